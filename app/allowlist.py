@@ -0,0 +1,83 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from dotenv import load_dotenv
+
+import redis.asyncio as aioredis
+
+import database
+import transcription
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+ALLOWLIST_CHANNEL = "whisper-bot:allowlist"
+RECONNECT_DELAY = 5
+CONNECT_TIMEOUT = 2
+
+# Идентификатор реплики, чтобы не применять повторно собственные изменения
+INSTANCE_ID = uuid.uuid4().hex
+
+_client: aioredis.Redis | None = None
+
+
+def _get_client() -> aioredis.Redis:
+    global _client
+    if _client is None:
+        # Без таймаута чтения: подписка ждёт сообщений сколько угодно долго
+        _client = aioredis.Redis(
+            host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=CONNECT_TIMEOUT
+        )
+    return _client
+
+
+async def publish_change(user_id: int, allowed: bool) -> None:
+    """Оповестить остальные реплики бота о добавлении/удалении пользователя."""
+    # Во встроенном режиме Redis нет и реплика одна (listen тоже не запускается)
+    if transcription.EXECUTION_MODE == "embedded":
+        return
+    message = json.dumps(
+        {"origin": INSTANCE_ID, "user_id": user_id, "allowed": allowed}
+    )
+    try:
+        await _get_client().publish(ALLOWLIST_CHANNEL, message)
+    except Exception as e:
+        logger.warning(f"Не удалось опубликовать изменение списка пользователей: {e}")
+
+
+async def listen(db_name: str) -> None:
+    """
+    Слушать изменения списка разрешённых пользователей от других реплик.
+    После каждой (пере)подписки кэш перечитывается из БД целиком,
+    чтобы не потерять изменения, пропущенные во время разрыва соединения.
+    """
+    while True:
+        try:
+            async with _get_client().pubsub() as pubsub:
+                await pubsub.subscribe(ALLOWLIST_CHANNEL)
+                await database.run(database.reload_allowed_users, db_name)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") == INSTANCE_ID:
+                        continue
+                    database.apply_allowlist_change(
+                        db_name, int(data["user_id"]), bool(data["allowed"])
+                    )
+                    logger.info(
+                        f"Получено изменение списка пользователей: {data['user_id']} -> {data['allowed']}"
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(
+                f"Подписка на изменения списка пользователей прервана: {e}. "
+                f"Повтор через {RECONNECT_DELAY} с."
+            )
+            await asyncio.sleep(RECONNECT_DELAY)
@@ -1,7 +1,10 @@
 import asyncio
+import io
 import logging
 import os
+import random
 import re
+import shutil
 import time
 import uuid
 from datetime import datetime
@@ -16,15 +19,20 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
-from huey.contrib.asyncio import aget_result
 
+import allowlist
+import bulk
 import database
 import llm
-from huey_tasks import transcribe_task
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+import metrics
+import profiling
+import retention
+import status_updates
+import tracing
+import transcription
+import user_state
+
+logging.basicConfig(format=tracing.LOG_FORMAT, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -36,8 +44,52 @@ if ADMIN_ID is not None:
     except Exception:
         ADMIN_ID = None
 DB_PATH = os.getenv("DB_PATH", "data/bot_database.db")
+TASK_WRITE_BATCH_SIZE = int(os.getenv("TASK_WRITE_BATCH_SIZE", "50"))
+TASK_WRITE_FLUSH_MS = int(os.getenv("TASK_WRITE_FLUSH_MS", "500"))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "5"))
+# "polling" — long polling (одна реплика), "webhook" — встроенный HTTP-сервер
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Собственный сервер Bot API (например, http://telegram-bot-api:8081); пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+# Локальный режим сервера Bot API: файлы не скачиваются, а читаются с диска сервера
+TELEGRAM_LOCAL_MODE = os.getenv("TELEGRAM_LOCAL_MODE", "0") == "1"
+# Соответствие путей на сервере Bot API путям в контейнерах бота и воркера:
+# "/var/lib/telegram-bot-api=/app/data/telegram-bot-api"
+TELEGRAM_LOCAL_PATH_MAP = os.getenv("TELEGRAM_LOCAL_PATH_MAP", "")
+# Публичный Bot API отдаёт файлы не больше 20 МБ, локальный сервер — до 2000 МБ
+MAX_FILE_SIZE_MB = int(
+    os.getenv("MAX_FILE_SIZE_MB", "2000" if TELEGRAM_LOCAL_MODE else "20")
+)
+# Режим "auto": язык не определяется, если из последних определений пользователя
+# не меньше LANGUAGE_AUTO_MIN_SAMPLES и доля самого частого языка не ниже
+# LANGUAGE_AUTO_CONFIDENCE. Доля LANGUAGE_AUTO_RECHECK_RATE запросов всё равно
+# проверяется, чтобы заметить смену языка.
+LANGUAGE_AUTO_MIN_SAMPLES = int(os.getenv("LANGUAGE_AUTO_MIN_SAMPLES", "5"))
+LANGUAGE_AUTO_CONFIDENCE = float(os.getenv("LANGUAGE_AUTO_CONFIDENCE", "0.9"))
+LANGUAGE_AUTO_RECHECK_RATE = float(os.getenv("LANGUAGE_AUTO_RECHECK_RATE", "0.05"))
+DEFAULT_LANGUAGE = "ru"
+LANGUAGE_LABELS = {"ru": "Русский", "en": "Английский", "auto": "Авто"}
 
 database.init_db(DB_PATH)
+task_writer = database.TaskMetadataWriter(
+    DB_PATH,
+    batch_size=TASK_WRITE_BATCH_SIZE,
+    flush_interval=TASK_WRITE_FLUSH_MS / 1000,
+)
+status_updater = status_updates.StatusUpdater()
+
+# Предел длины сообщения Telegram: более длинная расшифровка отправляется файлом
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Сколько последних символов распознанного текста показывать в статусе
+PROGRESS_TAIL_CHARS = 300
+
+
+def _local_file_path(server_path: str) -> str:
+    """Перевести путь файла на сервере Bot API в путь, видимый боту и воркеру."""
+    server_prefix, _, local_prefix = TELEGRAM_LOCAL_PATH_MAP.partition("=")
+    if server_prefix and server_path.startswith(server_prefix):
+        return local_prefix + server_path[len(server_prefix):]
+    return server_path
 
 
 def get_admin_keyboard() -> ReplyKeyboardMarkup:
@@ -55,15 +107,12 @@ def get_admin_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
 
 
-def get_language_keyboard(current_lang: str = "ru") -> ReplyKeyboardMarkup:
+def get_language_keyboard(current_lang: str = DEFAULT_LANGUAGE) -> ReplyKeyboardMarkup:
     """Получить клавиатуру для выбора языка с пометкой текущего языка."""
-    ru_label = "Русский"
-    en_label = "Английский"
-    if current_lang == "ru":
-        ru_label += " (выбран)"
-    elif current_lang == "en":
-        en_label += " (выбран)"
-    keyboard = [[KeyboardButton(ru_label)], [KeyboardButton(en_label)]]
+    keyboard = [
+        [KeyboardButton(f"{label} (выбран)" if lang == current_lang else label)]
+        for lang, label in LANGUAGE_LABELS.items()
+    ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 
@@ -132,9 +181,7 @@ async def add_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             )
         return
 
-    if not hasattr(context, "user_data") or context.user_data is None:
-        context.user_data = {}
-    context.user_data["admin_action"] = "add"
+    await user_state.set_state(user_id, "admin_action", "add")
 
     if update.message:
         await update.message.reply_text(
@@ -157,12 +204,10 @@ async def remove_user_command(
             )
         return
 
-    if not hasattr(context, "user_data") or context.user_data is None:
-        context.user_data = {}
-    context.user_data["admin_action"] = "remove"
+    await user_state.set_state(user_id, "admin_action", "remove")
 
     if not context.args:
-        users = database.get_all_users(DB_PATH)
+        users = await database.run(database.get_all_users, DB_PATH)
         if not users:
             if update.message:
                 await update.message.reply_text(
@@ -189,7 +234,8 @@ async def remove_user_command(
 
     try:
         user_to_remove_id = int(context.args[0])
-        database.remove_user(DB_PATH, user_to_remove_id)
+        await database.run(database.remove_user, DB_PATH, user_to_remove_id)
+        await allowlist.publish_change(user_to_remove_id, False)
         if update.message:
             await update.message.reply_text(
                 f"Пользователь с ID `{user_to_remove_id}` успешно удалён из списка разрешённых.",
@@ -223,7 +269,7 @@ async def list_users_command(
             )
         return
 
-    users = database.get_all_users(DB_PATH)
+    users = await database.run(database.get_all_users, DB_PATH)
     if not users:
         if update.message:
             await update.message.reply_text("Список разрешенных пользователей пуст.")
@@ -242,6 +288,13 @@ async def list_users_command(
         await update.message.reply_text(message_text, parse_mode="Markdown")
 
 
+def _format_rtf(rtf: float | None) -> str:
+    """RTF и пропускная способность в секундах аудио на секунду работы воркера."""
+    if not rtf:
+        return "нет данных"
+    return f"{rtf:.2f} ({1 / rtf:.1f}× реального времени)"
+
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /stats для отображения статистики бота."""
     user = update.effective_user
@@ -253,7 +306,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             )
         return
 
-    stats = database.get_bot_stats(DB_PATH)
+    stats = await database.run(database.get_bot_stats, DB_PATH)
     
     # Получаем текущую дату в формате DD.MM.YYYY
     today = datetime.now().strftime("%d.%m.%Y")
@@ -263,24 +316,352 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     message_text += f"📅 Сегодня ({today}):\n"
     message_text += f"   • Активных: {stats['today_active']}\n"
     message_text += f"   • Запросов на STT: {stats['today_requests']}\n"
-    message_text += f"   • Новых: {stats['today_new']}\n\n"
+    message_text += f"   • Новых: {stats['today_new']}\n"
+    message_text += f"   • RTF: {_format_rtf(stats['today_rtf'])}\n\n"
     message_text += "📈 За последние 7 дней:\n"
     message_text += f"   • Активных: {stats['week_active']}\n"
     message_text += f"   • Запросов на STT: {stats['week_requests']}\n"
-    message_text += f"   • Новых: {stats['week_new']}"
+    message_text += f"   • Новых: {stats['week_new']}\n"
+    message_text += f"   • Аудио: {stats['week_audio_seconds'] / 60:.1f} мин\n"
+    message_text += f"   • RTF: {_format_rtf(stats['week_rtf'])}"
+    for model_name, compute_type, count, rtf in stats["week_models"]:
+        message_text += (
+            f"\n      {model_name or '?'}/{compute_type or '?'}: "
+            f"{count} задач, RTF {_format_rtf(rtf)}"
+        )
+
+    if stats["slowest"]:
+        message_text += "\n\n🐢 Самые долгие запросы за 7 дней:"
+        for task_id, task_user_id, duration, audio_duration, model_name in stats["slowest"]:
+            audio = f"{audio_duration:.1f} с аудио" if audio_duration is not None else "аудио ?"
+            message_text += (
+                f"\n   • #{task_id} (user {task_user_id}): {duration:.1f} с, "
+                f"{audio}, {model_name or '?'}"
+            )
     
     if update.message:
         await update.message.reply_text(message_text)
 
 
+async def _send_search_page(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int
+) -> None:
+    """Отправить очередную страницу результатов поиска по сохранённому запросу."""
+    search_state = await user_state.get_state(user_id, "search") or {}
+    query = search_state.get("query")
+    if not query:
+        if update.message:
+            await update.message.reply_text(
+                "Укажите запрос: /search <текст для поиска>"
+            )
+        return
+
+    results, next_cursor = await database.run(
+        database.search_transcripts,
+        DB_PATH,
+        user_id,
+        query,
+        limit=SEARCH_PAGE_SIZE,
+        after=tuple(search_state["after"]) if search_state.get("after") else None,
+    )
+    await user_state.set_state(
+        user_id, "search", {"query": query, "after": list(next_cursor) if next_cursor else None}
+    )
+
+    if not results:
+        if update.message:
+            await update.message.reply_text(f"По запросу «{query}» ничего не найдено.")
+        return
+
+    message_text = f"🔎 Результаты по запросу «{query}»:\n\n"
+    for task_id, timestamp, snippet in results:
+        try:
+            date_str = datetime.fromisoformat(timestamp).strftime("%d.%m.%Y %H:%M")
+        except ValueError:
+            date_str = timestamp
+        message_text += f"#{task_id} — {date_str}\n{snippet}\n\n"
+    if next_cursor is not None:
+        message_text += "Показать ещё: /search_more\n"
+    message_text += "Полный текст: /transcript <номер>"
+    if update.message:
+        await update.message.reply_text(message_text.strip())
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /search для поиска по своим транскриптам."""
+    user = update.effective_user
+    user_id = user.id if user else None
+    if user_id is None or not database.is_user_allowed(DB_PATH, user_id):
+        if update.message:
+            await update.message.reply_text(
+                "Извини, у тебя нет доступа к этому боту. Пожалуйста, свяжись с администратором."
+            )
+        return
+
+    await user_state.set_state(
+        user_id, "search", {"query": " ".join(context.args or []).strip(), "after": None}
+    )
+    await _send_search_page(update, context, user_id)
+
+
+async def search_more_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /search_more для следующей страницы результатов поиска."""
+    user = update.effective_user
+    user_id = user.id if user else None
+    if user_id is None or not database.is_user_allowed(DB_PATH, user_id):
+        return
+
+    search_state = await user_state.get_state(user_id, "search") or {}
+    if search_state.get("query") and search_state.get("after") is None:
+        if update.message:
+            await update.message.reply_text("Больше результатов нет.")
+        return
+    await _send_search_page(update, context, user_id)
+
+
+async def transcript_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /transcript <id> для получения полного текста своей задачи."""
+    user = update.effective_user
+    user_id = user.id if user else None
+    if user_id is None or not database.is_user_allowed(DB_PATH, user_id):
+        return
+
+    try:
+        task_id = int((context.args or [""])[0].lstrip("#"))
+    except ValueError:
+        if update.message:
+            await update.message.reply_text("Укажите номер записи: /transcript <id>")
+        return
+
+    text = await database.run(
+        database.get_transcript, DB_PATH, retention.ARCHIVE_DB_PATH, user_id, task_id
+    )
+    if update.message:
+        await update.message.reply_text(text or f"Запись #{task_id} не найдена.")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /profile [N]: профилировать следующие N задач транскрибации."""
+    user = update.effective_user
+    user_id = user.id if user else None
+    if ADMIN_ID is None or user_id != ADMIN_ID:
+        if update.message:
+            await update.message.reply_text(
+                "Извини, эта команда доступна только администратору."
+            )
+        return
+
+    try:
+        count = int((context.args or ["1"])[0])
+    except ValueError:
+        if update.message:
+            await update.message.reply_text("Укажите число задач: /profile <N> (0 — отменить)")
+        return
+
+    if not await profiling.request_profiling(count):
+        reply = "Не удалось включить профилирование: Redis недоступен."
+    elif count > 0:
+        reply = f"Профилирую следующие {count} задач транскрибации. Результаты пришлю сюда."
+    else:
+        reply = "Профилирование отменено."
+    if update.message:
+        await update.message.reply_text(reply)
+
+
+async def bulk_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /bulk: следующий ZIP-архив администратора распознаётся целиком."""
+    user = update.effective_user
+    user_id = user.id if user else None
+    if ADMIN_ID is None or user_id != ADMIN_ID:
+        if update.message:
+            await update.message.reply_text(
+                "Извини, эта команда доступна только администратору."
+            )
+        return
+
+    await user_state.set_state(user_id, "admin_action", "bulk")
+    if update.message:
+        await update.message.reply_text(
+            "Отправьте ZIP-архив с голосовыми сообщениями, видео-кружками или аудиофайлами. "
+            "Файлы распознаются в фоне, расшифровки придут одним файлом в порядке архива."
+        )
+
+
+async def handle_bulk_archive(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик ZIP-архива, отправленного администратором после /bulk."""
+    user = update.effective_user
+    user_id = user.id if user else None
+    if not update.message:
+        return
+    if ADMIN_ID is None or user_id != ADMIN_ID:
+        await update.message.reply_text(
+            "Я могу обрабатывать голосовые сообщения, видео-кружки, аудио- и видеофайлы."
+        )
+        return
+    if await user_state.get_state(user_id, "admin_action") != "bulk":
+        await update.message.reply_text("Чтобы распознать архив, сначала отправьте /bulk.")
+        return
+    await user_state.set_state(user_id, "admin_action", None)
+    with tracing.span("bulk", user_id=user_id, message_id=update.message.message_id):
+        await _process_bulk(update, user_id)
+
+
+async def _process_bulk(update: Update, user_id: int) -> None:
+    document = update.message.document
+    file_size = document.file_size or 0
+    if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        await update.message.reply_text(
+            f"Архив слишком большой ({file_size / 1024 / 1024:.0f} МБ). "
+            f"Максимальный размер — {MAX_FILE_SIZE_MB} МБ."
+        )
+        return
+
+    status_message = await status_updater.send(
+        update.message.chat_id,
+        lambda: update.message.reply_text("Получил архив! Скачиваю..."),
+        priority=status_updates.PRIORITY_STATUS,
+    )
+    job_dir = os.path.join(bulk.BULK_DIR, uuid.uuid4().hex)
+    keep_job_dir = False
+    try:
+        with metrics.track_stage("download"), tracing.span(
+            "download", local_mode=TELEGRAM_LOCAL_MODE
+        ):
+            telegram_file = await document.get_file()
+            if TELEGRAM_LOCAL_MODE:
+                zip_path = _local_file_path(telegram_file.file_path)
+            else:
+                os.makedirs(job_dir, exist_ok=True)
+                zip_path = os.path.join(job_dir, "archive.zip")
+                await telegram_file.download_to_drive(zip_path)
+
+        status_updater.edit(status_message, "Архив скачан. Распаковываю...")
+        try:
+            items = await asyncio.get_running_loop().run_in_executor(
+                None, bulk.extract_archive, zip_path, job_dir
+            )
+        except bulk.ArchiveError as e:
+            status_updater.edit(status_message, f"Не удалось распаковать архив: {e}.")
+            return
+        if not TELEGRAM_LOCAL_MODE:
+            os.remove(zip_path)
+        if not items:
+            status_updater.edit(status_message, "В архиве нет аудио- или видеофайлов.")
+            return
+
+        total = len(items)
+        logger.info(f"Пакетная транскрибация: {total} файлов для пользователя {user_id}")
+        status_updater.edit(status_message, f"В архиве {total} файлов. Распознано 0 из {total}...")
+        # Ограничивает число файлов в очереди одновременно: остальные ставятся
+        # по мере готовности, и бот не опрашивает сотни результатов сразу
+        in_flight = asyncio.Semaphore(bulk.BULK_MAX_IN_FLIGHT)
+        completed = 0
+        # Один язык на весь архив: иначе проверка режима "auto" с вероятностью
+        # LANGUAGE_AUTO_RECHECK_RATE дала бы файлам разные языки
+        language = await _resolve_language(user_id)
+
+        async def transcribe_item(item: bulk.BulkItem) -> str | None:
+            nonlocal completed
+            async with in_flight:
+                start_time = time.time()
+                try:
+                    result = await transcription.transcribe(
+                        item.path,
+                        item.file_type,
+                        language,
+                        trace_context=tracing.inject_context(),
+                        background=True,
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка транскрибации файла архива {item.name}: {e}")
+                    result = None
+            completed += 1
+            status_updater.edit(status_message, f"Распознано {completed} из {total}...")
+            text = result.get("text") if isinstance(result, dict) else None
+            if text:
+                task_writer.add(user_id, time.time() - start_time, item.file_type, text, result)
+            return text
+
+        try:
+            texts = await asyncio.gather(*(transcribe_item(item) for item in items))
+        except asyncio.CancelledError:
+            # Задачи остаются в очереди Huey: файлы нужны воркеру до их завершения
+            keep_job_dir = transcription.EXECUTION_MODE != "embedded"
+            raise
+
+        recognized = sum(1 for text in texts if text)
+        transcript = bulk.format_transcript([(item.name, text) for item, text in zip(items, texts)])
+        with metrics.track_stage("reply"), tracing.span("reply"):
+            await status_updater.send(
+                update.message.chat_id,
+                lambda: update.message.reply_document(
+                    document=io.BytesIO(transcript.encode("utf-8")),
+                    filename=_transcript_filename(document),
+                    caption=f"Распознано {recognized} из {total} файлов.",
+                    reply_markup=get_admin_keyboard(),
+                ),
+            )
+        status_updater.edit(status_message, f"Готово: распознано {recognized} из {total} файлов.")
+    except asyncio.CancelledError:
+        logger.info(f"Пакетная транскрибация для пользователя {user_id} отменена.")
+        status_updater.edit(status_message, "Обработка архива отменена.")
+    except Exception:
+        logger.exception(f"Ошибка при обработке архива для пользователя {user_id}:")
+        status_updater.edit(
+            status_message,
+            "Произошла внутренняя ошибка при обработке архива. Пожалуйста, попробуй еще раз позже.",
+        )
+    finally:
+        if not keep_job_dir:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+
+async def _send_profile(context: ContextTypes.DEFAULT_TYPE, transcribe_result: dict) -> None:
+    """
+    Отправить администратору сводку и дамп профиля задачи. Вызывается после
+    ответа пользователю и идёт через status_updater с его лимитами чата.
+    """
+    profile = transcribe_result["profile"]
+    text = (
+        f"🔬 Профиль задачи ({transcribe_result.get('audio_duration', 0):.1f} с аудио, "
+        f"{transcribe_result.get('model')}/{transcribe_result.get('compute_type')})\n"
+        f"{profile['summary']}"
+    )
+    trace_id = tracing.current_trace_id()
+    if trace_id:
+        text += f"\nTrace: {trace_id}"
+    path = profile.get("path")
+
+    async def send_dump():
+        with open(path, "rb") as f:
+            return await context.bot.send_document(
+                chat_id=ADMIN_ID,
+                document=f,
+                filename=os.path.basename(path),
+                caption="Стеки в формате folded: flamegraph.pl, speedscope или inferno",
+            )
+
+    try:
+        await status_updater.send(
+            ADMIN_ID,
+            lambda: context.bot.send_message(chat_id=ADMIN_ID, text=text),
+            priority=status_updates.PRIORITY_STATUS,
+        )
+        if path and os.path.exists(path):
+            await status_updater.send(ADMIN_ID, send_dump, priority=status_updates.PRIORITY_STATUS)
+    except Exception as e:
+        logger.warning(f"Не удалось отправить профиль администратору: {e}")
+
+
 async def handle_language_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /language для выбора языка распознавания."""
-    current_lang = "ru"
-    if hasattr(context, "user_data") and context.user_data is not None:
-        current_lang = context.user_data.get("lang", "ru")
+    user = update.effective_user
+    current_lang = DEFAULT_LANGUAGE
+    if user:
+        current_lang = await _get_language_setting(user.id)
     if update.message:
         await update.message.reply_text(
-            f"Пожалуйста, выберите язык для распознавания (текущий: {'Русский' if current_lang == 'ru' else 'Английский'}):",
+            f"Пожалуйста, выберите язык для распознавания (текущий: {LANGUAGE_LABELS[current_lang]}):",
             reply_markup=get_language_keyboard(current_lang),
         )
 
@@ -290,35 +671,115 @@ async def handle_language_choice(update: Update, context: ContextTypes.DEFAULT_T
     if not update.message or not update.message.text:
         return
     text = update.message.text.strip().lower()
-    if not hasattr(context, "user_data") or context.user_data is None:
-        context.user_data = {}
     is_admin = False
     user = update.effective_user
     user_id = user.id if user else None
+    if user_id is None:
+        return
     if ADMIN_ID is not None and user_id == ADMIN_ID:
         is_admin = True
     if "англ" in text:
-        context.user_data["lang"] = "en"
+        await database.run(database.set_user_language, DB_PATH, user_id, "en")
         await update.message.reply_text(
             "Выбран английский язык. Теперь отправьте голосовое сообщение или видео-кружок.",
             reply_markup=get_admin_keyboard() if is_admin else get_user_keyboard(),
         )
     elif "рус" in text:
-        context.user_data["lang"] = "ru"
+        await database.run(database.set_user_language, DB_PATH, user_id, "ru")
         await update.message.reply_text(
             "Выбран русский язык. Теперь отправьте голосовое сообщение или видео-кружок.",
             reply_markup=get_admin_keyboard() if is_admin else get_user_keyboard(),
         )
+    elif "авто" in text:
+        await database.run(database.set_user_language, DB_PATH, user_id, "auto")
+        await update.message.reply_text(
+            "Язык будет определяться автоматически. Теперь отправьте голосовое сообщение или видео-кружок.",
+            reply_markup=get_admin_keyboard() if is_admin else get_user_keyboard(),
+        )
     else:
-        current_lang = context.user_data.get("lang", "ru")
+        current_lang = await _get_language_setting(user_id)
         await update.message.reply_text(
             "Пожалуйста, выберите язык с помощью кнопок ниже.",
             reply_markup=get_language_keyboard(current_lang),
         )
 
 
+async def _get_language_setting(user_id: int) -> str:
+    language = await database.run(database.get_user_language, DB_PATH, user_id)
+    return language if language in LANGUAGE_LABELS else DEFAULT_LANGUAGE
+
+
+async def _resolve_language(user_id: int) -> str | None:
+    """
+    Язык распознавания для запроса. В режиме "auto" — язык, на котором
+    пользователь уверенно говорит по статистике определений, иначе None:
+    воркер определит язык по началу аудио.
+    """
+    setting, stats = await database.run(database.get_language_profile, DB_PATH, user_id)
+    if setting != "auto":
+        return setting if setting in LANGUAGE_LABELS else DEFAULT_LANGUAGE
+    total = sum(stats.values())
+    if total < LANGUAGE_AUTO_MIN_SAMPLES or random.random() < LANGUAGE_AUTO_RECHECK_RATE:
+        return None
+    language, requests = max(stats.items(), key=lambda item: item[1])
+    return language if requests / total >= LANGUAGE_AUTO_CONFIDENCE else None
+
+
+def _extract_media(message) -> tuple[object | None, str]:
+    """Медиа сообщения и его тип для транскрибации; (None, "") — медиа не поддерживается."""
+    if message is None:
+        return None, ""
+    for file_type in ("voice", "video_note", "audio", "video"):
+        file_obj = getattr(message, file_type, None)
+        if file_obj:
+            return file_obj, file_type
+    document = getattr(message, "document", None)
+    mime_type = getattr(document, "mime_type", None) or ""
+    if document and mime_type.startswith(("audio/", "video/")):
+        return document, "document"
+    return None, ""
+
+
+def _format_time(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def _progress_text(progress: dict) -> str:
+    """Статус длинной транскрибации: распознанная часть записи и конец готового текста."""
+    done = _format_time(progress["offset"])
+    if progress.get("duration"):
+        percent = min(100, int(progress["offset"] / progress["duration"] * 100))
+        text = f"Распознано {done} из {_format_time(progress['duration'])} ({percent}%)..."
+    else:
+        text = f"Распознано {done}..."
+    tail = progress.get("text") or ""
+    if len(tail) > PROGRESS_TAIL_CHARS:
+        tail = "…" + tail[-PROGRESS_TAIL_CHARS:]
+    return f"{text}\n\n{tail}" if tail else text
+
+
+def _transcript_filename(file_obj) -> str:
+    name = getattr(file_obj, "file_name", None)
+    base = os.path.splitext(os.path.basename(name))[0] if name else "transcript"
+    return f"{base}.txt"
+
+
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик получения голосовых сообщений и видео-кружков."""
+    """Обработчик получения голосовых сообщений, видео-кружков, аудио- и видеофайлов."""
+    user = update.effective_user
+    # Корневой спан трассировки сообщения: его trace_id попадает во все логи
+    # бота и воркера, относящиеся к этому сообщению
+    with tracing.span(
+        "handle_media",
+        user_id=user.id if user else None,
+        message_id=update.message.message_id if update.message else None,
+    ):
+        await _process_media(update, context)
+
+
+async def _process_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     user_id = user.id if user else None
 
@@ -329,96 +790,108 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             )
         return
 
-    if not hasattr(context, "user_data") or context.user_data is None:
-        context.user_data = {}
-    language = context.user_data.get("lang", "ru")
-
-    file_obj = None
-    file_type: str = ""
-    msg = update.message
-    if msg:
-        if getattr(msg, "forward_origin", None):
-            if getattr(msg, "voice", None):
-                file_obj = msg.voice
-                file_type = "voice"
-            elif getattr(msg, "video_note", None):
-                file_obj = msg.video_note
-                file_type = "video_note"
-        else:
-            if getattr(msg, "voice", None):
-                file_obj = msg.voice
-                file_type = "voice"
-            elif getattr(msg, "video_note", None):
-                file_obj = msg.video_note
-                file_type = "video_note"
-
-    if file_obj is None or not file_type:
+    language = await _resolve_language(user_id)
+
+    file_obj, file_type = _extract_media(update.message)
+    if file_obj is None:
         if update.message:
             await update.message.reply_text(
-                "Я могу обрабатывать только голосовые сообщения и видео-кружки."
+                "Я могу обрабатывать голосовые сообщения, видео-кружки, аудио- и видеофайлы."
+            )
+        return
+    tracing.set_attributes(file_type=file_type, language=language)
+
+    file_size = getattr(file_obj, "file_size", None) or 0
+    if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        if update.message:
+            await update.message.reply_text(
+                f"Файл слишком большой ({file_size / 1024 / 1024:.0f} МБ). "
+                f"Максимальный размер — {MAX_FILE_SIZE_MB} МБ."
             )
         return
 
     status_message = None
     if update.message:
-        status_message = await update.message.reply_text(
-            "Получил медиа! Скачиваю файл..."
+        status_message = await status_updater.send(
+            update.message.chat_id,
+            lambda: update.message.reply_text("Получил медиа! Скачиваю файл..."),
+            priority=status_updates.PRIORITY_STATUS,
         )
 
     file_path = None
     start_time = time.time()
     try:
         logger.info(f"Начало скачивания файла для пользователя {user_id}")
-        unique_name = f"data/{uuid.uuid4().hex}_{file_type}.bin"
-        telegram_file = await file_obj.get_file()
-        await telegram_file.download_to_drive(unique_name)
-        file_path = unique_name
-        logger.info(f"Файл скачан: {file_path}")
+        with metrics.track_stage("download"), tracing.span(
+            "download", local_mode=TELEGRAM_LOCAL_MODE
+        ):
+            telegram_file = await file_obj.get_file()
+            if TELEGRAM_LOCAL_MODE:
+                # Файл уже лежит на диске сервера Bot API: передаём воркеру путь без копирования.
+                # file_path остаётся None, чтобы файл сервера не был удалён.
+                source_path = _local_file_path(telegram_file.file_path)
+            else:
+                file_path = f"data/{uuid.uuid4().hex}_{file_type}.bin"
+                await telegram_file.download_to_drive(file_path)
+                source_path = file_path
+        logger.info(f"Файл скачан: {source_path}")
 
-        if status_message:
-            await status_message.edit_text("Файл скачан. Запускаю транскрибацию...")
+        status_updater.edit(status_message, "Файл скачан. Запускаю транскрибацию...")
 
-        huey_task = transcribe_task(file_path, file_type, language)
         try:
-            transcribe_result = await aget_result(
-                huey_task, backoff=1.15, max_delay=1.0, preserve=False
-            )
-        except Exception as e:
-            logger.error(f"Ошибка ожидания результата huey: {e}")
-            if status_message:
-                await status_message.edit_text(
-                    "Ошибка при обработке очереди. Попробуйте позже."
+            with tracing.span("transcribe"):
+                transcribe_result = await transcription.transcribe(
+                    source_path,
+                    file_type,
+                    language,
+                    trace_context=tracing.inject_context(),
+                    keep_file=TELEGRAM_LOCAL_MODE,
+                    on_progress=lambda progress: status_updater.edit(
+                        status_message, _progress_text(progress)
+                    ),
                 )
+        except asyncio.CancelledError:
+            # Бот останавливается, а задача остаётся в очереди Huey:
+            # файл нужен воркеру до её завершения
+            if transcription.EXECUTION_MODE != "embedded":
+                file_path = None
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка ожидания результата транскрибации: {e}")
+            status_updater.edit(status_message, "Ошибка при обработке очереди. Попробуйте позже.")
             return
         duration = time.time() - start_time
 
-        if not transcribe_result or not isinstance(transcribe_result, (list, tuple)):
+        if not transcribe_result or not isinstance(transcribe_result, dict):
             if update.message:
-                await update.message.reply_text(
-                    "Не удалось распознать текст. Возможно, аудио было слишком коротким или нечетким."
+                await status_updater.send(
+                    update.message.chat_id,
+                    lambda: update.message.reply_text(
+                        "Не удалось распознать текст. Возможно, аудио было слишком коротким или нечетким."
+                    ),
                 )
             return
 
-        raw_text, lang = transcribe_result if len(transcribe_result) == 2 else (transcribe_result[0], None)
+        raw_text = transcribe_result.get("text")
 
         final_text = raw_text
-        if raw_text:
-            if status_message:
-                await status_message.edit_text(
-                    "Транскрибация завершена. Попытка исправить ошибки..."
-                )
-            corrected_text = await llm.correct_text_with_llm(raw_text)
+        # Длинные расшифровки (часовые записи) отправляются файлом без исправления LLM
+        send_as_file = bool(raw_text) and len(raw_text) + 2 > TELEGRAM_MESSAGE_LIMIT
+        if raw_text and not send_as_file:
+            status_updater.edit(
+                status_message,
+                "Транскрибация завершена. Попытка исправить ошибки...",
+            )
+            with metrics.track_stage("llm"), tracing.span("llm"):
+                corrected_text = await llm.correct_text_with_llm(raw_text)
             if corrected_text != raw_text:
                 final_text = corrected_text
-                if status_message:
-                    await status_message.edit_text(
-                        "Текст исправлен. Отправляю ответ..."
-                    )
+                status_updater.edit(status_message, "Текст исправлен. Отправляю ответ...")
             else:
-                if status_message:
-                    await status_message.edit_text(
-                        "Исправление текста не потребовалось или не удалось исправить. Отправляю ответ..."
-                    )
+                status_updater.edit(
+                    status_message,
+                    "Исправление текста не потребовалось или не удалось исправить. Отправляю ответ...",
+                )
 
         if final_text:
             if update.message:
@@ -427,15 +900,31 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 user_id = user.id if user else None
                 if ADMIN_ID is not None and user_id == ADMIN_ID:
                     is_admin = True
-                await update.message.reply_text(
-                    f"`{final_text}`",
-                    parse_mode="Markdown",
-                    reply_markup=get_admin_keyboard() if is_admin else get_user_keyboard(),
-                )
+                reply_markup = get_admin_keyboard() if is_admin else get_user_keyboard()
+                with metrics.track_stage("reply"), tracing.span("reply"):
+                    if send_as_file:
+                        status_updater.edit(status_message, "Транскрибация завершена. Отправляю файл...")
+                        await status_updater.send(
+                            update.message.chat_id,
+                            lambda: update.message.reply_document(
+                                document=io.BytesIO(final_text.encode("utf-8")),
+                                filename=_transcript_filename(file_obj),
+                                caption="Текст слишком длинный для сообщения, расшифровка в файле.",
+                                reply_markup=reply_markup,
+                            ),
+                        )
+                    else:
+                        await status_updater.send(
+                            update.message.chat_id,
+                            lambda: update.message.reply_text(
+                                f"`{final_text}`",
+                                parse_mode="Markdown",
+                                reply_markup=reply_markup,
+                            ),
+                        )
             if user_id is not None:
-                database.record_task_metadata(
-                    DB_PATH, user_id, duration, file_type, final_text
-                )
+                task_writer.add(user_id, duration, file_type, final_text, transcribe_result)
+            metrics.STAGE_LATENCY.labels(stage="total").observe(time.time() - start_time)
         else:
             if update.message:
                 is_admin = False
@@ -443,23 +932,29 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 user_id = user.id if user else None
                 if ADMIN_ID is not None and user_id == ADMIN_ID:
                     is_admin = True
-                await update.message.reply_text(
-                    "Не удалось распознать текст. Возможно, аудио было слишком коротким или нечетким.",
-                    reply_markup=get_admin_keyboard() if is_admin else get_user_keyboard(),
+                await status_updater.send(
+                    update.message.chat_id,
+                    lambda: update.message.reply_text(
+                        "Не удалось распознать текст. Возможно, аудио было слишком коротким или нечетким.",
+                        reply_markup=get_admin_keyboard() if is_admin else get_user_keyboard(),
+                    ),
                 )
 
+        # Профиль отправляется после ответа: пользователь не ждёт выгрузки дампа
+        if transcribe_result.get("profile") and ADMIN_ID is not None:
+            await _send_profile(context, transcribe_result)
+
     except asyncio.CancelledError:
         logger.info(f"Задача для пользователя {user_id} была отменена.")
-        if status_message:
-            await status_message.edit_text("Обработка отменена.")
+        status_updater.edit(status_message, "Обработка отменена.")
     except Exception:
         logger.exception(f"Ошибка при обработке медиа для пользователя {user_id}:")
-        if status_message:
-            await status_message.edit_text(
-                "Произошла внутренняя ошибка при обработке. Пожалуйста, попробуй еще раз позже."
-            )
+        status_updater.edit(
+            status_message,
+            "Произошла внутренняя ошибка при обработке. Пожалуйста, попробуй еще раз позже.",
+        )
     finally:
-        # Удаляем файл, если он еще существует (на случай ошибок до обработки в huey)
+        # Удаляем файл, если он еще существует (на случай ошибок до обработки воркером)
         if file_path and os.path.exists(file_path):
             try:
                 os.remove(file_path)
@@ -479,8 +974,7 @@ async def handle_admin_id_input(
     if not update.message or not update.message.text:
         return
     text = update.message.text.strip()
-    user_data = getattr(context, "user_data", {}) or {}
-    action = user_data.get("admin_action")
+    action = await user_state.get_state(user_id, "admin_action")
     if text.isdigit() and action:
         try:
             target_id = int(text)
@@ -494,7 +988,15 @@ async def handle_admin_id_input(
                     first_name = ""
                     last_name = ""
                     username = ""
-                database.add_user(DB_PATH, target_id, first_name=first_name, last_name=last_name, username=username)
+                await database.run(
+                    database.add_user,
+                    DB_PATH,
+                    target_id,
+                    first_name=first_name,
+                    last_name=last_name,
+                    username=username,
+                )
+                await allowlist.publish_change(target_id, True)
                 await update.message.reply_text(
                     f"Пользователь с ID `{target_id}` успешно добавлен в список разрешённых!",
                     parse_mode="Markdown",
@@ -513,21 +1015,20 @@ async def handle_admin_id_input(
                         f"Пользователь добавлен, но не удалось ему отправить сообщение {target_id}, возможно, он не начал диалог с ботом."
                     )
             elif action == "remove":
-                database.remove_user(DB_PATH, target_id)
+                await database.run(database.remove_user, DB_PATH, target_id)
+                await allowlist.publish_change(target_id, False)
                 await update.message.reply_text(
                     f"Пользователь с ID `{target_id}` успешно удалён из списка разрешённых.",
                     parse_mode="Markdown",
                     reply_markup=get_admin_keyboard(),
                 )
-            if hasattr(context, "user_data") and context.user_data is not None:
-                context.user_data["admin_action"] = None
+            await user_state.set_state(user_id, "admin_action", None)
         except Exception:
             await update.message.reply_text(
                 "Ошибка при обработке ID пользователя. Проверьте ID и попробуйте ещё раз.",
                 reply_markup=get_admin_keyboard(),
             )
-            if hasattr(context, "user_data") and context.user_data is not None:
-                context.user_data["admin_action"] = None
+            await user_state.set_state(user_id, "admin_action", None)
 
 
 def escape_md(text: str) -> str:
@@ -538,18 +1039,58 @@ def escape_md(text: str) -> str:
     return re.sub(r'([_\*\[\]()`])', r'\\\1', text)
 
 
+async def post_init(application: Application) -> None:
+    """Запустить фоновые задачи: запись задач, отправку статусов, синхронизацию пользователей, обслуживание БД."""
+    task_writer.start()
+    status_updater.start()
+    transcription.start()
+    application.bot_data["background_tasks"] = [
+        asyncio.create_task(retention.retention_loop(DB_PATH)),
+    ]
+    # Во встроенном режиме бот работает в одном экземпляре и без Redis
+    if transcription.EXECUTION_MODE != "embedded":
+        application.bot_data["background_tasks"].append(
+            asyncio.create_task(allowlist.listen(DB_PATH))
+        )
+
+
+async def post_shutdown(application: Application) -> None:
+    """Остановить фоновые задачи и закрыть соединения с БД при остановке бота."""
+    for background_task in application.bot_data.get("background_tasks", []):
+        background_task.cancel()
+    await status_updater.close()
+    transcription.shutdown()
+    await task_writer.close()
+    await database.run(database.close_db)
+
+
 def main() -> None:
     """Запуск бота."""
     if not TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN не установлен!")
         return
 
+    tracing.init_tracing("whisper-bot")
+
     admin_id_int = int(ADMIN_ID) if ADMIN_ID is not None else None
     if admin_id_int is not None and not database.is_user_allowed(DB_PATH, admin_id_int):
         logger.info(f"Добавление администратора {admin_id_int} в базу при первом запуске.")
         database.add_user(DB_PATH, admin_id_int, is_admin=True)
 
-    application = Application.builder().token(TOKEN).concurrent_updates(True).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = (
+            builder.base_url(f"{TELEGRAM_API_URL}/bot")
+            .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+            .local_mode(TELEGRAM_LOCAL_MODE)
+        )
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("admin_menu", admin_menu_command))
@@ -557,6 +1098,11 @@ def main() -> None:
     application.add_handler(CommandHandler("remove_user", remove_user_command))
     application.add_handler(CommandHandler("list_users", list_users_command))
     application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("search_more", search_more_command))
+    application.add_handler(CommandHandler("transcript", transcript_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("bulk", bulk_command))
 
     application.add_handler(
         MessageHandler(
@@ -578,7 +1124,20 @@ def main() -> None:
     )
 
     application.add_handler(
-        MessageHandler(filters.VOICE | filters.VIDEO_NOTE, handle_media)
+        MessageHandler(
+            filters.VOICE
+            | filters.VIDEO_NOTE
+            | filters.AUDIO
+            | filters.VIDEO
+            | filters.Document.AUDIO
+            | filters.Document.VIDEO,
+            handle_media,
+        )
+    )
+    application.add_handler(
+        MessageHandler(
+            filters.Document.ZIP | filters.Document.FileExtension("zip"), handle_bulk_archive
+        )
     )
 
     application.add_handler(
@@ -587,11 +1146,20 @@ def main() -> None:
         )
     )
     application.add_handler(
-        MessageHandler(filters.TEXT & filters.Regex("^(Русский|Английский)"), handle_language_choice)
+        MessageHandler(filters.TEXT & filters.Regex("^(Русский|Английский|Авто)"), handle_language_choice)
+    )
+
+    metrics.start_metrics_server(
+        (metrics.QueueDepthCollector(transcription.pending_count),)
     )
 
     logger.info("Бот запущен! 🤖")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook":
+        import webhook
+
+        asyncio.run(webhook.serve(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
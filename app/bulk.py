@@ -0,0 +1,115 @@
+import logging
+import os
+import stat
+import zipfile
+import zlib
+
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Каталог распакованных архивов: должен быть общим с воркером, как data/
+BULK_DIR = os.getenv("BULK_DIR", "data/bulk")
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "500"))
+# Предел суммарного размера распакованных файлов (защита от zip-бомб), МБ
+BULK_MAX_UNPACKED_MB = int(os.getenv("BULK_MAX_UNPACKED_MB", "4000"))
+# Сколько файлов архива одновременно стоят в очереди и ждут результата
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "16"))
+
+AUDIO_EXTENSIONS = {".ogg", ".oga", ".opus", ".mp3", ".m4a", ".wav", ".flac", ".aac", ".wma"}
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".webm", ".mkv", ".avi", ".m4v"}
+
+_CHUNK_SIZE = 1024 * 1024
+# Бит 11 general purpose flag: имя файла в UTF-8
+_UTF8_FLAG = 0x800
+
+
+class ArchiveError(Exception):
+    """Архив нельзя обработать: он повреждён, зашифрован или превышает пределы."""
+
+
+@dataclass
+class BulkItem:
+    # Путь внутри архива: заголовок расшифровки в итоговом файле
+    name: str
+    # Распакованный файл в каталоге задачи
+    path: str
+    file_type: str
+
+
+def _display_name(info: zipfile.ZipInfo) -> str:
+    # Архиваторы без флага UTF-8 часто всё равно пишут имена в UTF-8, а zipfile
+    # читает их как cp437
+    if info.flag_bits & _UTF8_FLAG:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("utf-8")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _media_type(name: str) -> str | None:
+    if name.startswith("__MACOSX/") or os.path.basename(name).startswith("._"):
+        return None
+    extension = os.path.splitext(name)[1].lower()
+    if extension in AUDIO_EXTENSIONS:
+        return "audio"
+    if extension in VIDEO_EXTENSIONS:
+        return "video"
+    return None
+
+
+def extract_archive(zip_path: str, dest_dir: str) -> list[BulkItem]:
+    """
+    Распаковать медиафайлы ZIP-архива в dest_dir в порядке следования в архиве;
+    остальные файлы пропускаются. Имена на диске генерируются (номер и
+    расширение), поэтому пути из архива (../, абсолютные, симлинки) не выходят
+    за пределы dest_dir. Суммарный размер проверяется по фактически записанным
+    байтам, а не по заголовкам архива.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    limit = BULK_MAX_UNPACKED_MB * 1024 * 1024
+    written = 0
+    items: list[BulkItem] = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or stat.S_ISLNK(info.external_attr >> 16):
+                    continue
+                name = _display_name(info)
+                file_type = _media_type(name)
+                if file_type is None:
+                    continue
+                if len(items) >= BULK_MAX_FILES:
+                    raise ArchiveError(f"в архиве больше {BULK_MAX_FILES} медиафайлов")
+                if info.flag_bits & 0x1:
+                    raise ArchiveError("зашифрованные архивы не поддерживаются")
+                extension = os.path.splitext(name)[1].lower()
+                path = os.path.join(dest_dir, f"{len(items):05d}{extension}")
+                with archive.open(info) as src, open(path, "wb") as dst:
+                    while chunk := src.read(_CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > limit:
+                            raise ArchiveError(
+                                f"распакованные файлы больше {BULK_MAX_UNPACKED_MB} МБ"
+                            )
+                        dst.write(chunk)
+                items.append(BulkItem(name, path, file_type))
+    except NotImplementedError as e:
+        raise ArchiveError(f"метод сжатия не поддерживается ({e})") from e
+    # zlib.error — повреждённые сжатые данные внутри файла архива
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, EOFError, zlib.error) as e:
+        raise ArchiveError(f"архив повреждён ({e})") from e
+    logger.info(f"Из архива {zip_path} распаковано {len(items)} медиафайлов ({written} байт)")
+    return items
+
+
+def format_transcript(entries: list[tuple[str, str | None]]) -> str:
+    """Итоговый файл: расшифровки в порядке файлов архива, с именем файла в заголовке."""
+    parts = []
+    for name, text in entries:
+        parts.append(f"=== {name} ===\n{text or '[не удалось распознать]'}\n")
+    return "\n".join(parts)
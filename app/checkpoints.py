@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "data/checkpoints")
+# Как часто (по времени) сохранять распознанные сегменты, с
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL_SECONDS", "5"))
+# Задача считается брошенной, если её файл не обновлялся дольше этого времени, с
+CHECKPOINT_STALE_SECONDS = float(os.getenv("CHECKPOINT_STALE_SECONDS", "120"))
+HEARTBEAT_INTERVAL = CHECKPOINT_STALE_SECONDS / 4
+# Подкаталог контрольных точек встроенного режима: recover() его не просматривает
+EMBEDDED_SUBDIR = "embedded"
+
+
+def _path(job_id: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{job_id}.json")
+
+
+def embedded_job_id() -> str:
+    """
+    Идентификатор задачи встроенного пула. Её контрольная точка нужна только для
+    промежуточного результата: воркер Huey с общим data/ не должен ставить её в
+    очередь как брошенную.
+    """
+    return f"{EMBEDDED_SUBDIR}/{uuid.uuid4().hex}"
+
+
+def clear_embedded() -> None:
+    """Удалить контрольные точки встроенного пула, оставшиеся после падения бота."""
+    shutil.rmtree(os.path.join(CHECKPOINT_DIR, EMBEDDED_SUBDIR), ignore_errors=True)
+
+
+def _write(path: str, data: dict) -> None:
+    """Записать файл атомарно: читатель видит либо старую, либо новую версию."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """
+    Прогресс одной задачи транскрибации: параметры задачи (чтобы её можно было
+    поставить в очередь заново), готовые сегменты и, после завершения, результат.
+    Файл удаляется только после того, как Huey сохранил результат задачи.
+    """
+
+    def __init__(self, job_id: str, data: dict):
+        self.job_id = job_id
+        self.path = _path(job_id)
+        self.data = data
+        self._saved_at = time.monotonic()
+
+    @property
+    def segments(self) -> list[list]:
+        return self.data.setdefault("segments", [])
+
+    @property
+    def offset(self) -> float:
+        """Конец последнего готового сегмента: с этого места продолжается распознавание."""
+        return self.segments[-1][1] if self.segments else 0.0
+
+    @property
+    def result(self) -> dict | None:
+        return self.data.get("result")
+
+    def save(self) -> None:
+        try:
+            _write(self.path, self.data)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить контрольную точку {self.path}: {e}")
+        self._saved_at = time.monotonic()
+
+    def add_segment(self, start: float, end: float, text: str, inference_seconds: float) -> None:
+        self.segments.append([round(start, 3), round(end, 3), text])
+        self.data["inference_seconds"] = inference_seconds
+        if time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def finish(self, result: dict) -> None:
+        """Сохранить результат до удаления исходного файла."""
+        self.data["result"] = result
+        self.save()
+
+
+def _heartbeat(path: str, stop: threading.Event) -> None:
+    # Обновляем mtime, пока задача выполняется (в том числе во время
+    # декодирования, когда новых сегментов нет)
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def track(job_id: str | None, job: dict) -> Iterator[Checkpoint | None]:
+    """
+    Открыть контрольную точку задачи: продолжить сохранённую или создать новую.
+    Без job_id контрольные точки не ведутся.
+    """
+    if job_id is None:
+        yield None
+        return
+    os.makedirs(os.path.dirname(_path(job_id)), exist_ok=True)
+    checkpoint = None
+    try:
+        with open(_path(job_id), encoding="utf-8") as f:
+            checkpoint = Checkpoint(job_id, json.load(f))
+        logger.info(
+            f"Задача {job_id} продолжается с {checkpoint.offset:.1f} с "
+            f"({len(checkpoint.segments)} готовых сегментов)"
+        )
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Контрольная точка {job_id} повреждена, задача начинается заново: {e}")
+    if checkpoint is None:
+        checkpoint = Checkpoint(job_id, {"job": job, "segments": []})
+    checkpoint.save()
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(checkpoint.path, stop), name="checkpoint-heartbeat", daemon=True
+    )
+    heartbeat.start()
+    try:
+        yield checkpoint
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def progress(job_id: str) -> dict | None:
+    """
+    Промежуточный результат задачи для бота: распознанная часть аудио (с),
+    длительность файла (с, если известна) и готовый текст. None — задача ещё
+    не начата или контрольная точка не читается.
+    """
+    try:
+        with open(_path(job_id), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    segments = data.get("segments") or []
+    return {
+        "offset": segments[-1][1] if segments else 0.0,
+        "duration": data.get("duration"),
+        "text": " ".join(segment[2] for segment in segments).strip(),
+    }
+
+
+def remove(job_id: str) -> None:
+    """Подтвердить завершение задачи: результат сохранён, контрольная точка не нужна."""
+    try:
+        os.remove(_path(job_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить контрольную точку {job_id}: {e}")
+
+
+def recover(enqueue: Callable[[str, dict], None]) -> int:
+    """
+    Поставить в очередь заново задачи, воркер которых перестал обновлять
+    контрольную точку (упал или был перезапущен). Несколько воркеров могут
+    проверять каталог одновременно: задачу забирает тот, кто первым
+    переименовал её файл.
+    """
+    try:
+        names = os.listdir(CHECKPOINT_DIR)
+    except FileNotFoundError:
+        return 0
+    recovered = 0
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        job_id = name[: -len(".json")]
+        path = _path(job_id)
+        claimed_path = f"{path}.{uuid.uuid4().hex}.claim"
+        # Живые задачи не переименовываются: иначе их сохранение или удаление
+        # после завершения попадёт в окно, пока файл переименован
+        try:
+            if time.time() - os.stat(path).st_mtime < CHECKPOINT_STALE_SECONDS:
+                continue
+            os.rename(path, claimed_path)
+        except OSError:
+            continue
+        try:
+            # Файл мог обновиться между проверкой и переименованием
+            if time.time() - os.path.getmtime(claimed_path) < CHECKPOINT_STALE_SECONDS:
+                continue
+            with open(claimed_path, encoding="utf-8") as f:
+                job = json.load(f)["job"]
+            # Свежий mtime: остальные воркеры не заберут задачу повторно
+            os.utime(claimed_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Контрольная точка {job_id} не читается и будет удалена: {e}")
+            os.remove(claimed_path)
+            continue
+        finally:
+            if os.path.exists(claimed_path):
+                os.rename(claimed_path, path)
+        enqueue(job_id, job)
+        recovered += 1
+        logger.warning(f"Задача {job_id} брошена воркером и поставлена в очередь заново")
+    return recovered
@@ -1,75 +1,391 @@
+import asyncio
+import functools
 import logging
 import os
+import re
 import sqlite3
+import threading
+import zlib
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from typing import Any, Callable, Iterator, TypeVar
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Все запросы из асинхронного кода выполняются в одном выделенном потоке,
+# поэтому одно долгоживущее соединение на файл БД не блокирует event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+_connections: dict[str, sqlite3.Connection] = {}
+_lock = threading.RLock()
+# Кэш списка разрешённых пользователей: проверка доступа без обращения к диску
+_allowed_users: dict[str, set[int]] = {}
+
+
+# Показатели транскрибации, которые воркер возвращает вместе с текстом:
+# ключ результата -> (колонка tasks, тип)
+TASK_STATS_COLUMNS = {
+    "audio_duration": ("audio_duration_seconds", "REAL"),
+    "decode_seconds": ("decode_seconds", "REAL"),
+    "inference_seconds": ("inference_seconds", "REAL"),
+    "model": ("whisper_model", "TEXT"),
+    "compute_type": ("compute_type", "TEXT"),
+    "beam_size": ("beam_size", "INTEGER"),
+    "cpu_threads": ("cpu_threads", "INTEGER"),
+    "language": ("language", "TEXT"),
+}
+# Сколько самых долгих задач за день хранится для /stats
+SLOWEST_TASKS_PER_DAY = 5
+
+
+def _sql_decompress_text(data: bytes | None) -> str | None:
+    return decompress_text(data) if data is not None else None
+
+
+def _get_connection(db_name: str) -> sqlite3.Connection:
+    """Получить долгоживущее соединение к БД (создаётся один раз на файл)."""
+    conn = _connections.get(db_name)
+    if conn is None:
+        conn = sqlite3.connect(db_name, check_same_thread=False, timeout=30)
+        # Для новых БД включает постепенное освобождение места; для существующих
+        # вступает в силу только после `python database.py vacuum`
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA mmap_size=134217728")
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Нужна представлению tasks_search и триггерам полнотекстового индекса
+        conn.create_function("decompress_text", 1, _sql_decompress_text, deterministic=True)
+        _connections[db_name] = conn
+    return conn
+
+
+@contextmanager
+def _transaction(db_name: str) -> Iterator[sqlite3.Cursor]:
+    """Курсор в рамках транзакции: commit при успехе, rollback при ошибке."""
+    with _lock:
+        conn = _get_connection(db_name)
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Выполнить функцию модуля в потоке БД, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def close_db() -> None:
+    """Закрыть все открытые соединения (при остановке процесса)."""
+    with _lock:
+        for db_name, conn in list(_connections.items()):
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка при закрытии БД '{db_name}': {e}")
+        _connections.clear()
+
 
 def init_db(db_name: str) -> None:
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
+        with _transaction(db_name) as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    is_admin BOOLEAN DEFAULT FALSE
+                )
+                """
+            )
+            cursor.execute("PRAGMA table_info(users)")
+            existing_cols = {row[1] for row in cursor.fetchall()}
+            for col, coltype in [
+                ("first_name", "TEXT"),
+                ("last_name", "TEXT"),
+                ("username", "TEXT"),
+                # Выбранный язык распознавания: код языка или "auto"; NULL — по умолчанию
+                ("language", "TEXT"),
+            ]:
+                if col not in existing_cols:
+                    try:
+                        cursor.execute(f"ALTER TABLE users ADD COLUMN {col} {coltype}")
+                    except sqlite3.OperationalError as e:
+                        logger.warning(f"Ошибка миграции users: {e}")
 
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                is_admin BOOLEAN DEFAULT FALSE
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    duration_seconds REAL,
+                    original_file_type TEXT,
+                    recognized_text TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+                """
+            )
+            cursor.execute("PRAGMA table_info(tasks)")
+            existing_cols = {row[1] for row in cursor.fetchall()}
+            for col, coltype in [
+                ("compressed_text", "BLOB"),
+                *TASK_STATS_COLUMNS.values(),
+            ]:
+                if col not in existing_cols:
+                    try:
+                        cursor.execute(f"ALTER TABLE tasks ADD COLUMN {col} {coltype}")
+                    except sqlite3.OperationalError as e:
+                        logger.warning(f"Ошибка миграции tasks: {e}")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_timestamp ON tasks (timestamp)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_user_timestamp ON tasks (user_id, timestamp)"
             )
-            """
-        )
-        cursor.execute("PRAGMA table_info(users)")
-        existing_cols = {row[1] for row in cursor.fetchall()}
-        for col, coltype in [
-            ("first_name", "TEXT"),
-            ("last_name", "TEXT"),
-            ("username", "TEXT")
-        ]:
-            if col not in existing_cols:
-                try:
-                    cursor.execute(f"ALTER TABLE users ADD COLUMN {col} {coltype}")
-                except sqlite3.OperationalError as e:
-                    logger.warning(f"Ошибка миграции users: {e}")
-
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tasks (
-                task_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp TEXT NOT NULL,
-                duration_seconds REAL,
-                original_file_type TEXT,
-                recognized_text TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            """
-        )
-        conn.commit()
 
-        admin_id_str = os.getenv("ADMIN_ID")
-        if admin_id_str:
-            admin_id = int(admin_id_str)
-            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (admin_id,))
-            if cursor.fetchone() is None:
-                cursor.execute(
-                    "INSERT INTO users (user_id, is_admin) VALUES (?, ?)",
-                    (admin_id, True),
+            _create_search_index(cursor)
+
+            # Агрегаты для /stats, обновляются вместе с записью задач
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_user_activity (
+                    day TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    audio_seconds REAL NOT NULL DEFAULT 0,
+                    compute_seconds REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, user_id)
+                ) WITHOUT ROWID
+                """
+            )
+            cursor.execute("PRAGMA table_info(daily_user_activity)")
+            existing_cols = {row[1] for row in cursor.fetchall()}
+            for col, coltype in [
+                ("audio_seconds", "REAL NOT NULL DEFAULT 0"),
+                ("compute_seconds", "REAL NOT NULL DEFAULT 0"),
+            ]:
+                if col not in existing_cols:
+                    try:
+                        cursor.execute(
+                            f"ALTER TABLE daily_user_activity ADD COLUMN {col} {coltype}"
+                        )
+                    except sqlite3.OperationalError as e:
+                        logger.warning(f"Ошибка миграции daily_user_activity: {e}")
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_first_seen (
+                    user_id INTEGER PRIMARY KEY,
+                    first_day TEXT NOT NULL
                 )
-                conn.commit()
-                logger.info(f"Администратор с ID {admin_id} добавлен в базу данных.")
-        else:
-            logger.warning(
-                "Переменная окружения ADMIN_ID не установлена. Администратор не будет добавлен автоматически."
+                """
             )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_user_first_seen_day ON user_first_seen (first_day)"
+            )
+            # Разбивка по моделям и самые долгие задачи за день: /stats не читает задачи
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_model_stats (
+                    day TEXT NOT NULL,
+                    whisper_model TEXT NOT NULL,
+                    compute_type TEXT NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    audio_seconds REAL NOT NULL DEFAULT 0,
+                    compute_seconds REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, whisper_model, compute_type)
+                ) WITHOUT ROWID
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_slowest_tasks (
+                    day TEXT NOT NULL,
+                    task_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    duration_seconds REAL NOT NULL,
+                    audio_duration_seconds REAL,
+                    whisper_model TEXT,
+                    PRIMARY KEY (day, task_id)
+                ) WITHOUT ROWID
+                """
+            )
+            # Языки, определённые автоматически в запросах пользователя: по ним
+            # режим "auto" перестаёт определять язык, если пользователь говорит на одном
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_language_stats (
+                    user_id INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, language)
+                ) WITHOUT ROWID
+                """
+            )
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM user_first_seen) "
+                "AND EXISTS (SELECT 1 FROM daily_slowest_tasks)"
+            )
+            has_rollups = cursor.fetchone()[0]
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM tasks)")
+            if cursor.fetchone()[0] and not has_rollups:
+                logger.warning(
+                    "Агрегаты статистики пусты, хотя задачи есть. "
+                    "Запустите `python database.py backfill-stats`."
+                )
 
-        conn.close()
-        logger.info(f"База данных '{db_name}' успешно инициализирована.")
+            admin_id_str = os.getenv("ADMIN_ID")
+            if admin_id_str:
+                admin_id = int(admin_id_str)
+                cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (admin_id,))
+                if cursor.fetchone() is None:
+                    cursor.execute(
+                        "INSERT INTO users (user_id, is_admin) VALUES (?, ?)",
+                        (admin_id, True),
+                    )
+                    logger.info(f"Администратор с ID {admin_id} добавлен в базу данных.")
+            else:
+                logger.warning(
+                    "Переменная окружения ADMIN_ID не установлена. Администратор не будет добавлен автоматически."
+                )
+
+            _load_allowed_users(cursor, db_name)
+
+            logger.info(f"База данных '{db_name}' успешно инициализирована.")
     except sqlite3.Error as e:
         logger.error(f"Ошибка инициализации базы данных: {e}")
 
 
+def _create_search_index(cursor: sqlite3.Cursor) -> None:
+    """
+    Создать полнотекстовый индекс FTS5 по текстам задач и триггеры синхронизации.
+    Содержимое индекс читает из представления tasks_search, которое распаковывает
+    сжатые тексты, поэтому сжатие не убирает задачу из поиска. Колонка owner
+    ("u<user_id>") ограничивает поиск задачами пользователя внутри индекса.
+    """
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'"
+    )
+    row = cursor.fetchone()
+    index_exists = row is not None
+    if index_exists and "owner" not in row[0]:
+        # Индекс прежней схемы: без колонки владельца (и, в ранних версиях,
+        # с текстом прямо из tasks, без сжатых задач)
+        for trigger in ("tasks_fts_insert", "tasks_fts_delete", "tasks_fts_update"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute("DROP TABLE tasks_fts")
+        cursor.execute("DROP VIEW IF EXISTS tasks_search")
+        index_exists = False
+    cursor.execute(
+        """
+        CREATE VIEW IF NOT EXISTS tasks_search AS
+        SELECT task_id,
+               COALESCE(recognized_text, decompress_text(compressed_text)) AS recognized_text,
+               'u' || user_id AS owner
+        FROM tasks
+        """
+    )
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            recognized_text,
+            owner,
+            content='tasks_search',
+            content_rowid='task_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, recognized_text, owner)
+            VALUES (
+                new.task_id,
+                COALESCE(new.recognized_text, decompress_text(new.compressed_text)),
+                'u' || new.user_id
+            );
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, recognized_text, owner)
+            VALUES (
+                'delete',
+                old.task_id,
+                COALESCE(old.recognized_text, decompress_text(old.compressed_text)),
+                'u' || old.user_id
+            );
+        END
+        """
+    )
+    # Сжатие (recognized_text -> NULL) текст не меняет, и индекс остаётся прежним
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF recognized_text ON tasks
+        WHEN new.recognized_text IS NOT NULL BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, recognized_text, owner)
+            VALUES (
+                'delete',
+                old.task_id,
+                COALESCE(old.recognized_text, decompress_text(old.compressed_text)),
+                'u' || old.user_id
+            );
+            INSERT INTO tasks_fts (rowid, recognized_text, owner)
+            VALUES (new.task_id, new.recognized_text, 'u' || new.user_id);
+        END
+        """
+    )
+    if not index_exists:
+        # Индекс создан впервые: проиндексировать уже накопленную историю
+        cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+        logger.info("Полнотекстовый индекс по истории задач построен.")
+
+
+def _load_allowed_users(cursor: sqlite3.Cursor, db_name: str) -> None:
+    cursor.execute("SELECT user_id FROM users")
+    _allowed_users[db_name] = {row[0] for row in cursor.fetchall()}
+
+
+def reload_allowed_users(db_name: str) -> None:
+    """Перечитать список разрешённых пользователей из БД в кэш."""
+    try:
+        with _transaction(db_name) as cursor:
+            _load_allowed_users(cursor, db_name)
+        logger.info(
+            f"Кэш разрешённых пользователей обновлён: {len(_allowed_users[db_name])} записей."
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при загрузке списка разрешённых пользователей: {e}")
+
+
+def apply_allowlist_change(db_name: str, user_id: int, allowed: bool) -> None:
+    """Применить к кэшу изменение, сделанное другой репликой бота."""
+    users = _allowed_users.get(db_name)
+    if users is None:
+        return
+    if allowed:
+        users.add(user_id)
+    else:
+        users.discard(user_id)
+
+
 def add_user(
     db_name: str,
     user_id: int,
@@ -79,14 +395,12 @@ def add_user(
     username: str = "",
 ) -> None:
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO users (user_id, is_admin, first_name, last_name, username) VALUES (?, ?, ?, ?, ?)",
-            (user_id, is_admin, first_name, last_name, username),
-        )
-        conn.commit()
-        conn.close()
+        with _transaction(db_name) as cursor:
+            cursor.execute(
+                "INSERT OR REPLACE INTO users (user_id, is_admin, first_name, last_name, username) VALUES (?, ?, ?, ?, ?)",
+                (user_id, is_admin, first_name, last_name, username),
+            )
+        apply_allowlist_change(db_name, user_id, True)
         logger.info(f"Пользователь {user_id} добавлен/обновлен в БД.")
     except sqlite3.Error as e:
         logger.error(f"Ошибка при добавлении пользователя {user_id}: {e}")
@@ -94,24 +408,23 @@ def add_user(
 
 def remove_user(db_name: str, user_id: int) -> None:
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+        with _transaction(db_name) as cursor:
+            cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        apply_allowlist_change(db_name, user_id, False)
         logger.info(f"Пользователь {user_id} удален из БД.")
     except sqlite3.Error as e:
         logger.error(f"Ошибка при удалении пользователя {user_id}: {e}")
 
 
 def is_user_allowed(db_name: str, user_id: int) -> bool:
+    users = _allowed_users.get(db_name)
+    if users is not None:
+        return user_id in users
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
+        with _transaction(db_name) as cursor:
+            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
+            return result is not None
     except sqlite3.Error as e:
         logger.error(f"Ошибка при проверке доступа пользователя {user_id}: {e}")
         return False
@@ -119,42 +432,404 @@ def is_user_allowed(db_name: str, user_id: int) -> bool:
 
 def get_all_users(db_name: str) -> list[tuple[int, bool, str, str, str]]:
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_id, is_admin, first_name, last_name, username FROM users")
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        with _transaction(db_name) as cursor:
+            cursor.execute("SELECT user_id, is_admin, first_name, last_name, username FROM users")
+            users = cursor.fetchall()
+            return users
     except sqlite3.Error as e:
         logger.error(f"Ошибка при получении списка пользователей: {e}")
         return []
 
 
+def get_user_language(db_name: str, user_id: int) -> str | None:
+    """Выбранный пользователем язык распознавания (None — не выбран)."""
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute("SELECT language FROM users WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при чтении языка пользователя {user_id}: {e}")
+        return None
+
+
+def set_user_language(db_name: str, user_id: int, language: str) -> None:
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute(
+                "UPDATE users SET language = ? WHERE user_id = ?", (language, user_id)
+            )
+        logger.info(f"Язык пользователя {user_id}: {language}")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении языка пользователя {user_id}: {e}")
+
+
+def get_language_profile(db_name: str, user_id: int) -> tuple[str | None, dict[str, int]]:
+    """
+    Выбранный язык пользователя и, если выбран "auto", статистика определённых
+    языков — одним обращением к БД на каждый запрос распознавания.
+    """
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute("SELECT language FROM users WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            language = row[0] if row else None
+            if language != "auto":
+                return language, {}
+            cursor.execute(
+                "SELECT language, requests FROM user_language_stats WHERE user_id = ?",
+                (user_id,),
+            )
+            return language, dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при чтении языка пользователя {user_id}: {e}")
+        return None, {}
+
+
+def _compute_seconds(record: dict) -> float:
+    """Время воркера на задачу: декодирование плюс инференс."""
+    return (record.get("decode_seconds") or 0.0) + (record.get("inference_seconds") or 0.0)
+
+
+def _update_stats(cursor: sqlite3.Cursor, records: list[dict]) -> None:
+    # RTF считается только по задачам, для которых известна длительность аудио
+    cursor.executemany(
+        """
+        INSERT INTO daily_user_activity (day, user_id, requests, audio_seconds, compute_seconds)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT (day, user_id) DO UPDATE SET
+            requests = requests + 1,
+            audio_seconds = audio_seconds + excluded.audio_seconds,
+            compute_seconds = compute_seconds + excluded.compute_seconds
+        """,
+        [
+            (
+                record["timestamp"][:10],
+                record["user_id"],
+                record.get("audio_duration_seconds") or 0.0,
+                _compute_seconds(record) if record.get("audio_duration_seconds") else 0.0,
+            )
+            for record in records
+        ],
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO user_first_seen (user_id, first_day) VALUES (?, ?)",
+        [(record["user_id"], record["timestamp"][:10]) for record in records],
+    )
+    # Неизвестные модель и compute_type хранятся как "": колонки ключа не бывают NULL
+    cursor.executemany(
+        """
+        INSERT INTO daily_model_stats
+            (day, whisper_model, compute_type, requests, audio_seconds, compute_seconds)
+        VALUES (?, ?, ?, 1, ?, ?)
+        ON CONFLICT (day, whisper_model, compute_type) DO UPDATE SET
+            requests = requests + 1,
+            audio_seconds = audio_seconds + excluded.audio_seconds,
+            compute_seconds = compute_seconds + excluded.compute_seconds
+        """,
+        [
+            (
+                record["timestamp"][:10],
+                record.get("whisper_model") or "",
+                record.get("compute_type") or "",
+                record["audio_duration_seconds"],
+                _compute_seconds(record),
+            )
+            for record in records
+            if record.get("audio_duration_seconds")
+        ],
+    )
+    slow = [record for record in records if record.get("duration_seconds") is not None]
+    cursor.executemany(
+        """
+        INSERT OR REPLACE INTO daily_slowest_tasks
+            (day, task_id, user_id, duration_seconds, audio_duration_seconds, whisper_model)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                record["timestamp"][:10],
+                record["task_id"],
+                record["user_id"],
+                record["duration_seconds"],
+                record.get("audio_duration_seconds"),
+                record.get("whisper_model"),
+            )
+            for record in slow
+        ],
+    )
+    cursor.executemany(
+        """
+        DELETE FROM daily_slowest_tasks
+        WHERE day = ?1 AND task_id NOT IN (
+            SELECT task_id FROM daily_slowest_tasks
+            WHERE day = ?1
+            ORDER BY duration_seconds DESC, task_id DESC
+            LIMIT ?2
+        )
+        """,
+        [(day, SLOWEST_TASKS_PER_DAY) for day in {record["timestamp"][:10] for record in slow}],
+    )
+    # Заданный пользователем язык воркер не проверяет, поэтому он не учитывается
+    cursor.executemany(
+        """
+        INSERT INTO user_language_stats (user_id, language, requests)
+        VALUES (?, ?, 1)
+        ON CONFLICT (user_id, language) DO UPDATE SET requests = requests + 1
+        """,
+        [
+            (record["user_id"], record["language"])
+            for record in records
+            if record.get("language_detected") and record.get("language")
+        ],
+    )
+
+
+def make_task_record(
+    user_id: int,
+    duration_seconds: float,
+    original_file_type: str,
+    recognized_text: str,
+    stats: dict | None = None,
+) -> dict:
+    """
+    Сформировать запись о задаче; время фиксируется в момент вызова.
+    stats — результат воркера с ключами из TASK_STATS_COLUMNS (отсутствующие
+    показатели записываются как NULL).
+    """
+    stats = stats or {}
+    record = {
+        "user_id": user_id,
+        "timestamp": datetime.now().isoformat(),
+        "duration_seconds": duration_seconds,
+        "original_file_type": original_file_type,
+        "recognized_text": recognized_text,
+    }
+    for key, (column, _coltype) in TASK_STATS_COLUMNS.items():
+        record[column] = stats.get(key)
+    # Не колонка tasks: нужен только для статистики языков пользователя
+    record["language_detected"] = bool(stats.get("language_detected"))
+    return record
+
+
+def record_tasks_metadata(db_name: str, records: list[dict]) -> bool:
+    """Записать пачку задач одной транзакцией. Возвращает True при успехе."""
+    if not records:
+        return True
+    try:
+        with _transaction(db_name) as cursor:
+            columns = [
+                "user_id",
+                "timestamp",
+                "duration_seconds",
+                "original_file_type",
+                "recognized_text",
+                *(column for column, _coltype in TASK_STATS_COLUMNS.values()),
+            ]
+            sql = (
+                f"INSERT INTO tasks ({', '.join(columns)}) "
+                f"VALUES ({', '.join(':' + column for column in columns)})"
+            )
+            # По одной строке: агрегатам самых долгих задач нужен task_id
+            for record in records:
+                cursor.execute(sql, record)
+                record["task_id"] = cursor.lastrowid
+            _update_stats(cursor, records)
+        logger.info(f"Метаданные {len(records)} задач записаны в БД.")
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при записи метаданных {len(records)} задач: {e}")
+        return False
+
+
 def record_task_metadata(
     db_name: str,
     user_id: int,
     duration_seconds: float,
     original_file_type: str,
     recognized_text: str,
+    stats: dict | None = None,
 ) -> None:
-    try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        timestamp = datetime.now().isoformat()
-        cursor.execute(
-            """
-            INSERT INTO tasks (user_id, timestamp, duration_seconds, original_file_type, recognized_text)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (user_id, timestamp, duration_seconds, original_file_type, recognized_text),
+    record_tasks_metadata(
+        db_name,
+        [make_task_record(user_id, duration_seconds, original_file_type, recognized_text, stats)],
+    )
+
+
+class TaskMetadataWriter:
+    """
+    Буфер отложенной записи метаданных задач.
+    Записи копятся в памяти и сбрасываются в БД одной транзакцией,
+    когда набирается batch_size записей или проходит flush_interval секунд.
+    При ошибке записи сброс повторяется с экспоненциальной паузой (до
+    max_backoff секунд); после max_attempts неудачных попыток подряд записи
+    отбрасываются. В буфере хранится не больше max_buffer записей.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        batch_size: int = 50,
+        flush_interval: float = 0.5,
+        max_buffer: int = 10000,
+        max_attempts: int = 5,
+        max_backoff: float = 30.0,
+    ):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._buffer: list[dict] = []
+        self._failures = 0
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    def add(
+        self,
+        user_id: int,
+        duration_seconds: float,
+        original_file_type: str,
+        recognized_text: str,
+        stats: dict | None = None,
+    ) -> None:
+        """Поставить запись в буфер, не дожидаясь записи на диск."""
+        self._buffer.append(
+            make_task_record(
+                user_id, duration_seconds, original_file_type, recognized_text, stats
+            )
         )
-        conn.commit()
-        conn.close()
-        logger.info(f"Метаданные задачи для пользователя {user_id} записаны в БД.")
+        self._trim()
+        # Пока БД недоступна, сброс ждёт паузы, а не каждой полной пачки
+        if len(self._buffer) >= self.batch_size and not self._failures:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            logger.error(f"Буфер метаданных задач переполнен, отброшено записей: {overflow}")
+
+    def _delay(self) -> float:
+        if not self._failures:
+            return self.flush_interval
+        return min(self.max_backoff, self.flush_interval * 2**self._failures)
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        if await run(record_tasks_metadata, self.db_name, records):
+            self._failures = 0
+            return
+        self._failures += 1
+        if self._failures >= self.max_attempts:
+            logger.error(
+                f"Метаданные {len(records)} задач не записаны после "
+                f"{self._failures} попыток и отброшены"
+            )
+            self._failures = 0
+            return
+        # Возвращаем записи в начало буфера, чтобы повторить при следующем сбросе
+        self._buffer[:0] = records
+        self._trim()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._delay())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closing:
+                break
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка при сбросе буфера метаданных задач:")
+
+    async def close(self) -> None:
+        """
+        Остановить фоновый сброс и записать всё, что осталось в буфере.
+        Сброс, который уже выполняется, не прерывается: его записи иначе потерялись бы.
+        """
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+def _build_fts_query(query: str, user_id: int) -> str:
+    """
+    Превратить пользовательский запрос в безопасный запрос FTS5 (поиск по
+    префиксам) по текстам пользователя user_id.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return ""
+    phrases = " ".join(f'"{term}"*' for term in terms)
+    return f'owner : "u{user_id}" AND recognized_text : ({phrases})'
+
+
+def search_transcripts(
+    db_name: str,
+    user_id: int,
+    query: str,
+    limit: int = 5,
+    after: tuple[float, int] | None = None,
+) -> tuple[list[tuple[int, str, str]], tuple[float, int] | None]:
+    """
+    Найти транскрипты пользователя по полнотекстовому запросу, от самых
+    релевантных (bm25) к менее релевантным; при равной релевантности новые раньше.
+    Страницы выбираются по ключу (bm25, task_id): after — курсор, возвращённый
+    предыдущей страницей. Новые задачи между страницами меняют веса bm25, так
+    что граница страниц может немного сдвинуться.
+    Возвращает список (task_id, timestamp, snippet) и курсор следующей страницы
+    (None, если результатов больше нет).
+    """
+    fts_query = _build_fts_query(query, user_id)
+    if not fts_query:
+        return [], None
+    rank_after, task_after = after if after is not None else (float("-inf"), 2**63 - 1)
+    try:
+        with _transaction(db_name) as cursor:
+            # bm25 нельзя использовать в WHERE запроса с MATCH, поэтому курсор
+            # применяется во внешнем запросе; колонка owner в ранжировании не участвует
+            cursor.execute(
+                """
+                SELECT task_id, timestamp, snippet, rank FROM (
+                    SELECT t.task_id, t.timestamp,
+                           snippet(tasks_fts, 0, '[', ']', '…', 16) AS snippet,
+                           bm25(tasks_fts, 1.0, 0.0) AS rank
+                    FROM tasks_fts
+                    JOIN tasks t ON t.task_id = tasks_fts.rowid
+                    WHERE tasks_fts MATCH ? AND t.user_id = ?
+                )
+                WHERE rank > ? OR (rank = ? AND task_id < ?)
+                ORDER BY rank, task_id DESC
+                LIMIT ?
+                """,
+                (fts_query, user_id, rank_after, rank_after, task_after, limit + 1),
+            )
+            rows = cursor.fetchall()
     except sqlite3.Error as e:
-        logger.error(
-            f"Ошибка при записи метаданных задачи для пользователя {user_id}: {e}"
-        )
+        logger.error(f"Ошибка полнотекстового поиска для пользователя {user_id}: {e}")
+        return [], None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][3], rows[-1][0])
+    return [(task_id, timestamp, snippet) for task_id, timestamp, snippet, _ in rows], next_cursor
 
 
 def get_bot_stats(db_name: str) -> dict:
@@ -168,103 +843,89 @@ def get_bot_stats(db_name: str) -> dict:
     - week_active: активных за последние 7 дней
     - week_requests: запросов на STT за последние 7 дней
     - week_new: новых пользователей за последние 7 дней
+    - today_rtf, week_rtf: real-time factor (время воркера / длительность аудио)
+      или None, если аудио с известной длительностью ещё не было
+    - week_audio_seconds: обработано секунд аудио за 7 дней
+    - week_models: [(модель, compute_type, задач, RTF)] за 7 дней
+    - slowest: [(task_id, user_id, время обработки, длительность аудио, модель)]
+      самые долгие запросы за 7 дней
+
+    Все показатели берутся из агрегатов (daily_user_activity, user_first_seen,
+    daily_model_stats, daily_slowest_tasks), поэтому время ответа не зависит
+    от размера истории задач.
     """
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        
-        # Получаем текущую дату и дату начала дня
-        now = datetime.now()
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_start = week_start - timedelta(days=7)
-        
-        today_start_str = today_start.isoformat()
-        week_start_str = week_start.isoformat()
-        now_str = now.isoformat()
-        
-        # Всего пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-        
-        # Статистика за сегодня
-        cursor.execute(
-            """
-            SELECT COUNT(DISTINCT user_id) 
-            FROM tasks 
-            WHERE timestamp >= ? AND timestamp <= ?
-            """,
-            (today_start_str, now_str)
-        )
-        today_active = cursor.fetchone()[0]
-        
-        cursor.execute(
-            """
-            SELECT COUNT(*) 
-            FROM tasks 
-            WHERE timestamp >= ? AND timestamp <= ?
-            """,
-            (today_start_str, now_str)
-        )
-        today_requests = cursor.fetchone()[0]
-        
-        # Новые пользователи сегодня (нужно проверить, когда пользователь был добавлен)
-        # Так как у нас нет поля created_at в users, будем считать новыми тех,
-        # у кого первая задача была сегодня
-        cursor.execute(
-            """
-            SELECT COUNT(DISTINCT user_id)
-            FROM tasks t1
-            WHERE t1.timestamp >= ? AND t1.timestamp <= ?
-            AND NOT EXISTS (
-                SELECT 1 FROM tasks t2 
-                WHERE t2.user_id = t1.user_id 
-                AND t2.timestamp < ?
-            )
-            """,
-            (today_start_str, now_str, today_start_str)
-        )
-        today_new = cursor.fetchone()[0]
-        
-        # Статистика за последние 7 дней
-        cursor.execute(
-            """
-            SELECT COUNT(DISTINCT user_id) 
-            FROM tasks 
-            WHERE timestamp >= ? AND timestamp <= ?
-            """,
-            (week_start_str, now_str)
-        )
-        week_active = cursor.fetchone()[0]
-        
-        cursor.execute(
-            """
-            SELECT COUNT(*) 
-            FROM tasks 
-            WHERE timestamp >= ? AND timestamp <= ?
-            """,
-            (week_start_str, now_str)
-        )
-        week_requests = cursor.fetchone()[0]
-        
-        # Новые пользователи за последние 7 дней
-        cursor.execute(
-            """
-            SELECT COUNT(DISTINCT user_id)
-            FROM tasks t1
-            WHERE t1.timestamp >= ? AND t1.timestamp <= ?
-            AND NOT EXISTS (
-                SELECT 1 FROM tasks t2 
-                WHERE t2.user_id = t1.user_id 
-                AND t2.timestamp < ?
-            )
-            """,
-            (week_start_str, now_str, week_start_str)
-        )
-        week_new = cursor.fetchone()[0]
-        
-        conn.close()
-        
+        with _transaction(db_name) as cursor:
+            today = datetime.now().date()
+            today_str = today.isoformat()
+            week_start_str = (today - timedelta(days=7)).isoformat()
+
+            # Всего пользователей
+            cursor.execute("SELECT COUNT(*) FROM users")
+            total_users = cursor.fetchone()[0]
+
+            # Статистика за сегодня
+            cursor.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(requests), 0),
+                       COALESCE(SUM(audio_seconds), 0), COALESCE(SUM(compute_seconds), 0)
+                FROM daily_user_activity
+                WHERE day = ?
+                """,
+                (today_str,),
+            )
+            today_active, today_requests, today_audio, today_compute = cursor.fetchone()
+
+            # Новыми считаются пользователи, у которых первая задача была в этот период
+            cursor.execute(
+                "SELECT COUNT(*) FROM user_first_seen WHERE first_day >= ?",
+                (today_str,),
+            )
+            today_new = cursor.fetchone()[0]
+
+            # Статистика за последние 7 дней
+            cursor.execute(
+                """
+                SELECT COUNT(DISTINCT user_id), COALESCE(SUM(requests), 0),
+                       COALESCE(SUM(audio_seconds), 0), COALESCE(SUM(compute_seconds), 0)
+                FROM daily_user_activity
+                WHERE day >= ?
+                """,
+                (week_start_str,),
+            )
+            week_active, week_requests, week_audio, week_compute = cursor.fetchone()
+
+            cursor.execute(
+                "SELECT COUNT(*) FROM user_first_seen WHERE first_day >= ?",
+                (week_start_str,),
+            )
+            week_new = cursor.fetchone()[0]
+
+            cursor.execute(
+                """
+                SELECT NULLIF(whisper_model, ''), NULLIF(compute_type, ''), SUM(requests),
+                       SUM(compute_seconds) / SUM(audio_seconds)
+                FROM daily_model_stats
+                WHERE day >= ?
+                GROUP BY whisper_model, compute_type
+                ORDER BY SUM(requests) DESC
+                """,
+                (week_start_str,),
+            )
+            week_models = cursor.fetchall()
+
+            cursor.execute(
+                """
+                SELECT task_id, user_id, duration_seconds, audio_duration_seconds, whisper_model
+                FROM daily_slowest_tasks
+                WHERE day >= ?
+                ORDER BY duration_seconds DESC, task_id DESC
+                LIMIT ?
+                """,
+                (week_start_str, SLOWEST_TASKS_PER_DAY),
+            )
+            slowest = cursor.fetchall()
+
         return {
             "total_users": total_users,
             "today_active": today_active,
@@ -273,6 +934,11 @@ def get_bot_stats(db_name: str) -> dict:
             "week_active": week_active,
             "week_requests": week_requests,
             "week_new": week_new,
+            "today_rtf": today_compute / today_audio if today_audio else None,
+            "week_rtf": week_compute / week_audio if week_audio else None,
+            "week_audio_seconds": week_audio,
+            "week_models": week_models,
+            "slowest": slowest,
         }
     except sqlite3.Error as e:
         logger.error(f"Ошибка при получении статистики: {e}")
@@ -284,4 +950,321 @@ def get_bot_stats(db_name: str) -> dict:
             "week_active": 0,
             "week_requests": 0,
             "week_new": 0,
+            "today_rtf": None,
+            "week_rtf": None,
+            "week_audio_seconds": 0,
+            "week_models": [],
+            "slowest": [],
         }
+
+
+def backfill_stats(db_name: str, archive_db_name: str | None = None) -> None:
+    """
+    Пересчитать агрегаты статистики по всей истории задач, включая задачи,
+    перенесённые в архивную БД archive_db_name (если она существует).
+    """
+    has_archive = bool(archive_db_name) and os.path.exists(archive_db_name)
+    columns = (
+        "task_id, user_id, timestamp, duration_seconds, audio_duration_seconds, "
+        "decode_seconds, inference_seconds, whisper_model, compute_type"
+    )
+    history = f"SELECT {columns} FROM tasks"
+    if has_archive:
+        # Задача, попавшая в обе БД при сбое переноса, считается один раз
+        history += (
+            f" UNION ALL SELECT {columns} FROM archive.tasks"
+            " WHERE task_id NOT IN (SELECT task_id FROM main.tasks)"
+        )
+    try:
+        with _lock:
+            conn = _get_connection(db_name)
+            if has_archive:
+                # ATTACH нельзя выполнить внутри транзакции
+                conn.execute("ATTACH DATABASE ? AS archive", (archive_db_name,))
+            try:
+                with _transaction(db_name) as cursor:
+                    cursor.execute("DELETE FROM daily_user_activity")
+                    cursor.execute("DELETE FROM user_first_seen")
+                    cursor.execute("DELETE FROM daily_model_stats")
+                    cursor.execute("DELETE FROM daily_slowest_tasks")
+                    cursor.execute(
+                        f"""
+                        INSERT INTO daily_user_activity (day, user_id, requests, audio_seconds, compute_seconds)
+                        SELECT
+                            substr(timestamp, 1, 10),
+                            user_id,
+                            COUNT(*),
+                            COALESCE(SUM(audio_duration_seconds), 0),
+                            COALESCE(SUM(
+                                CASE WHEN audio_duration_seconds IS NOT NULL
+                                THEN COALESCE(decode_seconds, 0) + COALESCE(inference_seconds, 0)
+                                END
+                            ), 0)
+                        FROM ({history})
+                        GROUP BY substr(timestamp, 1, 10), user_id
+                        """
+                    )
+                    cursor.execute(
+                        """
+                        INSERT INTO user_first_seen (user_id, first_day)
+                        SELECT user_id, MIN(day)
+                        FROM daily_user_activity
+                        GROUP BY user_id
+                        """
+                    )
+                    cursor.execute(
+                        f"""
+                        INSERT INTO daily_model_stats
+                            (day, whisper_model, compute_type, requests, audio_seconds, compute_seconds)
+                        SELECT
+                            substr(timestamp, 1, 10),
+                            COALESCE(whisper_model, ''),
+                            COALESCE(compute_type, ''),
+                            COUNT(*),
+                            SUM(audio_duration_seconds),
+                            SUM(COALESCE(decode_seconds, 0) + COALESCE(inference_seconds, 0))
+                        FROM ({history})
+                        WHERE audio_duration_seconds > 0
+                        GROUP BY substr(timestamp, 1, 10), COALESCE(whisper_model, ''), COALESCE(compute_type, '')
+                        """
+                    )
+                    cursor.execute(
+                        f"""
+                        INSERT INTO daily_slowest_tasks
+                            (day, task_id, user_id, duration_seconds, audio_duration_seconds, whisper_model)
+                        SELECT day, task_id, user_id, duration_seconds, audio_duration_seconds, whisper_model
+                        FROM (
+                            SELECT
+                                substr(timestamp, 1, 10) AS day, task_id, user_id, duration_seconds,
+                                audio_duration_seconds, whisper_model,
+                                ROW_NUMBER() OVER (
+                                    PARTITION BY substr(timestamp, 1, 10)
+                                    ORDER BY duration_seconds DESC, task_id DESC
+                                ) AS position
+                            FROM ({history})
+                            WHERE duration_seconds IS NOT NULL
+                        )
+                        WHERE position <= ?
+                        """,
+                        (SLOWEST_TASKS_PER_DAY,),
+                    )
+            finally:
+                if has_archive:
+                    conn.execute("DETACH DATABASE archive")
+        logger.info(f"Агрегаты статистики в '{db_name}' пересчитаны.")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при пересчёте агрегатов статистики: {e}")
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def decompress_text(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+
+def init_archive_db(archive_db_name: str) -> None:
+    """Создать схему архивной БД, куда переносятся старые задачи."""
+    try:
+        with _transaction(archive_db_name) as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    duration_seconds REAL,
+                    original_file_type TEXT,
+                    compressed_text BLOB
+                )
+                """
+            )
+            cursor.execute("PRAGMA table_info(tasks)")
+            existing_cols = {row[1] for row in cursor.fetchall()}
+            for col, coltype in TASK_STATS_COLUMNS.values():
+                if col not in existing_cols:
+                    try:
+                        cursor.execute(f"ALTER TABLE tasks ADD COLUMN {col} {coltype}")
+                    except sqlite3.OperationalError as e:
+                        logger.warning(f"Ошибка миграции архивной tasks: {e}")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks (user_id)"
+            )
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка инициализации архивной базы данных: {e}")
+
+
+def compress_old_transcripts(db_name: str, older_than: datetime, batch_size: int) -> int:
+    """
+    Сжать тексты задач старше older_than (не более batch_size за вызов).
+    Сжатые задачи остаются в полнотекстовом поиске: индекс хранит только
+    токены, а текст для сниппетов распаковывается при чтении. Возвращает
+    число сжатых задач.
+    """
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute(
+                """
+                SELECT task_id, recognized_text FROM tasks
+                WHERE timestamp < ? AND recognized_text IS NOT NULL
+                LIMIT ?
+                """,
+                (older_than.isoformat(), batch_size),
+            )
+            rows = cursor.fetchall()
+            cursor.executemany(
+                "UPDATE tasks SET compressed_text = ?, recognized_text = NULL WHERE task_id = ?",
+                [(compress_text(text), task_id) for task_id, text in rows],
+            )
+        return len(rows)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сжатии старых транскриптов: {e}")
+        return 0
+
+
+def archive_old_tasks(
+    db_name: str, archive_db_name: str, older_than: datetime, batch_size: int
+) -> int:
+    """
+    Перенести задачи старше older_than в архивную БД (не более batch_size за вызов).
+    Сначала фиксируется запись в архив, затем удаление из основной БД: при сбое
+    между ними задача окажется в обеих БД, но не потеряется. Агрегаты /stats
+    не затрагиваются. Возвращает число перенесённых задач.
+    """
+    columns = [
+        "task_id",
+        "user_id",
+        "timestamp",
+        "duration_seconds",
+        "original_file_type",
+        *(column for column, _coltype in TASK_STATS_COLUMNS.values()),
+    ]
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute(
+                f"""
+                SELECT {', '.join(columns)}, recognized_text, compressed_text
+                FROM tasks
+                WHERE timestamp < ?
+                ORDER BY timestamp
+                LIMIT ?
+                """,
+                (older_than.isoformat(), batch_size),
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return 0
+
+        with _transaction(archive_db_name) as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO tasks ({', '.join(columns)}, compressed_text) "
+                f"VALUES ({', '.join('?' * (len(columns) + 1))})",
+                [
+                    (
+                        *row[:-2],
+                        row[-1] if row[-1] is not None
+                        else compress_text(row[-2]) if row[-2] is not None
+                        else None,
+                    )
+                    for row in rows
+                ],
+            )
+        with _transaction(db_name) as cursor:
+            cursor.executemany(
+                "DELETE FROM tasks WHERE task_id = ?", [(row[0],) for row in rows]
+            )
+        return len(rows)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при переносе старых задач в архив: {e}")
+        return 0
+
+
+def incremental_vacuum(db_name: str, pages: int) -> bool:
+    """
+    Освободить до pages свободных страниц файла БД.
+    Возвращает True, если свободные страницы ещё остались.
+    """
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2:
+                return False
+            cursor.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            cursor.fetchall()
+            cursor.execute("PRAGMA freelist_count")
+            return cursor.fetchone()[0] > 0
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при incremental vacuum: {e}")
+        return False
+
+
+def get_transcript(
+    db_name: str, archive_db_name: str | None, user_id: int, task_id: int
+) -> str | None:
+    """Прочитать полный текст задачи пользователя из основной или архивной БД."""
+    try:
+        with _transaction(db_name) as cursor:
+            cursor.execute(
+                "SELECT recognized_text, compressed_text FROM tasks WHERE task_id = ? AND user_id = ?",
+                (task_id, user_id),
+            )
+            row = cursor.fetchone()
+        if row is None and archive_db_name and os.path.exists(archive_db_name):
+            with _transaction(archive_db_name) as cursor:
+                cursor.execute(
+                    "SELECT NULL, compressed_text FROM tasks WHERE task_id = ? AND user_id = ?",
+                    (task_id, user_id),
+                )
+                row = cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при чтении транскрипта {task_id}: {e}")
+        return None
+    if row is None:
+        return None
+    text, compressed = row
+    if text is not None:
+        return text
+    return decompress_text(compressed) if compressed is not None else None
+
+
+def vacuum(db_name: str) -> None:
+    """Полный VACUUM с включением incremental auto_vacuum (однократно, в тихое время)."""
+    with _lock:
+        conn = _get_connection(db_name)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    logger.info(f"VACUUM базы данных '{db_name}' завершён.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    parser.add_argument(
+        "--db", default=os.getenv("DB_PATH", "data/bot_database.db"), help="Путь к БД"
+    )
+    parser.add_argument(
+        "--archive-db",
+        default=os.getenv("ARCHIVE_DB_PATH", "data/bot_archive.db"),
+        help="Путь к архивной БД (учитывается в backfill-stats)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser(
+        "backfill-stats", help="Пересчитать агрегаты /stats по существующим задачам"
+    )
+    subparsers.add_parser(
+        "vacuum", help="Однократно перестроить БД с incremental auto_vacuum"
+    )
+    args = parser.parse_args()
+
+    init_db(args.db)
+    if args.command == "backfill-stats":
+        backfill_stats(args.db, args.archive_db)
+    elif args.command == "vacuum":
+        vacuum(args.db)
+    close_db()
@@ -1,8 +1,24 @@
+import logging
+import os
+import shutil
 import sys
 
-from huey.bin.huey_consumer import consumer_main
-
 if __name__ == "__main__":
     sys.path.insert(0, "/app")
-    sys.argv = ["huey_consumer.py", "huey_tasks.huey"]
-    consumer_main()
+
+    # Файлы метрик прошлых запусков нужно удалить до импорта модулей с метриками
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+    import metrics
+    import supervisor
+    import tracing
+    from tasks import huey
+
+    logging.basicConfig(format=tracing.LOG_FORMAT, level=logging.INFO)
+    # Модель загружают только процессы воркеров; супервизор отдаёт метрики
+    # всех процессов и следит за их памятью
+    metrics.start_metrics_server((metrics.QueueDepthCollector(huey.pending_count),))
+    supervisor.Supervisor().run()
@@ -1,32 +1,73 @@
-import logging
-import os
+import threading
+import time
 
+from huey import crontab
+from huey.signals import SIGNAL_COMPLETE, SIGNAL_ERROR
+
+import checkpoints
+import metrics
 from tasks import huey
 
-from stt_processor import transcribe_media_sync
-
-logger = logging.getLogger(__name__)
-
-
-@huey.task()
-def transcribe_task(file_path: str, file_type: str, language: str = "ru"):
-    try:
-        result = transcribe_media_sync(file_path, file_type, language=language)
-        # Удаляем файл сразу после обработки, до возврата результата
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                logger.info(f"Файл успешно удален после обработки: {file_path}")
-            except Exception as e:
-                logger.warning(f"Не удалось удалить файл {file_path}: {e}")
-        return result
-    except Exception as e:
-        logger.exception(f"Ошибка при обработке файла {file_path}: {e}")
-        # Удаляем файл даже при ошибке
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                logger.info(f"Файл удален после ошибки: {file_path}")
-            except Exception as remove_error:
-                logger.warning(f"Не удалось удалить файл {file_path} после ошибки: {remove_error}")
-        raise
+import stt_processor  # модель загружается при старте воркера, а не с первой задачей
+from transcription import run_transcription
+
+
+_startup_lock = threading.Lock()
+_started = False
+
+
+@huey.on_startup()
+def register_worker():
+    # Хук вызывается в каждом потоке консьюмера, а модель одна на процесс
+    global _started
+    with _startup_lock:
+        if _started:
+            return
+        _started = True
+    metrics.WORKERS.inc(stt_processor.NUM_WORKERS)
+    recover_abandoned_tasks.call_local()
+
+
+@huey.task(context=True)
+def transcribe_task(
+    file_path: str,
+    file_type: str,
+    language: str | None = "ru",
+    enqueued_at: float | None = None,
+    trace_context: dict | None = None,
+    keep_file: bool = False,
+    task=None,
+):
+    return run_transcription(
+        file_path,
+        file_type,
+        language,
+        enqueued_at,
+        trace_context,
+        keep_file,
+        job_id=task.id,
+        priority=task.priority,
+    )
+
+
+@huey.signal(SIGNAL_COMPLETE, SIGNAL_ERROR)
+def acknowledge_task(signal, task, *args):
+    # COMPLETE приходит после сохранения результата, и только тогда контрольная
+    # точка больше не нужна; задачу, завершившуюся ошибкой, не повторяем
+    if isinstance(task, transcribe_task.task_class):
+        checkpoints.remove(task.id)
+
+
+def _requeue(job_id: str, job: dict) -> None:
+    # Тот же id: бот продолжает ждать результат исходной задачи
+    kwargs = dict(job["kwargs"], enqueued_at=time.time())
+    huey.enqueue(
+        transcribe_task.task_class(
+            tuple(job["args"]), kwargs, id=job_id, priority=job.get("priority")
+        )
+    )
+
+
+@huey.periodic_task(crontab(minute="*"))
+def recover_abandoned_tasks():
+    checkpoints.recover(_requeue)
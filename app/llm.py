@@ -1,10 +1,16 @@
 import os
 import json
+import hashlib
 import logging
+import re
+import unicodedata
 
 from dotenv import load_dotenv
 
 import httpx
+import redis.asyncio as aioredis
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +18,23 @@ load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL_NAME = os.getenv("OPENROUTER_MODEL_NAME")
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# Во встроенном режиме Redis нет, и кэш по умолчанию выключен
+LLM_CACHE_ENABLED = (
+    os.getenv("LLM_CACHE_ENABLED", "0" if os.getenv("EXECUTION_MODE") == "embedded" else "1")
+    == "1"
+)
+# Кэш живёт в отдельном экземпляре Redis с вытеснением allkeys-lru, чтобы при
+# нехватке памяти не пострадали очередь Huey и состояние пользователей
+LLM_CACHE_REDIS_HOST = os.getenv("LLM_CACHE_REDIS_HOST") or REDIS_HOST
+LLM_CACHE_REDIS_PORT = int(os.getenv("LLM_CACHE_REDIS_PORT", str(REDIS_PORT)))
+LLM_CACHE_DB = int(os.getenv("LLM_CACHE_DB", "1"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_TEXT_LENGTH = int(os.getenv("LLM_CACHE_MAX_TEXT_LENGTH", "4000"))
+# Версию нужно увеличивать при любом изменении LLM_PROMPT_TEMPLATE или параметров запроса,
+# чтобы не отдавать из кэша исправления, сделанные по старому промпту
+LLM_PROMPT_VERSION = "1"
 LLM_PROMPT_TEMPLATE = (
     "Текст ниже получен с помощью автоматического распознавания речи (STT). "
     "Твоя задача — исправить только ошибки, вызванные распознаванием, а также грамматические и пунктуационные ошибки. "
@@ -21,6 +44,63 @@ LLM_PROMPT_TEMPLATE = (
 )
 
 
+_cache_client: aioredis.Redis | None = None
+
+
+def _get_cache_client() -> aioredis.Redis:
+    """Получить (лениво создать) общий для всех реплик клиент Redis для кэша исправлений."""
+    global _cache_client
+    if _cache_client is None:
+        _cache_client = aioredis.Redis(
+            host=LLM_CACHE_REDIS_HOST,
+            port=LLM_CACHE_REDIS_PORT,
+            db=LLM_CACHE_DB,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5,
+        )
+    return _cache_client
+
+
+def _normalize_text(text: str) -> str:
+    """Нормализует текст для ключа кэша: Unicode NFC и схлопывание пробелов."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def _cache_key(text: str) -> str:
+    """Ключ кэша: хэш нормализованного текста, имени модели и версии промпта."""
+    digest = hashlib.sha256(
+        "\x00".join(
+            [LLM_PROMPT_VERSION, OPENROUTER_MODEL_NAME or "", _normalize_text(text)]
+        ).encode("utf-8")
+    ).hexdigest()
+    return f"whisper-bot:llm:{digest}"
+
+
+async def _cache_get(text: str) -> str | None:
+    if not LLM_CACHE_ENABLED or len(text) > LLM_CACHE_MAX_TEXT_LENGTH:
+        return None
+    try:
+        cached = await _get_cache_client().get(_cache_key(text))
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать кэш исправлений LLM: {e}")
+        return None
+    metrics.CACHE_REQUESTS.labels(
+        cache="llm", result="hit" if cached is not None else "miss"
+    ).inc()
+    return cached.decode("utf-8") if cached is not None else None
+
+
+async def _cache_set(text: str, corrected_text: str) -> None:
+    if not LLM_CACHE_ENABLED or len(text) > LLM_CACHE_MAX_TEXT_LENGTH:
+        return
+    try:
+        await _get_cache_client().set(
+            _cache_key(text), corrected_text.encode("utf-8"), ex=LLM_CACHE_TTL
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось записать кэш исправлений LLM: {e}")
+
+
 async def correct_text_with_llm(text: str) -> str:
     """
     Исправляет ошибки в тексте с помощью LLM через Openrouter API.
@@ -32,6 +112,11 @@ async def correct_text_with_llm(text: str) -> str:
         )
         return text
 
+    cached_text = await _cache_get(text)
+    if cached_text is not None:
+        logger.info("Исправленный текст взят из кэша LLM.")
+        return cached_text
+
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
@@ -62,6 +147,8 @@ async def correct_text_with_llm(text: str) -> str:
             response_data = response.json()
             corrected_text = response_data["choices"][0]["message"]["content"].strip()
             logger.info("Текст успешно исправлен через API Openrouter.")
+            if corrected_text:
+                await _cache_set(text, corrected_text)
             return corrected_text
     except httpx.RequestError as e:
         logger.error(f"Ошибка запроса к API Openrouter: {e}")
@@ -0,0 +1,132 @@
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from dotenv import load_dotenv
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Если задан, метрики всех процессов-воркеров Huey собираются через файлы в этом каталоге
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+# Этапы: download, queue_wait, audio_extract, decode, inference, llm, reply, total
+STAGE_LATENCY = Histogram(
+    "whisper_bot_stage_seconds",
+    "Длительность этапов обработки сообщения",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "whisper_bot_model_load_seconds",
+    "Время загрузки модели Whisper",
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+WORKER_BUSY_SECONDS = Counter(
+    "whisper_bot_worker_busy_seconds",
+    "Время, которое модели воркеров провели за распознаванием "
+    "(доля занятости = rate(...) / whisper_bot_workers)",
+)
+WORKERS = Gauge(
+    "whisper_bot_workers",
+    "Число слотов распознавания живых воркеров (num_workers модели на процесс)",
+    multiprocess_mode="livesum",
+)
+WORKER_BUSY = Gauge(
+    "whisper_bot_workers_busy",
+    "Число слотов, занятых распознаванием прямо сейчас",
+    multiprocess_mode="livesum",
+)
+WORKER_RSS = Gauge(
+    "whisper_bot_worker_rss_bytes",
+    "Резидентная память процесса воркера после последней задачи",
+    multiprocess_mode="liveall",
+)
+WORKER_RSS_PEAK = Gauge(
+    "whisper_bot_worker_rss_peak_bytes",
+    "Максимальный RSS процессов воркеров с момента запуска контейнера",
+    multiprocess_mode="max",
+)
+WORKER_RECYCLES = Counter(
+    "whisper_bot_worker_recycles",
+    "Замены процессов воркеров по порогу (reason: rss/tasks)",
+    ["reason"],
+)
+CACHE_REQUESTS = Counter(
+    "whisper_bot_cache_requests",
+    "Обращения к кэшам (result: hit/miss)",
+    ["cache", "result"],
+)
+
+
+class QueueDepthCollector(Collector):
+    """Глубина очереди Huey, считываемая в момент опроса /metrics."""
+
+    def __init__(self, pending_count: Callable[[], int]):
+        self._pending_count = pending_count
+
+    def collect(self):
+        metric = GaugeMetricFamily(
+            "whisper_bot_queue_depth", "Число задач, ожидающих в очереди Huey"
+        )
+        try:
+            metric.add_metric([], self._pending_count())
+        except Exception as e:
+            logger.warning(f"Не удалось получить глубину очереди: {e}")
+            return
+        yield metric
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Замерить длительность этапа и записать её в гистограмму."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_worker_busy() -> Iterator[None]:
+    """Отметить слот модели занятым на время распознавания."""
+    WORKER_BUSY.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        WORKER_BUSY_SECONDS.inc(time.perf_counter() - start)
+        WORKER_BUSY.dec()
+
+
+def start_metrics_server(extra_collectors: tuple[Collector, ...] = ()) -> None:
+    """Поднять HTTP-эндпоинт /metrics на METRICS_PORT (0 — отключено)."""
+    if METRICS_PORT <= 0:
+        return
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    for collector in extra_collectors:
+        registry.register(collector)
+    start_http_server(METRICS_PORT, registry=registry)
+    logger.info(f"Метрики Prometheus доступны на порту {METRICS_PORT} (/metrics)")
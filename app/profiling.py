@@ -0,0 +1,203 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+import redis
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+PROFILES_DIR = os.getenv("PROFILES_DIR", "data/profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+# Сколько следующих задач осталось профилировать (общий счётчик для всех воркеров)
+PROFILE_COUNTER_KEY = "whisper-bot:profile:remaining"
+
+# Атомарно уменьшить счётчик, только если он больше нуля
+_CLAIM_SCRIPT = """
+local remaining = tonumber(redis.call('GET', KEYS[1]) or '0')
+if remaining > 0 then
+    redis.call('DECR', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+# Кадр стека ("файл:функция") -> этап. Этап сэмпла определяется ближайшим
+# к вершине стека кадром из этого списка.
+STAGE_FUNCTIONS = {
+    "stt_processor.py:extract_audio_from_video": "decode",
+    "stt_processor.py:stream_pcm": "decode",
+    # Окна длинного файла декодирует отдельный поток: в профиле задачи видно ожидание окна
+    "stt_processor.py:_prefetch": "decode",
+    "stt_processor.py:_inference_slot": "inference_wait",
+    "audio.py:decode_audio": "decode",
+    "feature_extractor.py:__call__": "features",
+    "transcribe.py:encode": "encoder",
+    "transcribe.py:generate_with_fallback": "decoder",
+}
+STAGE_TITLES = {
+    "decode": "декодирование аудио",
+    "inference_wait": "ожидание модели",
+    "features": "извлечение признаков",
+    "encoder": "энкодер",
+    "decoder": "декодер",
+    "other": "прочее",
+}
+
+CLAIM_RETRY_DELAY = 60
+
+_client: redis.Redis | None = None
+_async_client: aioredis.Redis | None = None
+# При недоступном Redis не пытаться подключаться перед каждой задачей
+_claim_disabled_until = 0.0
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=1)
+    return _client
+
+
+def _get_async_client() -> aioredis.Redis:
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+    return _async_client
+
+
+async def request_profiling(count: int) -> bool:
+    """Профилировать следующие count задач транскрибации (0 — отменить)."""
+    try:
+        if count > 0:
+            await _get_async_client().set(PROFILE_COUNTER_KEY, count)
+        else:
+            await _get_async_client().delete(PROFILE_COUNTER_KEY)
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось включить профилирование: {e}")
+        return False
+
+
+def claim_profile_slot() -> bool:
+    """Занять одно место из счётчика профилирования; вызывается воркером перед задачей."""
+    global _claim_disabled_until
+    if time.monotonic() < _claim_disabled_until:
+        return False
+    try:
+        return bool(_get_client().eval(_CLAIM_SCRIPT, 1, PROFILE_COUNTER_KEY))
+    except Exception as e:
+        logger.warning(f"Не удалось проверить счётчик профилирования: {e}")
+        _claim_disabled_until = time.monotonic() + CLAIM_RETRY_DELAY
+        return False
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер одного потока: фоновый поток раз в interval секунд
+    снимает стек целевого потока через sys._current_frames(). Накладные расходы
+    не зависят от числа вызовов функций в профилируемом коде, а время внутри
+    нативных вызовов (CTranslate2) попадает в Python-функцию, которая их вызвала.
+    """
+
+    def __init__(
+        self, thread_id: int | None = None, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000
+    ):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.stages: Counter[str] = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._started_at = 0.0
+
+    def start(self) -> None:
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self._started_at
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            stage = None
+            while frame is not None:
+                name = _frame_name(frame)
+                if stage is None:
+                    stage = STAGE_FUNCTIONS.get(name)
+                names.append(name)
+                frame = frame.f_back
+            names.reverse()
+            self.stacks[";".join(names)] += 1
+            self.stages[stage or "other"] += 1
+            self.samples += 1
+
+    def write_folded(self, path: str) -> None:
+        """Сохранить стеки в формате folded (flamegraph.pl, speedscope, inferno)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def summary(self, top: int = 5) -> str:
+        lines = [f"Длительность: {self.elapsed:.1f} с, сэмплов: {self.samples}"]
+        if not self.samples:
+            return lines[0]
+        for stage, title in STAGE_TITLES.items():
+            count = self.stages.get(stage, 0)
+            if count:
+                lines.append(f"   • {title}: {count / self.samples:.0%}")
+        leaves: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        lines.append("Горячие функции:")
+        for leaf, count in leaves.most_common(top):
+            lines.append(f"   • {leaf}: {count / self.samples:.0%}")
+        return "\n".join(lines)
+
+
+def start_if_requested() -> "SamplingProfiler | None":
+    """Запустить профайлер для текущего потока, если администратор запросил профилирование."""
+    if not claim_profile_slot():
+        return None
+    logger.info("Профилирование задачи включено")
+    profiler = SamplingProfiler()
+    profiler.start()
+    return profiler
+
+
+def save_profile(profiler: SamplingProfiler, name: str | None = None) -> dict:
+    """Записать профиль в PROFILES_DIR и вернуть словарь для результата задачи."""
+    filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{name or os.getpid()}.folded"
+    path = os.path.join(PROFILES_DIR, filename)
+    try:
+        profiler.write_folded(path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить профиль {path}: {e}")
+        path = None
+    return {"path": path, "summary": profiler.summary()}
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+import database
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "data/bot_archive.db")
+# 0 отключает соответствующий уровень хранения
+TRANSCRIPT_COMPRESS_AFTER_DAYS = int(os.getenv("TRANSCRIPT_COMPRESS_AFTER_DAYS", "30"))
+TRANSCRIPT_ARCHIVE_AFTER_DAYS = int(os.getenv("TRANSCRIPT_ARCHIVE_AFTER_DAYS", "180"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "6"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+VACUUM_PAGES_PER_STEP = int(os.getenv("VACUUM_PAGES_PER_STEP", "256"))
+
+
+async def run_maintenance(db_name: str) -> None:
+    """
+    Один проход обслуживания: сжатие старых транскриптов, перенос задач в архив
+    и incremental vacuum. Каждая пачка выполняется отдельной короткой транзакцией
+    в потоке БД, так что обработчики бота успевают выполняться между ними.
+    """
+    now = datetime.now()
+
+    if TRANSCRIPT_COMPRESS_AFTER_DAYS > 0:
+        cutoff = now - timedelta(days=TRANSCRIPT_COMPRESS_AFTER_DAYS)
+        total = 0
+        while True:
+            count = await database.run(
+                database.compress_old_transcripts, db_name, cutoff, RETENTION_BATCH_SIZE
+            )
+            total += count
+            if count < RETENTION_BATCH_SIZE:
+                break
+        if total:
+            logger.info(f"Сжато транскриптов: {total}")
+
+    if TRANSCRIPT_ARCHIVE_AFTER_DAYS > 0:
+        await database.run(database.init_archive_db, ARCHIVE_DB_PATH)
+        cutoff = now - timedelta(days=TRANSCRIPT_ARCHIVE_AFTER_DAYS)
+        total = 0
+        while True:
+            count = await database.run(
+                database.archive_old_tasks,
+                db_name,
+                ARCHIVE_DB_PATH,
+                cutoff,
+                RETENTION_BATCH_SIZE,
+            )
+            total += count
+            if count < RETENTION_BATCH_SIZE:
+                break
+        if total:
+            logger.info(f"Перенесено задач в архив '{ARCHIVE_DB_PATH}': {total}")
+
+    while await database.run(database.incremental_vacuum, db_name, VACUUM_PAGES_PER_STEP):
+        pass
+
+
+async def retention_loop(db_name: str) -> None:
+    """Периодически запускать обслуживание хранилища транскриптов."""
+    while True:
+        try:
+            await run_maintenance(db_name)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка при обслуживании хранилища транскриптов:")
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
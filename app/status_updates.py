@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import os
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from dotenv import load_dotenv
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Бюджеты Bot API: около 30 сообщений в секунду на бота и около одного в секунду на чат
+BOT_API_GLOBAL_RATE = float(os.getenv("BOT_API_GLOBAL_RATE", "25"))
+BOT_API_CHAT_RATE = float(os.getenv("BOT_API_CHAT_RATE", "1"))
+BOT_API_CHAT_BURST = float(os.getenv("BOT_API_CHAT_BURST", "3"))
+
+# Приоритеты: ответы с текстом > новые статусные сообщения > правки статуса
+PRIORITY_REPLY = 0
+PRIORITY_STATUS = 1
+PRIORITY_EDIT = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — сейчас)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+@dataclass
+class _Request:
+    priority: int
+    seq: int
+    chat_id: int
+    call: Callable[[], Awaitable[Any]] | None = None
+    future: asyncio.Future | None = None
+    # Для правок статуса: сообщение и последний запрошенный текст
+    message: Message | None = None
+    text: str = ""
+    kwargs: dict = field(default_factory=dict)
+
+    @property
+    def sort_key(self) -> tuple[int, int]:
+        return self.priority, self.seq
+
+
+class StatusUpdater:
+    """
+    Планировщик исходящих запросов к Bot API для handle_media.
+    Правки статусного сообщения схлопываются: пока правка ждёт отправки,
+    новая просто заменяет её текст, и промежуточные устаревшие статусы не
+    отправляются. Запросы выполняются в порядке приоритета с учётом общего и
+    поканального token bucket, поэтому правки статуса не задерживают ответы
+    с распознанным текстом. В каждом чате одновременно выполняется не больше
+    одного запроса, так что правки не обгоняют друг друга.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = BOT_API_GLOBAL_RATE,
+        chat_rate: float = BOT_API_CHAT_RATE,
+        chat_burst: float = BOT_API_CHAT_BURST,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: dict[int, TokenBucket] = {}
+        self._paused_until: dict[int, float] = {}
+        self._busy_chats: set[int] = set()
+        self._queue: list[_Request] = []
+        self._edits: dict[tuple[int, int], _Request] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Остановить планировщик; запросы в очереди отбрасываются."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        for request in self._queue:
+            if request.future is not None and not request.future.done():
+                request.future.cancel()
+        self._queue.clear()
+        self._edits.clear()
+
+    def _push(self, request: _Request) -> None:
+        keys = [r.sort_key for r in self._queue]
+        self._queue.insert(bisect.bisect(keys, request.sort_key), request)
+        self._wakeup.set()
+
+    async def send(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_REPLY,
+    ) -> Any:
+        """Выполнить запрос к Bot API в порядке очереди и вернуть его результат."""
+        if self._task is None:
+            return await call()
+        future = asyncio.get_running_loop().create_future()
+        self._push(_Request(priority, next(self._seq), chat_id, call=call, future=future))
+        return await future
+
+    def edit(self, message: Message | None, text: str, **kwargs: Any) -> None:
+        """Запросить правку статусного сообщения, не дожидаясь её отправки."""
+        if message is None:
+            return
+        if self._task is None:
+            # Цикл событий хранит задачи по слабой ссылке: держим её до завершения
+            task = asyncio.create_task(self._edit_now(message, text, kwargs))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            return
+        key = (message.chat_id, message.message_id)
+        pending = self._edits.get(key)
+        if pending is not None:
+            # Правка ещё не отправлена: заменяем устаревший текст новым
+            pending.text = text
+            pending.kwargs = kwargs
+            return
+        request = _Request(
+            PRIORITY_EDIT,
+            next(self._seq),
+            message.chat_id,
+            message=message,
+            text=text,
+            kwargs=kwargs,
+        )
+        self._edits[key] = request
+        self._push(request)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        """Забыть чаты, бюджет которых полностью восстановился."""
+        self._chats = {
+            chat_id: bucket
+            for chat_id, bucket in self._chats.items()
+            if bucket.delay(now) > 0 or bucket.tokens < bucket.burst
+        }
+        self._paused_until = {
+            chat_id: until for chat_id, until in self._paused_until.items() if until > now
+        }
+
+    def _next_ready(self, now: float) -> tuple[_Request | None, float | None]:
+        """Первый по приоритету запрос, который можно отправить, или время ожидания."""
+        wait = None
+        # Запросы, которые вызывающий уже не ждёт (отменённая обработка), не отправляем
+        self._queue = [r for r in self._queue if r.future is None or not r.future.cancelled()]
+        for request in self._queue:
+            chat_id = request.chat_id
+            if chat_id in self._busy_chats:
+                continue
+            delay = max(
+                self._chat_bucket(chat_id).delay(now),
+                self._paused_until.get(chat_id, 0.0) - now,
+            )
+            if delay <= 0:
+                return request, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            request, wait = self._next_ready(now)
+            if request is None:
+                if not self._queue:
+                    self._prune(now)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                # За время ожидания может прийти запрос с более высоким приоритетом
+                await asyncio.sleep(global_delay)
+                continue
+            self._global.consume(now)
+            self._chat_bucket(request.chat_id).consume(now)
+            self._queue.remove(request)
+            if request.message is not None:
+                self._edits.pop((request.message.chat_id, request.message.message_id), None)
+            self._busy_chats.add(request.chat_id)
+            task = asyncio.create_task(self._execute(request))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, request: _Request) -> None:
+        try:
+            if request.message is not None:
+                await request.message.edit_text(request.text, **request.kwargs)
+            else:
+                result = await request.call()
+                if not request.future.done():
+                    request.future.set_result(result)
+        except RetryAfter as e:
+            # Telegram просит подождать: откладываем чат и повторяем запрос
+            logger.warning(f"Flood limit в чате {request.chat_id}, пауза {e.retry_after} с")
+            self._paused_until[request.chat_id] = time.monotonic() + float(e.retry_after)
+            if request.message is not None:
+                key = (request.message.chat_id, request.message.message_id)
+                # Если за это время запрошена новая правка, отправится она, а не устаревший текст
+                if key not in self._edits:
+                    self.edit(request.message, request.text, **request.kwargs)
+            else:
+                self._push(request)
+        except Exception as e:
+            if request.future is not None:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            elif isinstance(e, BadRequest):
+                # "Message is not modified" и удалённые сообщения не мешают обработке
+                logger.debug(f"Правка статуса не применена: {e}")
+            else:
+                logger.warning(f"Не удалось обновить статусное сообщение: {e}")
+        finally:
+            self._busy_chats.discard(request.chat_id)
+            self._wakeup.set()
+
+    @staticmethod
+    async def _edit_now(message: Message, text: str, kwargs: dict) -> None:
+        try:
+            await message.edit_text(text, **kwargs)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статусное сообщение: {e}")
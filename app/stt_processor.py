@@ -1,12 +1,27 @@
+import gc
+import itertools
 import logging
 import os
+import queue
 import shutil
+import threading
+import time
+import uuid
+
+from contextlib import closing, contextmanager
+from typing import Generator, Iterator
 
 from dotenv import load_dotenv
 
-from faster_whisper import WhisperModel
+import av
+import numpy as np
+from faster_whisper import WhisperModel, decode_audio
 from pydub import AudioSegment
 
+import checkpoints
+import metrics
+import tracing
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -16,6 +31,16 @@ BEAM_SIZE = os.getenv("WHISPER_BEAM_SIZE", "5")
 CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "10"))
 NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", "1"))
 DOWNLOAD_ROOT = "./data/whisper_models"
+TEMP_DIR = "./data"
+# Аудио- и видеофайлы и документы могут длиться часами: они декодируются и
+# распознаются окнами фиксированной длины, а не целиком в памяти
+STREAMED_FILE_TYPES = ("audio", "video", "document")
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", "300"))
+# Сколько задач (и окон длинного файла) декодируется заранее, пока модель
+# занята распознаванием текущей
+PIPELINE_PREFETCH = int(os.getenv("PIPELINE_PREFETCH", "1"))
+# По скольким первым секундам аудио определяется язык, если он не задан
+LANGUAGE_DETECT_SECONDS = float(os.getenv("LANGUAGE_DETECT_SECONDS", "8"))
 
 # Создаем директорию для моделей, если её нет
 os.makedirs(DOWNLOAD_ROOT, exist_ok=True)
@@ -35,6 +60,9 @@ else:
     logger.info("HF_TOKEN не установлен. Будут использоваться неаутентифицированные запросы к HF Hub.")
 
 model = None
+# Одновременных вызовов модели не больше, чем её num_workers: остальные потоки
+# воркера в это время декодируют следующие задачи
+_inference_slots = threading.BoundedSemaphore(NUM_WORKERS)
 
 
 def _load_model() -> bool:
@@ -47,6 +75,7 @@ def _load_model() -> bool:
         logger.info(
             f"Загрузка модели Faster-Whisper '{WHISPER_MODEL}' с compute_type='{COMPUTE_TYPE}'..."
         )
+        load_start = time.perf_counter()
         model = WhisperModel(
             WHISPER_MODEL,
             device="cpu",
@@ -55,6 +84,7 @@ def _load_model() -> bool:
             cpu_threads=CPU_THREADS,
             num_workers=NUM_WORKERS,
         )
+        metrics.MODEL_LOAD_SECONDS.observe(time.perf_counter() - load_start)
         logger.info(f"Модель Faster-Whisper '{WHISPER_MODEL}' успешно загружена.")
         return True
     except Exception as e:
@@ -70,7 +100,6 @@ def _load_model() -> bool:
 
 def _remove_corrupted_model() -> None:
     """Удалить поврежденную модель для перезагрузки."""
-    import time
     try:
         # Ищем директорию модели в download_root
         # faster-whisper использует формат: models--Systran--faster-whisper-{model_name}
@@ -120,38 +149,377 @@ if not _load_model():
     _load_model()
 
 
-def transcribe_audio(audio_path: str, language: str = "ru") -> tuple[str | None, str | None]:
+@contextmanager
+def _inference_slot() -> Iterator[None]:
+    """Занять модель на время распознавания; ожидание пишется в метрику inference_wait."""
+    with metrics.track_stage("inference_wait"):
+        _inference_slots.acquire()
+    try:
+        with metrics.track_worker_busy():
+            yield
+    finally:
+        _inference_slots.release()
+
+
+def _prefetch(generator: Generator, depth: int) -> Iterator:
+    """
+    Выполнять generator в отдельном потоке на depth элементов вперёд: следующее
+    окно декодируется, пока модель распознаёт текущее. Исключение потока
+    передаётся потребителю.
+    """
+    if depth <= 0:
+        yield from generator
+        return
+    items: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce() -> None:
+        try:
+            for item in generator:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    break
+            else:
+                items.put(done)
+        except Exception as e:
+            items.put(e)
+        finally:
+            generator.close()
+
+    thread = threading.Thread(target=produce, name="decode-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Потребитель остановился раньше (ошибка распознавания): освобождаем поток
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+
+def _detect_language(
+    audio: np.ndarray, sampling_rate: int, checkpoint: checkpoints.Checkpoint | None
+) -> str:
+    """
+    Определить язык по первым LANGUAGE_DETECT_SECONDS аудио. При повторе задачи
+    берётся язык, определённый в первый раз: продолжение не должно его менять.
+    Вызывается с занятым слотом модели.
+    """
+    if checkpoint is not None and checkpoint.data.get("language"):
+        return checkpoint.data["language"]
+    with metrics.track_stage("language_detect"), tracing.span("language_detect"):
+        language, probability, _ = model.detect_language(
+            audio[: int(LANGUAGE_DETECT_SECONDS * sampling_rate)]
+        )
+    logger.info(f"Определён язык: {language} (вероятность {probability:.2f})")
+    if checkpoint is not None:
+        checkpoint.data["language"] = language
+    return language
+
+
+def model_settings() -> dict:
+    """Параметры модели, с которыми выполняется транскрибация."""
+    return {
+        "model": WHISPER_MODEL,
+        "compute_type": COMPUTE_TYPE,
+        "beam_size": int(BEAM_SIZE),
+        "cpu_threads": CPU_THREADS,
+    }
+
+
+def transcribe_audio(
+    audio_path: str,
+    language: str | None = "ru",
+    checkpoint: checkpoints.Checkpoint | None = None,
+) -> dict | None:
+    """Распознать аудиофайл.
+
+    Возвращает словарь с текстом, языком, длительностью аудио, временем
+    декодирования и инференса и параметрами модели либо None при ошибке.
+    language=None — язык определяется по началу аудио (language_detected в результате).
+    С checkpoint готовые сегменты сохраняются по ходу распознавания, а если
+    в нём уже есть сегменты, распознавание продолжается с конца последнего.
+    """
     logger.info(f"Начало transcribe_audio для файла: {audio_path}")
     global model
     if model is None:
         logger.warning("Модель Whisper не загружена. Попытка перезагрузки...")
         if not _load_model():
             logger.error("Модель Whisper не загружена. Невозможно выполнить транскрибацию.")
-            return None, None
+            return None
     try:
         logger.info(f"Начало транскрибации файла: {audio_path}")
         beam_size = int(BEAM_SIZE)
-        segments, info = model.transcribe(audio_path, language=language, beam_size=beam_size)
+        sampling_rate = model.feature_extractor.sampling_rate
+        decode_start = time.perf_counter()
+        with metrics.track_stage("decode"), tracing.span("decode"):
+            audio = decode_audio(audio_path, sampling_rate=sampling_rate)
+        decode_seconds = time.perf_counter() - decode_start
+        audio_duration = len(audio) / sampling_rate
 
         full_text = []
-        for segment in segments:
-            full_text.append(segment.text)
+        offset = 0.0
+        previous_inference_seconds = 0.0
+        options = {}
+        if checkpoint is not None and checkpoint.segments:
+            full_text = [segment[2] for segment in checkpoint.segments]
+            offset = checkpoint.offset
+            previous_inference_seconds = checkpoint.data.get("inference_seconds", 0.0)
+            # Текст последнего готового сегмента — контекст для декодера, как при сплошном распознавании
+            options["initial_prompt"] = full_text[-1]
+            audio = audio[int(offset * sampling_rate):]
+
+        language_detected = language is None
+        with _inference_slot():
+            if language is None and len(audio):
+                language = _detect_language(audio, sampling_rate, checkpoint)
+            lang = language
+            inference_start = time.perf_counter()
+            with metrics.track_stage("inference"), tracing.span(
+                "inference", beam_size=beam_size, resumed_from=offset
+            ):
+                if len(audio):
+                    segments, info = model.transcribe(
+                        audio, language=language, beam_size=beam_size, **options
+                    )
+                    lang = getattr(info, "language", None)
+                    for segment in segments:
+                        full_text.append(segment.text)
+                        if checkpoint is not None:
+                            checkpoint.add_segment(
+                                offset + segment.start,
+                                offset + segment.end,
+                                segment.text,
+                                previous_inference_seconds + time.perf_counter() - inference_start,
+                            )
+        inference_seconds = previous_inference_seconds + time.perf_counter() - inference_start
 
         text = " ".join(full_text).strip()
-        lang = getattr(info, "language", None)
-        logger.info(f"Транскрибация завершена. Текст: {text[:100]}... Язык: {lang}")
-        return text, lang
+        logger.info(
+            f"Транскрибация завершена. Текст: {text[:100]}... Язык: {lang}, "
+            f"длительность аудио: {audio_duration:.1f} с, инференс: {inference_seconds:.1f} с"
+        )
+        return {
+            "text": text,
+            "language": lang,
+            "language_detected": language_detected,
+            "audio_duration": audio_duration,
+            "decode_seconds": decode_seconds,
+            "inference_seconds": inference_seconds,
+            **model_settings(),
+        }
     except Exception as e:
         logger.exception(f"Ошибка при транскрибации аудио: {e}")
-        return None, None
+        return None
+
+
+def probe_duration(path: str) -> float | None:
+    """Длительность медиафайла по заголовку контейнера, без декодирования."""
+    try:
+        with av.open(path, mode="r", metadata_errors="ignore") as container:
+            if container.duration:
+                return container.duration / av.time_base
+            stream = container.streams.audio[0]
+            if stream.duration and stream.time_base:
+                return float(stream.duration * stream.time_base)
+    except (av.error.FFmpegError, IndexError) as e:
+        logger.warning(f"Не удалось определить длительность {path}: {e}")
+    return None
+
+
+def _frames_from(frames, start: float):
+    """Пропустить повреждённые кадры и кадры до start (seek встаёт на ключевой кадр раньше)."""
+    iterator = iter(frames)
+    while True:
+        try:
+            frame = next(iterator)
+        except StopIteration:
+            return
+        except av.error.InvalidDataError:
+            continue
+        if start > 0 and frame.time is not None and frame.time + frame.samples / frame.sample_rate <= start:
+            continue
+        yield frame
+
+
+def stream_pcm(
+    path: str, sampling_rate: int, window_seconds: float, start: float = 0.0
+) -> Iterator[np.ndarray]:
+    """
+    Декодировать аудиодорожку файла с позиции start окнами по window_seconds
+    (float32, моно). В памяти одновременно не больше одного окна, сколько бы
+    ни длился файл.
+    """
+    window = int(window_seconds * sampling_rate)
+    resampler = av.audio.resampler.AudioResampler(format="s16", layout="mono", rate=sampling_rate)
+    fifo = av.audio.fifo.AudioFifo()
+    try:
+        with av.open(path, mode="r", metadata_errors="ignore") as container:
+            if start > 0:
+                container.seek(int(start * av.time_base))
+            frames = _frames_from(container.decode(audio=0), start)
+            # None в конце сбрасывает буфер ресемплера
+            for frame in itertools.chain(frames, [None]):
+                for resampled in resampler.resample(frame):
+                    resampled.pts = None
+                    fifo.write(resampled)
+                while fifo.samples >= window:
+                    yield fifo.read(window).to_ndarray().reshape(-1).astype(np.float32) / 32768.0
+        if fifo.samples:
+            yield fifo.read().to_ndarray().reshape(-1).astype(np.float32) / 32768.0
+    finally:
+        # Объекты ресемплера освобождаются только сборщиком мусора (как в decode_audio)
+        del resampler
+        gc.collect()
+
+
+def transcribe_stream(
+    audio_path: str,
+    language: str | None = "ru",
+    checkpoint: checkpoints.Checkpoint | None = None,
+) -> dict | None:
+    """Распознать длинный файл окнами STREAM_WINDOW_SECONDS; результат в формате transcribe_audio.
+
+    Последний сегмент окна может быть обрезан границей окна, поэтому он не
+    сохраняется, а его аудио переносится в начало следующего окна. Готовые
+    сегменты пишутся в checkpoint: по ним бот показывает промежуточный
+    результат, а повтор задачи продолжает с конца последнего сегмента.
+    """
+    logger.info(f"Начало потоковой транскрибации файла: {audio_path}")
+    global model
+    if model is None:
+        logger.warning("Модель Whisper не загружена. Попытка перезагрузки...")
+        if not _load_model():
+            logger.error("Модель Whisper не загружена. Невозможно выполнить транскрибацию.")
+            return None
+    try:
+        beam_size = int(BEAM_SIZE)
+        sampling_rate = model.feature_extractor.sampling_rate
+        full_text = []
+        offset = 0.0
+        inference_seconds = 0.0
+        options = {}
+        if checkpoint is not None and checkpoint.segments:
+            full_text = [segment[2] for segment in checkpoint.segments]
+            offset = checkpoint.offset
+            inference_seconds = checkpoint.data.get("inference_seconds", 0.0)
+            options["initial_prompt"] = full_text[-1]
+        if checkpoint is not None:
+            checkpoint.data["duration"] = probe_duration(audio_path)
+
+        lang = language
+        language_detected = language is None
+        decode_seconds = 0.0
+        # Время начала carry (перенесённого хвоста окна) от начала файла
+        window_start = offset
+        carry = np.zeros(0, dtype=np.float32)
+        # Окна декодируются в отдельном потоке; decode_seconds — только время, которое
+        # распознавание ждало очередное окно
+        windows = _prefetch(
+            stream_pcm(audio_path, sampling_rate, STREAM_WINDOW_SECONDS, start=offset),
+            PIPELINE_PREFETCH,
+        )
+        with closing(windows), tracing.span("stream", beam_size=beam_size, resumed_from=offset):
+            while True:
+                decode_start = time.perf_counter()
+                pcm = next(windows, None)
+                decode_seconds += time.perf_counter() - decode_start
+                final = pcm is None
+                audio = carry if final else np.concatenate([carry, pcm])
+                if final and len(audio) < sampling_rate // 10:
+                    # Остаток короче 0,1 с (погрешность границ сегментов) не распознаём
+                    window_start += len(audio) / sampling_rate
+                    break
+
+                # Модель занимается на одно окно: между окнами длинного файла успевают
+                # распознаваться короткие задачи других потоков воркера
+                with _inference_slot():
+                    if language is None:
+                        # Только по первому окну: язык не меняется посреди записи
+                        language = _detect_language(audio, sampling_rate, checkpoint)
+                    inference_start = time.perf_counter()
+                    previous_inference_seconds = inference_seconds
+                    segments, info = model.transcribe(
+                        audio, language=language, beam_size=beam_size, **options
+                    )
+                    lang = getattr(info, "language", None)
+
+                    def keep(segment) -> None:
+                        full_text.append(segment.text)
+                        if checkpoint is not None:
+                            checkpoint.add_segment(
+                                window_start + segment.start,
+                                window_start + segment.end,
+                                segment.text,
+                                previous_inference_seconds + time.perf_counter() - inference_start,
+                            )
+
+                    # Сегмент сохраняется, когда декодер перешёл к следующему: последний
+                    # сегмент окна мог быть обрезан и распознаётся заново в следующем окне
+                    kept, pending = None, None
+                    for segment in segments:
+                        if pending is not None:
+                            keep(pending)
+                            kept = pending
+                        pending = segment
+                    held_back = pending is not None and kept is not None and not final
+                    if pending is not None and not held_back:
+                        keep(pending)
+                        kept = pending
+                    inference_seconds = previous_inference_seconds + time.perf_counter() - inference_start
+
+                if final:
+                    window_start += len(audio) / sampling_rate
+                    break
+                cut = kept.end if held_back else len(audio) / sampling_rate
+                carry = audio[int(cut * sampling_rate):]
+                window_start += cut
+                if kept is not None:
+                    options["initial_prompt"] = kept.text
+        metrics.STAGE_LATENCY.labels(stage="decode").observe(decode_seconds)
+        metrics.STAGE_LATENCY.labels(stage="inference").observe(inference_seconds)
+
+        text = " ".join(full_text).strip()
+        logger.info(
+            f"Потоковая транскрибация завершена. Язык: {lang}, длительность аудио: "
+            f"{window_start:.1f} с, декодирование: {decode_seconds:.1f} с, инференс: {inference_seconds:.1f} с"
+        )
+        return {
+            "text": text,
+            "language": lang,
+            "language_detected": language_detected,
+            "audio_duration": window_start,
+            "decode_seconds": decode_seconds,
+            "inference_seconds": inference_seconds,
+            **model_settings(),
+        }
+    except Exception as e:
+        logger.exception(f"Ошибка при потоковой транскрибации: {e}")
+        return None
 
 
 def extract_audio_from_video(video_path: str, output_audio_path: str) -> bool:
     logger.info(f"Начало extract_audio_from_video для файла: {video_path}")
     try:
         logger.info(f"Извлечение аудио из видео: {video_path} в {output_audio_path}")
-        video = AudioSegment.from_file(video_path)
-        video.export(output_audio_path, format="mp3")
+        with metrics.track_stage("audio_extract"), tracing.span("audio_extract"):
+            video = AudioSegment.from_file(video_path)
+            video.export(output_audio_path, format="mp3")
         logger.info("Аудио успешно извлечено.")
         return True
     except Exception as e:
@@ -159,22 +527,42 @@ def extract_audio_from_video(video_path: str, output_audio_path: str) -> bool:
         return False
 
 
-def transcribe_media_sync(file_path: str, file_type: str, language: str = "ru") -> tuple[str | None, str | None]:
+def transcribe_media_sync(
+    file_path: str,
+    file_type: str,
+    language: str | None = "ru",
+    checkpoint: checkpoints.Checkpoint | None = None,
+) -> dict | None:
+    """Распознать медиафайл; результат в формате transcribe_audio."""
     logger.info(
         f"Начало transcribe_media_sync для файла: {file_path}, тип: {file_type}, язык: {language}"
     )
+    if file_type in STREAMED_FILE_TYPES:
+        return transcribe_stream(file_path, language=language, checkpoint=checkpoint)
+
     audio_to_transcribe_path = file_path
     temp_audio_file = None
 
     try:
         if file_type == "video_note":
-            temp_audio_file = file_path + ".mp3"
+            # Временный файл пишем в data/: каталог исходного файла может быть
+            # только для чтения (файлы локального сервера Bot API)
+            temp_audio_file = os.path.join(
+                TEMP_DIR, f"{uuid.uuid4().hex}_{os.path.basename(file_path)}.mp3"
+            )
+            extract_start = time.perf_counter()
             success = extract_audio_from_video(file_path, temp_audio_file)
+            extract_seconds = time.perf_counter() - extract_start
             if not success:
-                return None, None
+                return None
             audio_to_transcribe_path = temp_audio_file
+        else:
+            extract_seconds = 0.0
 
-        text, lang = transcribe_audio(audio_to_transcribe_path, language=language)
+        result = transcribe_audio(audio_to_transcribe_path, language=language, checkpoint=checkpoint)
+        if result is not None:
+            # Извлечение дорожки из видео тоже считается временем декодирования
+            result["decode_seconds"] += extract_seconds
         # Удаляем временный файл сразу после обработки
         if temp_audio_file and os.path.exists(temp_audio_file):
             try:
@@ -182,7 +570,7 @@ def transcribe_media_sync(file_path: str, file_type: str, language: str = "ru")
                 logger.info(f"Временный аудиофайл удален: {temp_audio_file}")
             except Exception as e:
                 logger.warning(f"Не удалось удалить временный файл {temp_audio_file}: {e}")
-        return text, lang
+        return result
     finally:
         # Дополнительная проверка на случай, если файл не был удален выше
         if temp_audio_file and os.path.exists(temp_audio_file):
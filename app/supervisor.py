@@ -0,0 +1,231 @@
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+
+from dotenv import load_dotenv
+
+from huey.api import PeriodicTask
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+HUEY_WORKER_COUNT = int(os.getenv("HUEY_WORKER_COUNT", "1"))
+# Пороги переработки процесса воркера (0 — без ограничения)
+HUEY_WORKER_MAX_RSS_MB = float(os.getenv("HUEY_WORKER_MAX_RSS_MB", "0"))
+HUEY_WORKER_MAX_TASKS = int(os.getenv("HUEY_WORKER_MAX_TASKS", "0"))
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int:
+    """Текущий RSS процесса (Linux: /proc/self/statm), иначе пиковый."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryGovernor:
+    """
+    Следит за RSS и числом задач процесса воркера после каждой задачи. При
+    превышении порога просит супервизор заменить процесс и продолжает
+    работать, пока замена не загрузит модель.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.tasks = 0
+        self.recycle_requested = False
+        # Задачи выполняются в нескольких потоках консьюмера
+        self._lock = threading.Lock()
+
+    def after_task(self, task, task_value, exception) -> None:
+        if isinstance(task, PeriodicTask):
+            return
+        with self._lock:
+            self._after_task()
+
+    def _after_task(self) -> None:
+        self.tasks += 1
+        rss = current_rss_bytes()
+        metrics.WORKER_RSS.set(rss)
+        metrics.WORKER_RSS_PEAK.set(peak_rss_bytes())
+        reason = None
+        if HUEY_WORKER_MAX_RSS_MB > 0 and rss > HUEY_WORKER_MAX_RSS_MB * 1024 * 1024:
+            reason = "rss"
+        elif HUEY_WORKER_MAX_TASKS > 0 and self.tasks >= HUEY_WORKER_MAX_TASKS:
+            reason = "tasks"
+        if reason is not None:
+            if not self.recycle_requested:
+                logger.warning(
+                    f"Воркер {os.getpid()} превысил порог ({reason}): "
+                    f"RSS {rss / 1024 / 1024:.0f} МБ, задач {self.tasks}. Запрошена замена."
+                )
+                self.recycle_requested = True
+            # Повторяется после каждой задачи, пока замена не готова: если
+            # замена не запустилась, супервизор попробует снова
+            self.conn.send(("recycle", reason))
+
+
+def _worker_main(conn: Connection, periodic: bool) -> None:
+    """Процесс воркера: загрузить модель, сообщить о готовности и разбирать очередь."""
+    logging.basicConfig(format=tracing.LOG_FORMAT, level=logging.INFO)
+    tracing.init_tracing("whisper-bot-worker")
+    try:
+        from huey_tasks import huey
+        from stt_processor import NUM_WORKERS, PIPELINE_PREFETCH
+    except KeyboardInterrupt:
+        # Остановка во время загрузки модели
+        return
+
+    governor = MemoryGovernor(conn)
+    huey.post_execute()(governor.after_task)
+    metrics.WORKER_RSS.set(current_rss_bytes())
+    metrics.WORKER_RSS_PEAK.set(peak_rss_bytes())
+    conn.send(("ready", None))
+    # Модель одна на процесс: NUM_WORKERS потоков распознают, ещё PIPELINE_PREFETCH
+    # забирают следующие задачи из очереди и декодируют их, пока модель занята.
+    # SIGINT — мягкая остановка: текущие задачи дорабатывают, новые не берутся
+    consumer = huey.create_consumer(
+        workers=NUM_WORKERS + PIPELINE_PREFETCH, worker_type="thread", periodic=periodic
+    )
+    consumer.run()
+
+
+@dataclass
+class _Worker:
+    slot: int
+    process: multiprocessing.Process
+    conn: Connection
+    # Процесс, который заменяет этот (загружает модель)
+    replacement: "_Worker | None" = None
+    retiring: bool = False
+
+
+class Supervisor:
+    """
+    Запускает HUEY_WORKER_COUNT процессов воркеров и перерабатывает их по
+    сигналу MemoryGovernor: сначала поднимается замена, и только когда она
+    загрузила модель, старый процесс мягко останавливается. Упавшие процессы
+    перезапускаются.
+    """
+
+    def __init__(self, count: int = HUEY_WORKER_COUNT):
+        self.count = count
+        self.context = multiprocessing.get_context("spawn")
+        # Текущий процесс каждого слота
+        self.workers: dict[int, _Worker] = {}
+        # Все запущенные и ещё не завершившиеся процессы, включая замены и уходящие
+        self.alive: list[_Worker] = []
+        self._stopping = False
+
+    def _spawn(self, slot: int) -> _Worker:
+        parent_conn, child_conn = self.context.Pipe()
+        # Периодические задачи (восстановление брошенных задач) планирует один процесс
+        process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, slot == 0),
+            name=f"huey-worker-{slot}",
+        )
+        process.start()
+        child_conn.close()
+        logger.info(f"Запущен воркер {slot} (pid {process.pid})")
+        worker = _Worker(slot, process, parent_conn)
+        self.alive.append(worker)
+        return worker
+
+    def _retire(self, worker: _Worker) -> None:
+        worker.retiring = True
+        if worker.process.is_alive():
+            os.kill(worker.process.pid, signal.SIGINT)
+
+    def _handle_message(self, worker: _Worker, message: tuple) -> None:
+        kind, payload = message
+        if kind == "ready":
+            current = self.workers.get(worker.slot)
+            if current is not None and current.replacement is worker:
+                # Замена готова: старый процесс дорабатывает текущую задачу и выходит
+                logger.info(
+                    f"Воркер {worker.slot} заменён: pid {current.process.pid} -> {worker.process.pid}"
+                )
+                self.workers[worker.slot] = worker
+                self._retire(current)
+        elif kind == "recycle" and not self._stopping:
+            if worker.replacement is None and not worker.retiring:
+                metrics.WORKER_RECYCLES.labels(reason=payload).inc()
+                worker.replacement = self._spawn(worker.slot)
+
+    def _handle_exit(self, worker: _Worker) -> None:
+        pid = worker.process.pid
+        worker.process.join()
+        worker.conn.close()
+        if PROMETHEUS_MULTIPROC_DIR:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(pid)
+        self.alive.remove(worker)
+        if worker.retiring or self._stopping:
+            return
+        current = self.workers.get(worker.slot)
+        if current is worker:
+            logger.error(
+                f"Воркер {worker.slot} (pid {pid}) завершился с кодом {worker.process.exitcode}, перезапуск"
+            )
+            if worker.replacement is not None:
+                # Замена уже загружает модель: она и займёт слот
+                self.workers[worker.slot] = worker.replacement
+            else:
+                self.workers[worker.slot] = self._spawn(worker.slot)
+        elif current is not None and current.replacement is worker:
+            # Замена упала до готовности: старый процесс продолжает работать
+            # и запросит замену снова после следующей задачи
+            logger.error(f"Замена воркера {worker.slot} (pid {pid}) не запустилась")
+            current.replacement = None
+
+    def _stop(self, *args) -> None:
+        if self._stopping:
+            return
+        logger.info("Остановка воркеров...")
+        self._stopping = True
+        for worker in self.alive:
+            if worker.process.is_alive():
+                os.kill(worker.process.pid, signal.SIGINT)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for slot in range(self.count):
+            self.workers[slot] = self._spawn(slot)
+
+        while self.alive:
+            handles = {}
+            for worker in self.alive:
+                handles[worker.process.sentinel] = worker
+                if not worker.conn.closed:
+                    handles[worker.conn] = worker
+            for handle in wait(list(handles), timeout=1.0):
+                worker = handles[handle]
+                if handle is worker.conn:
+                    try:
+                        self._handle_message(worker, worker.conn.recv())
+                    except (EOFError, OSError):
+                        worker.conn.close()
+                elif not worker.process.is_alive():
+                    self._handle_exit(worker)
+        logger.info("Все воркеры остановлены.")
@@ -1,3 +1,18 @@
-from huey import RedisHuey
+import os
 
-huey = RedisHuey("whisper-bot", host="redis", port=6379, db=0, results=True)
+from dotenv import load_dotenv
+
+from huey import MemoryHuey, PriorityRedisHuey
+
+load_dotenv()
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# "memory" — очередь в памяти процесса (для нагрузочных тестов с consumer в том же процессе)
+HUEY_BACKEND = os.getenv("HUEY_BACKEND", "redis")
+
+if HUEY_BACKEND == "memory":
+    huey = MemoryHuey("whisper-bot", results=True)
+else:
+    # Очередь с приоритетами: фоновые задачи (архивы администратора) не задерживают
+    # сообщения пользователей
+    huey = PriorityRedisHuey("whisper-bot", host=REDIS_HOST, port=REDIS_PORT, db=0, results=True)
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Iterator, Sequence
+
+from dotenv import load_dotenv
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# none — только идентификаторы трассировки в логах,
+# file — спаны в формате JSON Lines в TRACING_FILE,
+# otlp — отправка в коллектор по OTLP/HTTP (адрес задаётся OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "data/traces.jsonl")
+
+tracer = trace.get_tracer("whisper-bot")
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Дописывает завершённые спаны в файл, по одному JSON-объекту на строку."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(span.to_json(indent=None) + "\n")
+        except OSError as e:
+            logger.warning(f"Не удалось записать спаны в {self.path}: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def init_tracing(service_name: str) -> None:
+    """Настроить провайдер трассировки процесса и экспорт спанов по TRACING_EXPORTER."""
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if TRACING_EXPORTER == "file":
+        provider.add_span_processor(BatchSpanProcessor(JsonLinesSpanExporter(TRACING_FILE)))
+        logger.info(f"Спаны трассировки пишутся в {TRACING_FILE}")
+    elif TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        logger.info("Спаны трассировки отправляются в коллектор OTLP")
+    elif TRACING_EXPORTER != "none":
+        logger.warning(f"Неизвестный TRACING_EXPORTER={TRACING_EXPORTER}, экспорт отключён")
+    trace.set_tracer_provider(provider)
+
+
+def current_trace_id() -> str | None:
+    """Идентификатор текущей трассировки в hex или None вне спана."""
+    span_context = trace.get_current_span().get_span_context()
+    if not span_context.is_valid:
+        return None
+    return format(span_context.trace_id, "032x")
+
+
+def _attributes(attributes: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+def set_attributes(**attributes: Any) -> None:
+    """Добавить атрибуты к текущему спану."""
+    trace.get_current_span().set_attributes(_attributes(attributes))
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[trace.Span]:
+    """Дочерний спан текущей трассировки; исключения записываются в спан."""
+    with tracer.start_as_current_span(name, attributes=_attributes(attributes)) as current:
+        yield current
+
+
+def inject_context() -> dict[str, str]:
+    """Заголовки W3C Trace Context для передачи трассировки в задачу Huey."""
+    carrier: dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+@contextmanager
+def span_from(carrier: dict[str, str] | None, name: str, **attributes: Any) -> Iterator[trace.Span]:
+    """Спан, продолжающий трассировку, переданную через inject_context()."""
+    parent = propagate.extract(carrier or {})
+    with tracer.start_as_current_span(
+        name, context=parent, attributes=_attributes(attributes)
+    ) as current:
+        yield current
+
+
+def record_span(name: str, start_time: float, end_time: float, **attributes: Any) -> None:
+    """Записать задним числом спан с известными границами (время в секундах epoch)."""
+    tracer.start_span(
+        name, start_time=int(start_time * 1e9), attributes=_attributes(attributes)
+    ).end(end_time=int(end_time * 1e9))
+
+
+_default_record_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args: Any, **kwargs: Any) -> logging.LogRecord:
+    record = _default_record_factory(*args, **kwargs)
+    record.trace_id = current_trace_id() or "-"
+    return record
+
+
+# Каждая запись лога получает атрибут trace_id, доступный в формате как %(trace_id)s
+logging.setLogRecordFactory(_record_factory)
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s"
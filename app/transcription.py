@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+import checkpoints
+import metrics
+import profiling
+import tracing
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# "huey" — задачи уходят в очередь Huey (Redis) и выполняются отдельным воркером,
+# "embedded" — пул процессов внутри бота, без Redis (одна машина)
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "huey")
+EMBEDDED_WORKERS = int(os.getenv("EMBEDDED_WORKERS", "1"))
+# Как часто бот читает промежуточный результат задачи из контрольной точки, с
+PROGRESS_POLL_SECONDS = float(os.getenv("PROGRESS_POLL_SECONDS", "5"))
+# Приоритет фоновых задач в очереди Huey: интерактивные (приоритет 0) выполняются раньше
+BACKGROUND_PRIORITY = -10
+
+_pool: ProcessPoolExecutor | None = None
+# Задачи, отправленные в пул и ещё не завершённые (включая выполняемые)
+_submitted = 0
+# Во встроенном режиме приоритетов нет: фоновые задачи занимают не все процессы пула
+_background_slots: asyncio.Semaphore | None = None
+
+
+def run_transcription(
+    file_path: str,
+    file_type: str,
+    language: str | None = "ru",
+    enqueued_at: float | None = None,
+    trace_context: dict | None = None,
+    keep_file: bool = False,
+    job_id: str | None = None,
+    priority: int | None = None,
+) -> dict | None:
+    """
+    Тело задачи транскрибации, общее для воркера Huey и встроенного пула.
+    trace_context — заголовки W3C Trace Context из бота: спаны воркера
+    продолжают трассировку сообщения.
+    keep_file — файл принадлежит локальному серверу Bot API и не удаляется.
+    language=None — язык определяется воркером по началу аудио.
+    job_id — идентификатор задачи, под которым ведётся контрольная точка.
+    priority — приоритет задачи Huey, с которым она ставится в очередь повторно.
+    """
+    with tracing.span_from(
+        trace_context, "transcribe_task", file_type=file_type, language=language
+    ):
+        if enqueued_at is not None:
+            now = time.time()
+            metrics.STAGE_LATENCY.labels(stage="queue_wait").observe(max(0.0, now - enqueued_at))
+            tracing.record_span("queue_wait", enqueued_at, now)
+        job = {
+            "args": [file_path, file_type, language],
+            "kwargs": {"trace_context": trace_context, "keep_file": keep_file},
+            "priority": priority,
+        }
+        with checkpoints.track(job_id, job) as checkpoint:
+            if checkpoint is not None and checkpoint.result is not None:
+                # Задача уже завершилась, но результат не успел попасть в Huey
+                logger.info(f"Задача {job_id} уже выполнена, результат взят из контрольной точки")
+                return checkpoint.result
+            return _transcribe(
+                file_path, file_type, language, keep_file, checkpoint, background=(priority or 0) < 0
+            )
+
+
+def _transcribe(
+    file_path: str,
+    file_type: str,
+    language: str | None,
+    keep_file: bool,
+    checkpoint: checkpoints.Checkpoint | None,
+    background: bool = False,
+):
+    # Модель загружается при импорте stt_processor, поэтому только в процессах воркеров
+    from stt_processor import transcribe_media_sync
+
+    try:
+        # Счётчик профилирования хранится в Redis, которого во встроенном режиме нет.
+        # Фоновые задачи не профилируются: профиль некому отправить, а слоты
+        # /profile предназначены для сообщений пользователей
+        profiler = (
+            profiling.start_if_requested()
+            if EXECUTION_MODE != "embedded" and not background
+            else None
+        )
+        try:
+            result = transcribe_media_sync(
+                file_path, file_type, language=language, checkpoint=checkpoint
+            )
+        finally:
+            if profiler is not None:
+                profiler.stop()
+        if profiler is not None and result:
+            result["profile"] = profiling.save_profile(profiler, tracing.current_trace_id())
+        if result:
+            tracing.set_attributes(
+                audio_duration=result["audio_duration"],
+                decode_seconds=result["decode_seconds"],
+                inference_seconds=result["inference_seconds"],
+                model=result["model"],
+            )
+        # Результат сохраняется до удаления исходного файла: повтор задачи после
+        # падения воркера вернёт его, не обращаясь к файлу
+        if checkpoint is not None and result:
+            checkpoint.finish(result)
+        # Удаляем файл сразу после обработки, до возврата результата
+        if not keep_file and file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.info(f"Файл успешно удален после обработки: {file_path}")
+            except Exception as e:
+                logger.warning(f"Не удалось удалить файл {file_path}: {e}")
+        return result
+    except Exception as e:
+        logger.exception(f"Ошибка при обработке файла {file_path}: {e}")
+        # Удаляем файл даже при ошибке
+        if not keep_file and file_path and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.info(f"Файл удален после ошибки: {file_path}")
+            except Exception as remove_error:
+                logger.warning(f"Не удалось удалить файл {file_path} после ошибки: {remove_error}")
+        raise
+
+
+def _init_embedded_worker() -> None:
+    """Инициализация процесса пула: логи, трассировка и загрузка модели Whisper."""
+    logging.basicConfig(format=tracing.LOG_FORMAT, level=logging.INFO)
+    tracing.init_tracing("whisper-bot-worker")
+    import stt_processor
+
+    metrics.WORKERS.inc(stt_processor.NUM_WORKERS)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: процесс пула не наследует потоки и соединения бота
+        _pool = ProcessPoolExecutor(
+            max_workers=EMBEDDED_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_embedded_worker,
+        )
+    return _pool
+
+
+def start() -> None:
+    """Во встроенном режиме заранее запустить процессы пула и загрузить модель."""
+    if EXECUTION_MODE != "embedded":
+        return
+    checkpoints.clear_embedded()
+    pool = _get_pool()
+    for _ in range(EMBEDDED_WORKERS):
+        pool.submit(os.getpid)
+    logger.info(f"Встроенный пул транскрибации: {EMBEDDED_WORKERS} процесс(ов)")
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def pending_count() -> int:
+    """Число задач, ожидающих свободного воркера."""
+    if EXECUTION_MODE == "embedded":
+        return max(0, _submitted - EMBEDDED_WORKERS)
+    from huey_tasks import huey
+
+    return huey.pending_count()
+
+
+async def transcribe(
+    file_path: str,
+    file_type: str,
+    language: str | None = "ru",
+    trace_context: dict | None = None,
+    keep_file: bool = False,
+    on_progress: Callable[[dict], None] | None = None,
+    background: bool = False,
+) -> dict | None:
+    """
+    Распознать файл в воркере Huey или во встроенном пуле, в зависимости от EXECUTION_MODE.
+    on_progress вызывается с промежуточным результатом (checkpoints.progress),
+    пока задача выполняется.
+    background — пакетная задача, которая не должна задерживать сообщения
+    пользователей: в очереди Huey у неё низкий приоритет, во встроенном пуле
+    фоновые задачи занимают не больше EMBEDDED_WORKERS - 1 процессов.
+    """
+    global _background_slots
+    enqueued_at = time.time()
+    if EXECUTION_MODE == "embedded":
+        if background and _background_slots is None:
+            _background_slots = asyncio.Semaphore(max(1, EMBEDDED_WORKERS - 1))
+        job_id = checkpoints.embedded_job_id()
+        try:
+            async with _background_slots if background else nullcontext():
+                return await _watch(
+                    _transcribe_embedded(
+                        file_path, file_type, language, enqueued_at, trace_context, keep_file, job_id
+                    ),
+                    job_id,
+                    on_progress,
+                )
+        finally:
+            checkpoints.remove(job_id)
+
+    from huey.contrib.asyncio import aget_result
+
+    from huey_tasks import transcribe_task
+
+    huey_task = transcribe_task(
+        file_path,
+        file_type,
+        language,
+        enqueued_at=enqueued_at,
+        trace_context=trace_context,
+        keep_file=keep_file,
+        priority=BACKGROUND_PRIORITY if background else None,
+    )
+    return await _watch(
+        aget_result(huey_task, backoff=1.15, max_delay=1.0, preserve=False),
+        huey_task.id,
+        on_progress,
+    )
+
+
+async def _watch(
+    result: Awaitable[dict | None], job_id: str, on_progress: Callable[[dict], None] | None
+) -> dict | None:
+    """Дождаться результата задачи, передавая её прогресс в on_progress."""
+    if on_progress is None:
+        return await result
+    waiter = asyncio.ensure_future(result)
+    last_offset = None
+    try:
+        while True:
+            done, _ = await asyncio.wait({waiter}, timeout=PROGRESS_POLL_SECONDS)
+            if done:
+                return waiter.result()
+            progress = checkpoints.progress(job_id)
+            if progress is not None and progress["offset"] != last_offset:
+                last_offset = progress["offset"]
+                on_progress(progress)
+    finally:
+        waiter.cancel()
+
+
+async def _transcribe_embedded(
+    file_path: str,
+    file_type: str,
+    language: str | None,
+    enqueued_at: float,
+    trace_context: dict | None,
+    keep_file: bool,
+    job_id: str,
+) -> dict | None:
+    global _pool, _submitted
+    pool = _get_pool()
+    _submitted += 1
+    try:
+        # Аргументы и результат передаются через канал пула, без Redis и опроса результата
+        return await asyncio.get_running_loop().run_in_executor(
+            pool,
+            run_transcription,
+            file_path,
+            file_type,
+            language,
+            enqueued_at,
+            trace_context,
+            keep_file,
+            job_id,
+        )
+    except BrokenProcessPool:
+        # Процесс пула упал (например, OOM): следующая задача создаст новый пул
+        logger.error("Процесс встроенного пула транскрибации завершился аварийно")
+        if _pool is pool:
+            _pool = None
+        raise
+    finally:
+        _submitted -= 1
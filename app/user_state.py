@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+
+from typing import Any
+
+from dotenv import load_dotenv
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# "redis" — состояние общее для всех реплик бота (webhook за балансировщиком),
+# "memory" — в памяти процесса (одна реплика, встроенный режим, нагрузочные тесты)
+USER_STATE_BACKEND = os.getenv(
+    "USER_STATE_BACKEND", "memory" if os.getenv("EXECUTION_MODE") == "embedded" else "redis"
+)
+KEY_PREFIX = "whisper-bot:user-state:"
+
+_client: aioredis.Redis | None = None
+_memory: dict[int, dict[str, Any]] = {}
+
+
+def _get_client() -> aioredis.Redis:
+    global _client
+    if _client is None:
+        _client = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+    return _client
+
+
+async def get_state(user_id: int, field: str, default: Any = None) -> Any:
+    """Прочитать поле состояния пользователя (действие администратора, поиск)."""
+    if USER_STATE_BACKEND == "memory":
+        return _memory.get(user_id, {}).get(field, default)
+    try:
+        raw = await _get_client().hget(f"{KEY_PREFIX}{user_id}", field)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать состояние пользователя {user_id}: {e}")
+        return default
+    return json.loads(raw) if raw is not None else default
+
+
+async def set_state(user_id: int, field: str, value: Any) -> None:
+    """Записать поле состояния пользователя; None удаляет поле."""
+    if USER_STATE_BACKEND == "memory":
+        if value is None:
+            _memory.get(user_id, {}).pop(field, None)
+        else:
+            _memory.setdefault(user_id, {})[field] = value
+        return
+    key = f"{KEY_PREFIX}{user_id}"
+    try:
+        if value is None:
+            await _get_client().hdel(key, field)
+        else:
+            await _get_client().hset(key, field, json.dumps(value, ensure_ascii=False))
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить состояние пользователя {user_id}: {e}")
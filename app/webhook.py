@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+
+from dotenv import load_dotenv
+
+import tornado.httpserver
+import tornado.web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+# Публичный адрес (без пути), который регистрируется в Telegram при запуске.
+# Если не задан, вебхук не регистрируется: так запускаются дополнительные реплики
+# за балансировщиком и локальная отладка.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateHandler(tornado.web.RequestHandler):
+    """Принимает JSON обновления и кладёт его в очередь обработки приложения."""
+
+    def initialize(self, bot_application: Application) -> None:
+        self.bot_application = bot_application
+
+    async def post(self) -> None:
+        if WEBHOOK_SECRET and self.request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            self.set_status(403)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            self.set_status(400)
+            return
+        await self.bot_application.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Проверка живости для балансировщика."""
+
+    def get(self) -> None:
+        self.write("ok")
+
+
+async def serve(application: Application) -> None:
+    """
+    Запустить приложение в режиме вебхука: обновления принимает встроенный
+    HTTP-сервер на WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH, жизненный цикл
+    (post_init/post_shutdown) тот же, что у run_polling.
+    """
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    if WEBHOOK_URL:
+        url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+        await application.bot.set_webhook(
+            url=url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Вебхук зарегистрирован: {url}")
+
+    await application.start()
+    server = tornado.httpserver.HTTPServer(
+        tornado.web.Application(
+            [
+                (f"/{WEBHOOK_PATH}", UpdateHandler, {"bot_application": application}),
+                ("/healthz", HealthHandler),
+            ]
+        )
+    )
+    server.listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+    logger.info(f"Вебхук слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,218 @@
+"""
+Заглушка сервера Telegram Bot API для локальной проверки бота без Telegram.
+
+Отвечает на методы, которые вызывает бот (getMe, getUpdates, getFile,
+sendMessage, editMessageText, sendDocument, ...), и печатает исходящие
+сообщения. Файлы берутся из --files-dir: file_id — имя файла в этом каталоге.
+С --local getFile, как локальный сервер Bot API, возвращает абсолютный путь
+к файлу на диске (бот запускается с TELEGRAM_LOCAL_MODE=1), без --local —
+относительный путь, который скачивается через /file/bot<token>/<path>.
+
+Обновления подаются POST-запросом на /inject:
+
+    python bench/bot_api_stub.py --files-dir bench/corpus --local
+    TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_LOCAL_MODE=1 python app/bot.py
+    curl -X POST http://127.0.0.1:8081/inject \\
+        -d '{"user_id": 123, "voice": "synthetic_voice_short.ogg"}'
+"""
+
+import argparse
+import itertools
+import json
+import mimetypes
+import os
+import queue
+import time
+
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class BotApiStub:
+    def __init__(self, files_dir: str, local: bool):
+        self.files_dir = os.path.realpath(files_dir)
+        self.local = local
+        self.updates: "queue.Queue[dict]" = queue.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pending: list[dict] = []
+
+    def file_path(self, name: str) -> str:
+        path = os.path.realpath(os.path.join(self.files_dir, name))
+        if not path.startswith(self.files_dir + os.sep):
+            raise KeyError("file_id")
+        return path
+
+    def inject(self, payload: dict) -> dict:
+        user_id = int(payload.get("user_id", 1))
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Stub"},
+        }
+        if "text" in payload:
+            message["text"] = payload["text"]
+        for media_type in ("voice", "video_note", "audio", "video", "document"):
+            name = payload.get(media_type)
+            if name:
+                path = self.file_path(name)
+                message[media_type] = {
+                    "file_id": name,
+                    "file_unique_id": name,
+                    "duration": int(payload.get("duration", 1)),
+                    "file_size": os.path.getsize(path) if os.path.exists(path) else 0,
+                    **({"length": 240} if media_type == "video_note" else {}),
+                    **({"width": 640, "height": 360} if media_type == "video" else {}),
+                }
+                if media_type in ("audio", "video", "document"):
+                    message[media_type]["file_name"] = os.path.basename(name)
+                    message[media_type]["mime_type"] = (
+                        mimetypes.guess_type(name)[0] or "application/octet-stream"
+                    )
+                if media_type == "document":
+                    del message[media_type]["duration"]
+        update = {"update_id": next(self._update_ids), "message": message}
+        self.updates.put(update)
+        return update
+
+    def get_updates(self, offset: int, timeout: float) -> list[dict]:
+        # Long polling: ждём первое обновление не дольше timeout, затем забираем остальные
+        self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending:
+            try:
+                self._pending.append(self.updates.get(timeout=timeout))
+            except queue.Empty:
+                return []
+        while True:
+            try:
+                self._pending.append(self.updates.get_nowait())
+            except queue.Empty:
+                return list(self._pending)
+
+    def call(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        if method == "getUpdates":
+            return self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method == "getFile":
+            file_id = params["file_id"]
+            path = self.file_path(file_id)
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": os.path.getsize(path) if os.path.exists(path) else 0,
+                "file_path": path if self.local else file_id,
+            }
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id") or 0)
+            text = params.get("text") or params.get("caption") or "<document>"
+            print(f"{method} -> {chat_id}: {text}", flush=True)
+            if method == "editMessageText":
+                return True
+            return {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+        if method == "getChat":
+            return {"id": int(params.get("chat_id") or 0), "type": "private", "first_name": "Stub"}
+        return True
+
+
+def _parse_params(handler: BaseHTTPRequestHandler, body: bytes) -> dict:
+    content_type = handler.headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                params[name] = part.get_content().strip()
+        return params
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def make_handler(stub: BotApiStub):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            # /file/bot<token>/<file_path> — скачивание в нелокальном режиме
+            if len(parts) >= 3 and parts[0] == "file":
+                try:
+                    path = stub.file_path(os.path.join(*parts[2:]))
+                except KeyError:
+                    path = ""
+                if not os.path.isfile(path):
+                    self._reply(404, {"ok": False, "description": "Not Found"})
+                    return
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self.do_POST()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path = urlparse(self.path).path.strip("/")
+            if path == "inject":
+                try:
+                    self._reply(200, stub.inject(json.loads(body or b"{}")))
+                except KeyError:
+                    self._reply(400, {"ok": False, "description": "Bad file name"})
+                return
+            parts = path.split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                self._reply(404, {"ok": False, "description": "Not Found"})
+                return
+            params = _parse_params(self, body)
+            params.update({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+            try:
+                self._reply(200, {"ok": True, "result": stub.call(parts[1], params)})
+            except KeyError as e:
+                self._reply(400, {"ok": False, "description": f"Bad Request: {e} is required"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--files-dir", default=".", help="Каталог с медиафайлами (file_id = имя файла)")
+    parser.add_argument("--local", action="store_true", help="Отдавать абсолютные пути, как локальный сервер Bot API")
+    args = parser.parse_args()
+
+    stub = BotApiStub(args.files_dir, args.local)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stub))
+    mode = "локальный" if args.local else "удалённый"
+    print(f"Заглушка Bot API ({mode} режим) на http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
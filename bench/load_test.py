@@ -0,0 +1,390 @@
+"""
+Сквозной нагрузочный тест конвейера без Telegram и OpenRouter.
+
+handle_media -> Huey -> transcribe_task -> LLM -> ответ. Синтетические Update
+подаются с заданной частотой, Telegram заменён записывающим Bot, OpenRouter —
+локальным HTTP-сервером с настраиваемой задержкой, очередь — Huey в памяти
+(или локальный Redis), consumer работает в этом же процессе.
+
+    python bench/load_test.py --rate 5 --duration 60 --workers 2 --fake-stt-latency 1.5
+    python bench/load_test.py --rate 1 --duration 30 --fixture bench/corpus/synthetic_voice_short.ogg
+    python bench/load_test.py --rate 1 --duration 30 --execution embedded --fixture bench/corpus/synthetic_voice_short.ogg
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import types
+import wave
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+
+# Тексты статусов handle_media, по которым отмечаются границы этапов
+STAGE_MARKERS = {
+    "Файл скачан": "downloaded",
+    "Транскрибация завершена": "transcribed",
+    "Текст исправлен": "corrected",
+    "Исправление текста не потребовалось": "corrected",
+}
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))], 4)
+
+    return {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1], 4)}
+
+
+def _write_tone_fixture(path: str, seconds: float = 5.0) -> None:
+    """Простейшая WAV-фикстура для режима с поддельным STT."""
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(
+            b"".join(
+                struct.pack("<h", int(3000 * math.sin(i * 2 * math.pi * 440 / 16000)))
+                for i in range(int(16000 * seconds))
+            )
+        )
+
+
+def _start_mock_llm(latency: float) -> tuple[ThreadingHTTPServer, str]:
+    """Локальный сервер в формате OpenRouter: возвращает исходный текст с задержкой."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):  # noqa: N802
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            time.sleep(latency)
+            prompt = body["messages"][-1]["content"]
+            text = prompt.rsplit("\n\n", 1)[-1]
+            payload = json.dumps({"choices": [{"message": {"content": text + "."}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+
+
+def _install_fake_stt(latency: float) -> None:
+    """Подменить stt_processor, чтобы мерить конвейер без загрузки модели Whisper."""
+    module = types.ModuleType("stt_processor")
+
+    def transcribe_media_sync(file_path: str, file_type: str, language: str | None = "ru", checkpoint=None):
+        time.sleep(latency)
+        return {
+            "text": "Привет перезвони мне пожалуйста",
+            "language": language,
+            "audio_duration": 3.0,
+            "decode_seconds": 0.0,
+            "inference_seconds": latency,
+            "model": "fake",
+            "compute_type": "fake",
+            "beam_size": 1,
+            "cpu_threads": 1,
+        }
+
+    module.transcribe_media_sync = transcribe_media_sync
+    module.NUM_WORKERS = 1
+    sys.modules["stt_processor"] = module
+
+
+class Recorder:
+    """Хранит временные метки этапов для каждого чата и событий очереди."""
+
+    def __init__(self):
+        self.chats: dict[int, dict[str, float]] = {}
+        self.enqueued: dict[str, float] = {}
+        self.queue_wait: list[float] = []
+        self.worker_time: list[float] = []
+        self.edits = 0
+        self._executing: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, chat_id: int, stage: str) -> None:
+        self.chats.setdefault(chat_id, {}).setdefault(stage, time.perf_counter())
+
+    def on_huey_signal(self, signal: str, task) -> None:
+        from huey.signals import SIGNAL_COMPLETE, SIGNAL_ENQUEUED, SIGNAL_ERROR, SIGNAL_EXECUTING
+
+        now = time.perf_counter()
+        with self._lock:
+            if signal == SIGNAL_ENQUEUED:
+                self.enqueued[task.id] = now
+            elif signal == SIGNAL_EXECUTING:
+                self._executing[task.id] = now
+                if task.id in self.enqueued:
+                    self.queue_wait.append(now - self.enqueued[task.id])
+            elif signal in (SIGNAL_COMPLETE, SIGNAL_ERROR):
+                started = self._executing.pop(task.id, None)
+                if started is not None:
+                    self.worker_time.append(now - started)
+
+
+def _make_recording_bot(recorder: Recorder, fixture: str, api_latency: float):
+    from telegram import Bot, File, Message
+
+    class RecordingBot(Bot):
+        """Bot, который не ходит в Telegram, а записывает отправки и правки."""
+
+        _next_message_id = 1000
+
+        def _message(self, chat_id: int, text: str) -> Message:
+            RecordingBot._next_message_id += 1
+            return Message.de_json(
+                {
+                    "message_id": RecordingBot._next_message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": text,
+                },
+                self,
+            )
+
+        async def send_message(self, chat_id, text, **kwargs):
+            stages = recorder.chats.get(chat_id, {})
+            final = "status_sent" in stages
+            if final:
+                recorder.mark(chat_id, "reply_started")
+            await asyncio.sleep(api_latency)
+            recorder.mark(chat_id, "replied" if final else "status_sent")
+            return self._message(chat_id, text)
+
+        async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+            recorder.edits += 1
+            await asyncio.sleep(api_latency)
+            return True
+
+        async def get_file(self, file_id, **kwargs):
+            telegram_file = File(file_id=file_id, file_unique_id=file_id, file_path=fixture)
+            telegram_file.set_bot(self)
+            return telegram_file
+
+    return RecordingBot("0:load-test")
+
+
+def _make_update(bot, update_id: int, user_id: int, chat_id: int):
+    from telegram import Update
+
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+                "voice": {"file_id": f"voice-{update_id}", "file_unique_id": f"u{update_id}", "duration": 5},
+            },
+        },
+        bot,
+    )
+
+
+async def _drive(bot_module, bot, recorder: Recorder, args) -> dict:
+    bot_module.task_writer.start()
+    bot_module.status_updater.start()
+    request_edit = bot_module.status_updater.edit
+
+    def edit(message, text, **kwargs):
+        # Правки схлопываются и уходят с задержкой, поэтому границы этапов
+        # отмечаются в момент запроса правки, а не её отправки
+        if message is not None:
+            for marker, stage in STAGE_MARKERS.items():
+                if text.startswith(marker):
+                    recorder.mark(message.chat_id, stage)
+        request_edit(message, text, **kwargs)
+
+    bot_module.status_updater.edit = edit
+    queue_samples = []
+    in_flight = set()
+    stop_sampling = asyncio.Event()
+
+    async def sample_queue():
+        started = time.perf_counter()
+        while not stop_sampling.is_set():
+            queue_samples.append(
+                {
+                    "t": round(time.perf_counter() - started, 2),
+                    "queue_depth": bot_module.transcription.pending_count(),
+                    "in_flight": len(in_flight),
+                }
+            )
+            await asyncio.sleep(args.sample_interval)
+
+    async def handle(update, chat_id):
+        recorder.mark(chat_id, "received")
+        context = types.SimpleNamespace(user_data={}, args=None, bot=bot)
+        try:
+            await bot_module.handle_media(update, context)
+        finally:
+            recorder.mark(chat_id, "done")
+
+    sampler = asyncio.create_task(sample_queue())
+    total = int(args.rate * args.duration)
+    start = time.perf_counter()
+    for i in range(total):
+        delay = start + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat_id = 10_000_000 + i
+        user_id = 1 + i % args.users
+        task = asyncio.create_task(handle(_make_update(bot, i + 1, user_id, chat_id), chat_id))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    offered_seconds = time.perf_counter() - start
+
+    if in_flight:
+        await asyncio.wait(set(in_flight), timeout=args.drain_timeout)
+    stop_sampling.set()
+    await sampler
+    await bot_module.status_updater.close()
+    await bot_module.task_writer.close()
+
+    def span(first: str, second: str) -> list[float]:
+        return [s[second] - s[first] for s in recorder.chats.values() if first in s and second in s]
+
+    replied = [s for s in recorder.chats.values() if "replied" in s]
+    if replied:
+        window = max(s["replied"] for s in replied) - min(s["received"] for s in replied)
+    else:
+        window = 0.0
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "offered": total,
+        "offered_rate": round(total / offered_seconds, 2) if offered_seconds else None,
+        "completed": len(replied),
+        "sustained_rate": round(len(replied) / window, 2) if window else None,
+        "stages": {
+            "download": _percentiles(span("status_sent", "downloaded")),
+            "queue_wait": _percentiles(recorder.queue_wait),
+            "worker": _percentiles(recorder.worker_time),
+            "result_wait": _percentiles(span("downloaded", "transcribed")),
+            "llm": _percentiles(span("transcribed", "corrected")),
+            "reply": _percentiles(span("reply_started", "replied")),
+            "end_to_end": _percentiles(span("received", "replied")),
+        },
+        "queue_depth_max": max((s["queue_depth"] for s in queue_samples), default=0),
+        "status_edits": recorder.edits,
+        "queue_samples": queue_samples,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест конвейера бота")
+    parser.add_argument("--rate", type=float, default=2.0, help="Сообщений в секунду")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность подачи, с")
+    parser.add_argument("--users", type=int, default=20, help="Число разных пользователей")
+    parser.add_argument("--workers", type=int, default=1, help="Потоков Huey consumer или процессов встроенного пула")
+    parser.add_argument("--execution", choices=("huey", "embedded"), default="huey", help="EXECUTION_MODE бота")
+    parser.add_argument("--huey", choices=("memory", "redis"), default="memory")
+    parser.add_argument("--external-workers", action="store_true", help="Не запускать consumer (только с --huey redis)")
+    parser.add_argument("--fixture", help="Аудиофайл, который «скачивает» бот")
+    parser.add_argument("--fake-stt-latency", type=float, help="Заменить Whisper задержкой, с")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Задержка мок-LLM, с")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Задержка мок-Telegram, с")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--drain-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="Куда сохранить JSON с результатами")
+    args = parser.parse_args()
+    if args.execution == "embedded" and args.fake_stt_latency is not None:
+        # Процессы пула запускаются через spawn и не видят подменённый stt_processor
+        parser.error("--fake-stt-latency не поддерживается с --execution embedded")
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    workdir = tempfile.mkdtemp(prefix="whisper-load-")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    fixture = os.path.abspath(args.fixture) if args.fixture else os.path.join(workdir, "fixture.wav")
+    if not args.fixture:
+        _write_tone_fixture(fixture)
+
+    llm_server, llm_url = _start_mock_llm(args.llm_latency)
+    os.environ.update(
+        {
+            "DB_PATH": os.path.join(workdir, "data", "load_test.db"),
+            "EXECUTION_MODE": args.execution,
+            "EMBEDDED_WORKERS": str(args.workers),
+            "HUEY_BACKEND": args.huey,
+            "USER_STATE_BACKEND": "redis" if args.huey == "redis" else "memory",
+            "OPENROUTER_API_KEY": "load-test",
+            "OPENROUTER_MODEL_NAME": "load-test",
+            "LLM_CACHE_ENABLED": "0",
+        }
+    )
+    os.environ.pop("ADMIN_ID", None)
+    os.chdir(workdir)
+    sys.path.insert(0, APP_DIR)
+    if args.fake_stt_latency is not None:
+        _install_fake_stt(args.fake_stt_latency)
+
+    import bot as bot_module
+    import database
+    import llm
+
+    llm.OPENROUTER_API_URL = llm_url
+    for user_id in range(1, args.users + 1):
+        database.add_user(bot_module.DB_PATH, user_id)
+
+    recorder = Recorder()
+    consumer = None
+    if args.execution == "embedded":
+        bot_module.transcription.start()
+    else:
+        from huey_tasks import huey
+
+        huey.signal()(recorder.on_huey_signal)
+        if not args.external_workers:
+            consumer = huey.create_consumer(
+                workers=args.workers, worker_type="thread", periodic=False, initial_delay=0.01, max_delay=0.1
+            )
+            consumer.start()
+
+    bot = _make_recording_bot(recorder, fixture, args.api_latency)
+    try:
+        report = asyncio.run(_drive(bot_module, bot, recorder, args))
+    finally:
+        if consumer is not None:
+            consumer.stop(graceful=True)
+        bot_module.transcription.shutdown()
+        llm_server.shutdown()
+        database.close_db()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Подано: {report['offered']} ({report['offered_rate']}/с), обработано: {report['completed']}")
+    print(f"Устойчивая пропускная способность: {report['sustained_rate']} сообщ./с")
+    print(f"Максимальная глубина очереди: {report['queue_depth_max']}")
+    print(f"Правок статуса отправлено: {report['status_edits']}")
+    for stage, stats in report["stages"].items():
+        if stats["count"]:
+            print(f"  {stage:12} p50={stats['p50']}s p95={stats['p95']}s p99={stats['p99']}s max={stats['max']}s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
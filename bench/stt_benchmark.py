@@ -0,0 +1,376 @@
+"""
+Офлайн-бенчмарк распознавания речи.
+
+Прогоняет transcribe_media_sync по фиксированному корпусу голосовых сообщений
+и видео-кружков для матрицы параметров Whisper и сохраняет результаты в JSON
+для сравнения между коммитами.
+
+    python bench/stt_benchmark.py generate
+    python bench/stt_benchmark.py run --param WHISPER_MODEL=tiny,small --param WHISPER_BEAM_SIZE=1,5
+    python bench/stt_benchmark.py compare bench/results/old.json bench/results/new.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+DEFAULT_CORPUS = os.path.join(BENCH_DIR, "corpus")
+DEFAULT_RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+MANIFEST_NAME = "manifest.json"
+
+# Параметры, которые можно перебирать в матрице (читаются stt_processor при импорте)
+MATRIX_PARAMS = (
+    "WHISPER_MODEL",
+    "WHISPER_COMPUTE_TYPE",
+    "WHISPER_BEAM_SIZE",
+    "WHISPER_CPU_THREADS",
+    "WHISPER_NUM_WORKERS",
+)
+
+SYNTHETIC_PHRASES = [
+    "Привет, перезвони мне, пожалуйста, когда освободишься.",
+    "Завтра в десять утра у нас встреча с командой, не опаздывай.",
+    "Купи, пожалуйста, хлеб, молоко и десяток яиц по дороге домой.",
+    "Отправляю тебе отчёт за прошлую неделю, посмотри его до пятницы.",
+]
+# (имя, тип файла, примерная длительность в секундах)
+SYNTHETIC_FIXTURES = [
+    ("synthetic_voice_short", "voice", 5),
+    ("synthetic_voice_medium", "voice", 30),
+    ("synthetic_voice_long", "voice", 120),
+    ("synthetic_video_note", "video_note", 20),
+]
+
+
+def _run_ffmpeg(args: list[str]) -> None:
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", *args],
+        check=True,
+    )
+
+
+def _synthesize_speech(text: str, wav_path: str) -> bool:
+    """Синтезировать речь через espeak-ng. Возвращает False, если синтезатора нет."""
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    if not espeak:
+        return False
+    subprocess.run([espeak, "-v", "ru", "-s", "150", "-w", wav_path, text], check=True)
+    return True
+
+
+def generate_corpus(corpus_dir: str) -> None:
+    """
+    Сгенерировать синтетические фикстуры и добавить их в manifest.json.
+    Если espeak-ng не установлен, вместо речи используется тональный сигнал
+    с шумом, и WER для таких фикстур не считается.
+    """
+    if not shutil.which("ffmpeg"):
+        sys.exit("Для генерации корпуса нужен ffmpeg.")
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest = _load_manifest(corpus_dir)
+    entries = {entry["file"]: entry for entry in manifest}
+
+    for index, (name, file_type, seconds) in enumerate(SYNTHETIC_FIXTURES):
+        wav_path = os.path.join(corpus_dir, f"{name}.wav")
+        words_needed = max(1, seconds * 2)
+        phrases = []
+        while sum(len(p.split()) for p in phrases) < words_needed:
+            phrases.append(SYNTHETIC_PHRASES[(index + len(phrases)) % len(SYNTHETIC_PHRASES)])
+        reference = " ".join(phrases)
+
+        if not _synthesize_speech(reference, wav_path):
+            reference = None
+            _run_ffmpeg(
+                [
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-f", "lavfi", "-i", f"anoisesrc=amplitude=0.05:duration={seconds}:seed={index}",
+                    "-filter_complex", "amix=inputs=2", "-ar", "16000", "-ac", "1", wav_path,
+                ]
+            )
+
+        if file_type == "voice":
+            file_name = f"{name}.ogg"
+            _run_ffmpeg(["-i", wav_path, "-c:a", "libopus", "-b:a", "32k", os.path.join(corpus_dir, file_name)])
+        else:
+            file_name = f"{name}.mp4"
+            _run_ffmpeg(
+                [
+                    "-f", "lavfi", "-i", "color=c=black:s=240x240:r=25",
+                    "-i", wav_path, "-shortest",
+                    "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac",
+                    os.path.join(corpus_dir, file_name),
+                ]
+            )
+        os.remove(wav_path)
+        entries[file_name] = {
+            "file": file_name,
+            "file_type": file_type,
+            "language": "ru",
+            "reference": reference,
+            "synthetic": True,
+        }
+        print(f"Сгенерирован {file_name}")
+
+    with open(os.path.join(corpus_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(sorted(entries.values(), key=lambda e: e["file"]), f, ensure_ascii=False, indent=2)
+
+
+def _load_manifest(corpus_dir: str) -> list[dict]:
+    path = os.path.join(corpus_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _normalize_words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower().replace("ё", "е"))
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """WER = расстояние Левенштейна по словам / число слов эталона."""
+    ref = _normalize_words(reference)
+    hyp = _normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _peak_rss_mb() -> tuple[float, float]:
+    """Пиковый RSS процесса и его дочерних процессов (ffmpeg) в МБ."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return own / scale, children / scale
+
+
+def run_cell(corpus_dir: str, repeat: int, warmup: bool) -> dict:
+    """Прогнать корпус в текущем процессе с параметрами из окружения."""
+    sys.path.insert(0, APP_DIR)
+    load_start = time.perf_counter()
+    import stt_processor
+    from faster_whisper import decode_audio
+
+    model_load_seconds = time.perf_counter() - load_start
+    if stt_processor.model is None:
+        raise SystemExit("Модель Whisper не загрузилась, замеры не имеют смысла.")
+    manifest = _load_manifest(corpus_dir)
+    if not manifest:
+        raise SystemExit(f"Корпус {corpus_dir} пуст, запустите generate.")
+
+    if warmup:
+        first = manifest[0]
+        stt_processor.transcribe_media_sync(
+            os.path.join(corpus_dir, first["file"]), first["file_type"], first.get("language", "ru")
+        )
+
+    files = []
+    latencies = []
+    total_audio = 0.0
+    total_processing = 0.0
+    for entry in manifest:
+        path = os.path.join(corpus_dir, entry["file"])
+        audio_seconds = len(decode_audio(path)) / 16000
+        runs = []
+        text = ""
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = stt_processor.transcribe_media_sync(
+                path, entry["file_type"], entry.get("language", "ru")
+            )
+            runs.append(time.perf_counter() - start)
+            text = result["text"] if result else ""
+        latencies.extend(runs)
+        total_audio += audio_seconds * repeat
+        total_processing += sum(runs)
+        reference = entry.get("reference")
+        files.append(
+            {
+                "file": entry["file"],
+                "file_type": entry["file_type"],
+                "audio_seconds": round(audio_seconds, 3),
+                "latency_p50": round(statistics.median(runs), 4),
+                "rtf": round(statistics.median(runs) / audio_seconds, 4) if audio_seconds else None,
+                "wer": round(word_error_rate(reference, text or ""), 4) if reference else None,
+            }
+        )
+
+    wers = [f["wer"] for f in files if f["wer"] is not None]
+    own_rss, children_rss = _peak_rss_mb()
+    return {
+        "model_load_seconds": round(model_load_seconds, 3),
+        "rtf": round(total_processing / total_audio, 4) if total_audio else None,
+        "latency_p50": round(_percentile(latencies, 0.5), 4),
+        "latency_p95": round(_percentile(latencies, 0.95), 4),
+        "wer": round(statistics.mean(wers), 4) if wers else None,
+        "peak_rss_mb": round(own_rss, 1),
+        "peak_rss_children_mb": round(children_rss, 1),
+        "files": files,
+    }
+
+
+def _parse_matrix(params: list[str]) -> list[dict[str, str]]:
+    axes = {}
+    for param in params:
+        name, _, values = param.partition("=")
+        if name not in MATRIX_PARAMS or not values:
+            raise SystemExit(f"Неверный параметр матрицы: {param}. Допустимые: {', '.join(MATRIX_PARAMS)}")
+        axes[name] = values.split(",")
+    names = list(axes)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(axes[n] for n in names))]
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_matrix(corpus_dir: str, params: list[str], repeat: int, warmup: bool, output: str | None) -> None:
+    """Прогнать каждую комбинацию параметров в отдельном процессе (чистый RSS и загрузка модели)."""
+    results = []
+    for overrides in _parse_matrix(params) or [{}]:
+        config = {name: os.getenv(name) for name in MATRIX_PARAMS if os.getenv(name)}
+        config.update(overrides)
+        print(f"Конфигурация: {config or 'по умолчанию'}", flush=True)
+        cmd = [sys.executable, os.path.abspath(__file__), "_cell", "--corpus", corpus_dir, "--repeat", str(repeat)]
+        if not warmup:
+            cmd.append("--no-warmup")
+        completed = subprocess.run(
+            cmd, env={**os.environ, **overrides}, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            raise SystemExit(f"Прогон конфигурации {config} завершился с ошибкой.")
+        metrics = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(
+            f"  RTF={metrics['rtf']} p50={metrics['latency_p50']}s p95={metrics['latency_p95']}s "
+            f"WER={metrics['wer']} RSS={metrics['peak_rss_mb']}MB",
+            flush=True,
+        )
+        results.append({"config": config, "metrics": metrics})
+
+    revision = _git_revision()
+    report = {
+        "revision": revision,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "corpus": os.path.relpath(corpus_dir),
+        "repeat": repeat,
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"{revision or 'local'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {output}")
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """Сравнить два отчёта. Возвращает 1, если есть регрессия больше threshold."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {json.dumps(r["config"], sort_keys=True): r["metrics"] for r in json.load(f)["results"]}
+    with open(current_path, encoding="utf-8") as f:
+        current = {json.dumps(r["config"], sort_keys=True): r["metrics"] for r in json.load(f)["results"]}
+
+    regressions = 0
+    for key, metrics in current.items():
+        old = baseline.get(key)
+        if old is None:
+            print(f"{key}: нет в базовом отчёте")
+            continue
+        print(key)
+        for name in ("rtf", "latency_p50", "latency_p95", "peak_rss_mb", "wer"):
+            before, after = old.get(name), metrics.get(name)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            marker = ""
+            # Для WER сравниваем абсолютную разницу: базовое значение бывает нулевым
+            regressed = (after - before > threshold) if name == "wer" else (change > threshold)
+            if regressed:
+                marker = "  <-- регрессия"
+                regressions += 1
+            print(f"  {name}: {before} -> {after} ({change:+.1%}){marker}")
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк STT")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gen = subparsers.add_parser("generate", help="Сгенерировать синтетические фикстуры")
+    gen.add_argument("--corpus", default=DEFAULT_CORPUS)
+
+    run = subparsers.add_parser("run", help="Прогнать корпус по матрице параметров")
+    run.add_argument("--corpus", default=DEFAULT_CORPUS)
+    run.add_argument("--param", action="append", default=[], help="ИМЯ=знач1,знач2 (можно несколько)")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--no-warmup", action="store_true")
+    run.add_argument("--output")
+
+    cell = subparsers.add_parser("_cell")
+    cell.add_argument("--corpus", default=DEFAULT_CORPUS)
+    cell.add_argument("--repeat", type=int, default=3)
+    cell.add_argument("--no-warmup", action="store_true")
+
+    cmp_parser = subparsers.add_parser("compare", help="Сравнить два отчёта")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate_corpus(args.corpus)
+    elif args.command == "run":
+        run_matrix(args.corpus, args.param, args.repeat, not args.no_warmup, args.output)
+    elif args.command == "_cell":
+        metrics = run_cell(args.corpus, args.repeat, not args.no_warmup)
+        # Последняя строка stdout читается родительским процессом
+        print(json.dumps(metrics))
+    elif args.command == "compare":
+        sys.exit(compare(args.baseline, args.current, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import stat
+import zipfile
+
+import pytest
+
+import bulk
+
+
+def _make_zip(path, entries):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_extracts_media_under_generated_names(tmp_path):
+    link = zipfile.ZipInfo("link.mp3")
+    link.external_attr = (stat.S_IFLNK | 0o777) << 16
+    zip_path = _make_zip(
+        tmp_path / "in.zip",
+        [
+            ("chat/voice.ogg", b"ogg"),
+            ("../../evil.mp3", b"mp3"),
+            ("/abs/clip.MP4", b"mp4"),
+            (link, "/etc/passwd"),
+            ("notes.txt", b"text"),
+            ("__MACOSX/chat/._voice.ogg", b"meta"),
+            ("folder/", b""),
+        ],
+    )
+    dest = tmp_path / "out"
+
+    items = bulk.extract_archive(zip_path, str(dest))
+
+    assert [(item.name, item.file_type) for item in items] == [
+        ("chat/voice.ogg", "audio"),
+        ("../../evil.mp3", "audio"),
+        ("/abs/clip.MP4", "video"),
+    ]
+    assert sorted(os.listdir(dest)) == ["00000.ogg", "00001.mp3", "00002.mp4"]
+    for item in items:
+        assert os.path.dirname(item.path) == str(dest)
+    with open(items[1].path, "rb") as f:
+        assert f.read() == b"mp3"
+    assert not (tmp_path / "evil.mp3").exists()
+
+
+def test_rejects_too_many_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_MAX_FILES", 2)
+    zip_path = _make_zip(tmp_path / "in.zip", [(f"{i}.ogg", b"x") for i in range(3)])
+
+    with pytest.raises(bulk.ArchiveError):
+        bulk.extract_archive(zip_path, str(tmp_path / "out"))
+
+
+def test_unpacked_size_is_limited_by_written_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_MAX_UNPACKED_MB", 1)
+    # Сжимается почти до нуля: предел проверяется по распакованным байтам
+    zip_path = str(tmp_path / "bomb.zip")
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("big.wav", b"\0" * (2 * 1024 * 1024))
+
+    with pytest.raises(bulk.ArchiveError):
+        bulk.extract_archive(zip_path, str(tmp_path / "out"))
+
+
+def test_damaged_archive(tmp_path):
+    zip_path = tmp_path / "bad.zip"
+    zip_path.write_bytes(b"not a zip")
+
+    with pytest.raises(bulk.ArchiveError):
+        bulk.extract_archive(str(zip_path), str(tmp_path / "out"))
+
+
+def test_corrupt_member_data(tmp_path):
+    zip_path = tmp_path / "corrupt.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("voice.ogg", os.urandom(4096))
+    data = bytearray(zip_path.read_bytes())
+    # Портим сжатые данные первого файла сразу после локального заголовка
+    offset = 30 + len("voice.ogg")
+    data[offset : offset + 64] = b"\xff" * 64
+    zip_path.write_bytes(bytes(data))
+
+    with pytest.raises(bulk.ArchiveError):
+        bulk.extract_archive(str(zip_path), str(tmp_path / "out"))
+
+
+def test_unsupported_compression_method(tmp_path):
+    zip_path = tmp_path / "method.zip"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        archive.writestr("voice.ogg", b"ogg")
+    data = bytearray(zip_path.read_bytes())
+    # Метод сжатия 99 (AES) в локальном и центральном заголовках
+    for signature, offset in ((b"PK\x03\x04", 8), (b"PK\x01\x02", 10)):
+        position = data.index(signature) + offset
+        data[position : position + 2] = (99).to_bytes(2, "little")
+    zip_path.write_bytes(bytes(data))
+
+    with pytest.raises(bulk.ArchiveError):
+        bulk.extract_archive(str(zip_path), str(tmp_path / "out"))
+
+
+def test_format_transcript_marks_failed_files():
+    text = bulk.format_transcript([("a.ogg", "привет"), ("b.ogg", None)])
+
+    assert text == "=== a.ogg ===\nпривет\n\n=== b.ogg ===\n[не удалось распознать]\n"
@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+import pytest
+
+import checkpoints
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.setattr(checkpoints, "CHECKPOINT_STALE_SECONDS", 60)
+    return tmp_path
+
+
+def _write_checkpoint(job_id: str, age: float) -> str:
+    path = checkpoints._path(job_id)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"job": {"args": [job_id]}, "segments": []}, f)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_fresh_checkpoint_is_not_claimed(checkpoint_dir):
+    path = _write_checkpoint("live", age=1)
+    inode = os.stat(path).st_ino
+    enqueued = []
+
+    assert checkpoints.recover(lambda job_id, job: enqueued.append(job_id)) == 0
+    assert enqueued == []
+    # Файл живой задачи не переименовывался
+    assert os.listdir(checkpoint_dir) == ["live.json"]
+    assert os.stat(path).st_ino == inode
+
+
+def test_stale_checkpoint_is_recovered_once(checkpoint_dir):
+    path = _write_checkpoint("dead", age=600)
+    enqueued = []
+
+    assert checkpoints.recover(lambda job_id, job: enqueued.append((job_id, job))) == 1
+    assert enqueued == [("dead", {"args": ["dead"]})]
+    assert os.listdir(checkpoint_dir) == ["dead.json"]
+    # mtime обновлён: повторный проход не забирает задачу снова
+    assert time.time() - os.path.getmtime(path) < 60
+    assert checkpoints.recover(lambda job_id, job: enqueued.append((job_id, job))) == 0
+    assert len(enqueued) == 1
+
+
+def test_unreadable_stale_checkpoint_is_removed(checkpoint_dir):
+    path = checkpoints._path("broken")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+    os.utime(path, (time.time() - 600, time.time() - 600))
+
+    assert checkpoints.recover(lambda job_id, job: None) == 0
+    assert os.listdir(checkpoint_dir) == []
+
+
+def test_embedded_checkpoints_are_not_recovered(checkpoint_dir):
+    job_id = checkpoints.embedded_job_id()
+    with checkpoints.track(job_id, {"args": []}):
+        pass
+    old = time.time() - 600
+    os.utime(checkpoints._path(job_id), (old, old))
+
+    assert checkpoints.recover(lambda job_id, job: None) == 0
+    assert checkpoints.progress(job_id) is not None
+    checkpoints.clear_embedded()
+    assert checkpoints.progress(job_id) is None
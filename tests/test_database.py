@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_name = str(tmp_path / "bot.db")
+    database.init_db(db_name)
+    yield db_name
+    database.close_db()
+
+
+def _add_tasks(db_name, user_id, texts):
+    stats = {"audio_duration": 2.0, "decode_seconds": 0.5, "inference_seconds": 0.5}
+    database.record_tasks_metadata(
+        db_name,
+        [
+            database.make_task_record(user_id, 1.0 + len(text) / 10, "voice", text, stats)
+            for text in texts
+        ],
+    )
+
+
+def test_search_pages_by_relevance(db):
+    # Чем чаще слово в коротком тексте, тем выше bm25; одинаковые тексты — новые раньше
+    _add_tasks(db, 1, ["отчёт", "вчера был длинный день и отчёт", "отчёт отчёт отчёт", "отчёт"])
+    _add_tasks(db, 1, ["прочее"])
+    _add_tasks(db, 2, ["отчёт отчёт отчёт отчёт"])
+
+    pages = []
+    cursor = None
+    while True:
+        rows, cursor = database.search_transcripts(db, 1, "отчёт", limit=2, after=cursor)
+        pages.append([task_id for task_id, _, _ in rows])
+        if cursor is None:
+            break
+
+    assert pages == [[3, 4], [1, 2]]
+
+
+def test_search_is_limited_to_own_transcripts(db):
+    _add_tasks(db, 1, ["мой текст"])
+    _add_tasks(db, 2, ["чужой текст u1"])
+
+    rows, _ = database.search_transcripts(db, 1, "текст")
+    assert [task_id for task_id, _, _ in rows] == [1]
+    # Служебная колонка владельца не ищется как текст
+    assert [task_id for task_id, _, _ in database.search_transcripts(db, 2, "u1")[0]] == [2]
+    assert database.search_transcripts(db, 1, "u2") == ([], None)
+
+
+def test_search_matches_prefixes_and_ignores_fts_syntax(db):
+    _add_tasks(db, 1, ["распознавание речи"])
+
+    rows, cursor = database.search_transcripts(db, 1, 'распозна"*)')
+    assert [task_id for task_id, _, _ in rows] == [1]
+    assert cursor is None
+    assert database.search_transcripts(db, 1, "***") == ([], None)
+
+
+def test_compressed_transcripts_stay_searchable(db):
+    _add_tasks(db, 1, ["старая запись", "новая запись"])
+
+    assert database.compress_old_transcripts(db, datetime.now() + timedelta(days=1), 10) == 2
+
+    rows, _ = database.search_transcripts(db, 1, "старая")
+    assert [(task_id, snippet) for task_id, _, snippet in rows] == [(1, "[старая] запись")]
+    assert database.get_transcript(db, None, 1, 2) == "новая запись"
+
+
+def test_backfill_counts_archived_tasks(db, tmp_path):
+    archive = str(tmp_path / "archive.db")
+    _add_tasks(db, 1, ["a" * i for i in range(1, 5)])
+    _add_tasks(db, 2, ["b" * i for i in range(1, 9)])
+    before = database.get_bot_stats(db)
+    assert before["today_requests"] == 12
+
+    database.init_archive_db(archive)
+    assert database.archive_old_tasks(db, archive, datetime.now() + timedelta(days=1), 5) == 5
+    database.backfill_stats(db, archive)
+
+    assert database.get_bot_stats(db) == before
+    # Архивированные задачи не ищутся, но читаются по номеру
+    assert database.get_transcript(db, archive, 1, 2) == "aa"
+
+
+def test_language_profile_reads_stats_only_in_auto_mode(db):
+    database.add_user(db, 1)
+    stats = {"audio_duration": 2.0, "language": "en", "language_detected": True}
+    database.record_tasks_metadata(
+        db, [database.make_task_record(1, 1.0, "voice", "hello", stats) for _ in range(3)]
+    )
+
+    assert database.get_language_profile(db, 1) == (None, {})
+    database.set_user_language(db, 1, "auto")
+    assert database.get_language_profile(db, 1) == ("auto", {"en": 3})
+    database.set_user_language(db, 1, "ru")
+    assert database.get_language_profile(db, 1) == ("ru", {})
@@ -0,0 +1,84 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from status_updates import StatusUpdater
+
+
+class FakeMessage:
+    chat_id = 1
+    message_id = 10
+
+    def __init__(self, fail_first: bool = False):
+        self.sent: list[str] = []
+        self.fail_first = fail_first
+        self.in_flight = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def edit_text(self, text, **kwargs):
+        if self.fail_first:
+            self.fail_first = False
+            self.in_flight.set()
+            await self.release.wait()
+            raise RetryAfter(0)
+        self.sent.append(text)
+
+
+def test_pending_edits_are_coalesced():
+    async def scenario():
+        updater = StatusUpdater(global_rate=100, chat_rate=100, chat_burst=100)
+        updater.start()
+        message = FakeMessage()
+        for text in ("A", "B", "C"):
+            updater.edit(message, text)
+        await asyncio.sleep(0.05)
+        await updater.close()
+        return message.sent
+
+    assert asyncio.run(scenario()) == ["C"]
+
+
+def test_retry_after_keeps_newer_pending_edit():
+    async def scenario():
+        updater = StatusUpdater(global_rate=100, chat_rate=100, chat_burst=100)
+        updater.start()
+        message = FakeMessage(fail_first=True)
+        updater.edit(message, "A")
+        await message.in_flight.wait()
+        # Правка B запрошена, пока A выполняется и затем получает RetryAfter
+        updater.edit(message, "B")
+        message.release.set()
+        await asyncio.sleep(0.05)
+        await updater.close()
+        return message.sent
+
+    assert asyncio.run(scenario()) == ["B"]
+
+
+def test_retry_after_resends_edit_without_newer_one():
+    async def scenario():
+        updater = StatusUpdater(global_rate=100, chat_rate=100, chat_burst=100)
+        updater.start()
+        message = FakeMessage(fail_first=True)
+        updater.edit(message, "A")
+        await message.in_flight.wait()
+        message.release.set()
+        await asyncio.sleep(0.05)
+        await updater.close()
+        return message.sent
+
+    assert asyncio.run(scenario()) == ["A"]
+
+
+def test_edit_without_scheduler_is_tracked_until_done():
+    async def scenario():
+        updater = StatusUpdater()
+        message = FakeMessage()
+        updater.edit(message, "A")
+        assert len(updater._inflight) == 1
+        await updater.close()
+        return message.sent, updater._inflight
+
+    sent, inflight = asyncio.run(scenario())
+    assert sent == ["A"]
+    assert not inflight